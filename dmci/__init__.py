@@ -85,3 +85,30 @@ def api_main():
     sys.exit(dmci_app.run())
 
 # END api_main entry point
+
+
+def migrate_main():
+    """This is the main entry point for the archive migration tool. It
+    moves the files in the file archive to the folder layout set in the
+    config, and can be run while the api is running.
+    """
+    from dmci.distributors.file_manifest import get_file_manifest
+    from dmci.distributors.file_shards import ShardLayout, migrate_archive
+
+    if not CONFIG.readConfig(configFile=os.environ.get("DMCI_CONFIG", None)):
+        sys.exit(1)
+
+    if CONFIG.file_archive_path is None:
+        logger.error("No 'file_archive_path' set")
+        sys.exit(1)
+
+    manifest = None
+    if CONFIG.file_manifest:
+        manifest = get_file_manifest(CONFIG.file_manifest_path, CONFIG.file_durability)
+
+    _, failed = migrate_archive(
+        CONFIG.file_archive_path, ShardLayout.from_config(CONFIG), manifest=manifest
+    )
+    sys.exit(1 if failed else 0)
+
+# END migrate_main entry point
@@ -17,26 +17,49 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import io
 import logging
 import os
 import sys
 import uuid
 import shutil
+import tarfile
+import zipfile
+import tempfile
+import threading
 
-from flask import Flask, request
-from lxml import etree
+from flask import Flask, request, jsonify
 
 import dmci
+from dmci.api.digest_index import DigestIndex
+from dmci.api.job_queue import JobQueue
+from dmci.api.journal import Journal
 from dmci.api.worker import Worker
+from dmci.distributors.file_manifest import get_file_manifest, start_manifest_rebuild
+from dmci.tools import SchemaPool
 from prometheus_client import Counter
 
 logger = logging.getLogger(__name__)
 
 OK_RETURN = "Everything is OK"
+UNCHANGED_RETURN = "Unchanged, the document is identical to the last one distributed"
 
 FILE_DIST_FAIL = Counter("failed_file_dist", "Number of failed file_dist", ["path"])
 CSW_DIST_FAIL = Counter("failed_pycsw_dist", "Number of failed csw_dist", ["path"])
 SOLR_DIST_FAIL = Counter("failed_solr_dist", "Number of failed solr_dist", ["path"])
+UNCHANGED_SKIPPED = Counter(
+    "skipped_unchanged", "Number of unchanged updates that were not distributed", ["path"]
+)
+
+# Seconds a job runner waits before it looks for jobs queued by other
+# processes
+JOB_POLL_INTERVAL = 5.0
+
+# Bytes read at a time when a request body is written to the cache
+STREAM_CHUNK_SIZE = 65536
+
+# The first bytes of a zip archive, or of an empty one
+ZIP_MAGIC = (b"PK\x03\x04", b"PK\x05\x06")
 
 
 class App(Flask):
@@ -57,9 +80,9 @@ class App(Flask):
             logger.error("Parameter path_to_parent_list in config is not set")
             sys.exit(1)
 
-        # Create the XML Validator Object
+        # Create the XML Validator Object, with one schema per thread
         try:
-            self._xsd_obj = etree.XMLSchema(etree.parse(self._conf.mmd_xsd_path))
+            self._xsd_obj = SchemaPool(self._conf.mmd_xsd_path)
         except Exception as e:
             logger.critical(
                 "XML Schema could not be parsed: %s" % str(self._conf.mmd_xsd_path)
@@ -67,6 +90,44 @@ class App(Flask):
             logger.critical(str(e))
             sys.exit(1)
 
+        # Set up the index of distributed documents
+        self._digests = None
+        if self._conf.skip_unchanged:
+            index_path = os.path.join(self._conf.distributor_cache, "digests")
+            try:
+                self._digests = DigestIndex(index_path)
+            except Exception as e:
+                logger.critical("Could not set up the digest index: %s" % index_path)
+                logger.critical(str(e))
+                sys.exit(1)
+
+        # Set up the journal of jobs being distributed
+        self._journal = None
+        if self._conf.distribution_journal:
+            journal_path = os.path.join(self._conf.distributor_cache, "journal")
+            try:
+                self._journal = Journal(
+                    journal_path, ttl=self._conf.journal_ttl,
+                    rejected_path=self._conf.rejected_jobs_path,
+                )
+            except Exception as e:
+                logger.critical("Could not set up the journal: %s" % journal_path)
+                logger.critical(str(e))
+                sys.exit(1)
+
+        # Set up the job queue for async mode
+        self._job_queue = None
+        if self._conf.async_mode:
+            self._start_job_runners()
+
+        # Resume jobs interrupted by a stopped process
+        if self._journal is not None:
+            self._start_journal_recovery()
+
+        # Fill the archive manifest if it is not complete
+        if "file" in self._conf.call_distributors:
+            self._start_manifest_rebuild()
+
         # Set up api entry points
         @self.route("/v1/create", methods=["POST"])
         @self.route("/v1/insert", methods=["POST"])
@@ -74,12 +135,7 @@ class App(Flask):
             msg, code, failed = self._insert_update_method_post("insert", request)
             if failed:
                 logger.info(f"failed {failed}")
-                if "file" in failed:
-                    FILE_DIST_FAIL.labels(path=request.path).inc()
-                if "pycsw" in failed:
-                    CSW_DIST_FAIL.labels(path=request.path).inc()
-                if "solr" in failed:
-                    SOLR_DIST_FAIL.labels(path=request.path).inc()
+                self._count_failed(failed, request.path)
             return self._formatMsgReturn(msg), code
 
         @self.route("/v1/update", methods=["POST"])
@@ -87,12 +143,7 @@ class App(Flask):
             msg, code, failed = self._insert_update_method_post("update", request)
             logger.info(f"failed {failed}")
             if failed:
-                if "file" in failed:
-                    FILE_DIST_FAIL.labels(path=request.path).inc()
-                if "pycsw" in failed:
-                    CSW_DIST_FAIL.labels(path=request.path).inc()
-                if "solr" in failed:
-                    SOLR_DIST_FAIL.labels(path=request.path).inc()
+                self._count_failed(failed, request.path)
             return self._formatMsgReturn(msg), code
 
         @self.route("/v1/delete/<metadata_id>", methods=["POST"])
@@ -120,6 +171,7 @@ class App(Flask):
             if err:
                 return self._formatMsgReturn(err), 500
             else:
+                self._forget_digest(f"{md_namespace}:{md_uuid}")
                 return self._formatMsgReturn(OK_RETURN), 200
 
         @self.route("/v1/validate", methods=["POST"])
@@ -128,6 +180,33 @@ class App(Flask):
             msg, code = self._validate_method_post(request)
             return self._formatMsgReturn(msg), code
 
+        @self.route("/v1/bulk/<cmd>", methods=["POST"])
+        def post_bulk(cmd=None):
+            """Process bulk insert, update or validate commands."""
+            if cmd not in ("insert", "update", "validate"):
+                return self._formatMsgReturn(f"Unknown bulk command: {cmd}"), 404
+            msg, code, result = self._bulk_method_post(cmd, request)
+            if result is None:
+                return self._formatMsgReturn(msg), code
+            return jsonify(result), code
+
+        @self.route("/v1/jobs/<job_id>", methods=["GET"])
+        def get_job(job_id=None):
+            """Report the status of an async job."""
+            if self._job_queue is None:
+                return self._formatMsgReturn("Async mode is not enabled"), 404
+            try:
+                job_id = str(uuid.UUID(job_id))
+            except ValueError:
+                return self._formatMsgReturn(f"Cannot convert to UUID: {job_id}"), 400
+
+            job = self._job_queue.status(job_id)
+            if job is None:
+                return self._formatMsgReturn(f"Unknown job: {job_id}"), 404
+
+            job.pop("file", None)
+            return jsonify(job), 200
+
         return
 
     ##
@@ -146,95 +225,452 @@ class App(Flask):
         return fmtMsg.rstrip() + "\n"
 
     def _insert_update_method_post(self, cmd, request):
-        """Process insert or update command requests."""
-        if request.content_length is None:
+        """Process insert or update command requests. The request body
+        is written to the cache as it is read, and is validated from
+        there.
+        """
+        if request.content_length is None and not self._is_chunked(request):
             return "There is no data sent to the api", 202, None
-        if request.content_length > self._conf.max_permitted_size:
+        if (request.content_length or 0) > self._conf.max_permitted_size:
             return (
                 f"The file is larger than maximum size: {self._conf.max_permitted_size}",
                 413,
                 None,
             )
 
-        data = request.get_data()
-
         # Cache the job file
         file_uuid = uuid.uuid4()
-        full_path = os.path.join(self._conf.distributor_cache, f"{file_uuid}.xml")
-        reject_path = os.path.join(self._conf.rejected_jobs_path, f"{file_uuid}.xml")
-        msg, code = self._persist_file(data, full_path)
+        full_path, reject_path = self._job_paths(file_uuid)
+        hasher = DigestIndex.new_hasher() if self._digests is not None else None
+        msg, code = self._stream_to_file(
+            request.stream, full_path, self._conf.max_permitted_size, hasher=hasher
+        )
         if code != 200:
             return msg, code, None
 
-        # Run the validator
-        worker = Worker(
-            cmd,
-            full_path,
-            self._xsd_obj,
-            path_to_parent_list=self._conf.path_to_parent_list,
-        )
-        valid, msg, data_ = worker.validate(data)
-        if not valid:
-            msg += f"\n Rejected persistent file : {file_uuid}.xml \n "
-            self._handle_persist_file(False, full_path, reject_path, msg)
-            return msg, 400, None
+        # Skip updates that are identical to the last distributed one
+        digest = hasher.hexdigest() if hasher is not None else None
+        if cmd == "update" and self._is_unchanged(digest, request.path):
+            self._handle_persist_file(True, full_path)
+            return UNCHANGED_RETURN, 200, None
 
-        # Check if the data from the request was modified in worker.validate().
-        # If so we will need to write the modified data to disk.
-        if not data == data_:
-            msg, code = self._persist_file(data_, full_path)
-            if code != 200:
-                return msg, code, None
+        # Validate the job file
+        worker, msg, code = self._validate_cached_job(cmd, file_uuid)
+        if worker is None:
+            return msg, code, None
+
+        # In async mode, the distributors are run by the job runners
+        if self._job_queue is not None:
+            msg, code = self._queue_job(cmd, file_uuid, digest=digest)
+            return msg, code, None
 
         # Run the distributors
+        self._begin_journal(str(file_uuid), cmd, full_path, digest)
+        self._forget_job_digest(worker)
         err, failed = self._distributor_wrapper(worker)
 
         if err:
             msg = "\n".join(err)
-            self._handle_persist_file(False, full_path, reject_path, msg)
+            self._release_job_file(worker, str(file_uuid), False, full_path, reject_path, msg)
             return msg, 500, failed
         else:
-            self._handle_persist_file(True, full_path)
+            self._record_digest(worker, digest)
+            self._release_job_file(worker, str(file_uuid), True, full_path)
             return OK_RETURN, 200, None
 
-    def _validate_method_post(self, request):
-        """Only run the validator for submitted file."""
-        if request.content_length > self._conf.max_permitted_size:
+    def _bulk_method_post(self, cmd, request):
+        """Process bulk insert, update or validate command requests.
+        Each document is validated on its own, and for insert and
+        update the valid documents are sent to the distributors in
+        batches.
+        """
+        if request.content_length is None:
+            return "There is no data sent to the api", 400, None
+        if request.content_length > self._conf.max_bulk_size:
             return (
-                f"The file is larger than maximum size: {self._conf.max_permitted_size}",
+                f"The request is larger than maximum size: {self._conf.max_bulk_size}",
                 413,
+                None,
             )
 
-        data = request.get_data()
+        if cmd == "validate":
+            entries, msg, code = self._validate_bulk_documents(request)
+            if code != 200:
+                return msg, code, None
+            return self._bulk_result(entries)
 
-        # Cache the job file
-        file_uuid = uuid.uuid4()
-        full_path = os.path.join(self._conf.distributor_cache, f"{file_uuid}.xml")
-        msg, code = self._persist_file(data, full_path)
+        docs, msg, code = self._read_bulk_documents(request)
         if code != 200:
-            self._handle_persist_file(True, full_path)
-            return msg, code
+            return msg, code, None
+
+        entries = []
+        to_distribute = []
+        for name, file_uuid, digest in docs:
+            entry = {"name": name}
+            entries.append(entry)
+            if file_uuid is None:
+                entry["status"] = "rejected"
+                entry["message"] = (
+                    f"The file is larger than maximum size: {self._conf.max_permitted_size}"
+                )
+                continue
+
+            full_path, _ = self._job_paths(file_uuid)
+            if cmd == "update" and self._is_unchanged(digest, request.path):
+                self._handle_persist_file(True, full_path)
+                entry["status"] = "unchanged"
+                entry["message"] = UNCHANGED_RETURN
+                continue
+
+            worker, msg, code = self._validate_cached_job(cmd, file_uuid)
+            if worker is None:
+                entry["status"] = "rejected" if code == 400 else "failed"
+                entry["message"] = msg
+                continue
+            if worker._file_metadata_id is not None:
+                entry["metadata_id"] = f"{worker._namespace}:{worker._file_metadata_id}"
+
+            if self._job_queue is not None:
+                msg, code = self._queue_job(cmd, file_uuid, digest=digest)
+                entry["status"] = "queued" if code == 202 else "failed"
+                entry["message"] = msg
+                if code == 202:
+                    entry["job"] = str(file_uuid)
+                continue
+
+            to_distribute.append((entry, worker, file_uuid, digest))
+
+        size = max(self._conf.bulk_batch_size, 1)
+        for first in range(0, len(to_distribute), size):
+            batch = to_distribute[first:first + size]
+            for _, worker, file_uuid, digest in batch:
+                full_path, _ = self._job_paths(file_uuid)
+                self._begin_journal(str(file_uuid), cmd, full_path, digest)
+                self._forget_job_digest(worker)
+            results = Worker.distribute_batch([worker for _, worker, _, _ in batch])
+            for (entry, worker, file_uuid, digest), result in zip(batch, results):
+                full_path, reject_path = self._job_paths(file_uuid)
+                summary = {}
+                err, failed = self._distributor_wrapper(worker, summary=summary, result=result)
+                entry["distributors"] = summary
+                job_id = str(file_uuid)
+                if err:
+                    entry["status"] = "failed"
+                    entry["message"] = "\n".join(err)
+                    self._count_failed(failed, request.path)
+                    self._release_job_file(
+                        worker, job_id, False, full_path, reject_path, entry["message"]
+                    )
+                else:
+                    entry["status"] = "ok"
+                    self._record_digest(worker, digest)
+                    self._release_job_file(worker, job_id, True, full_path)
+
+        return self._bulk_result(entries)
+
+    @staticmethod
+    def _bulk_result(entries):
+        """Return the response of a bulk request from the result of
+        each document.
+        """
+        n_ok = sum(entry["status"] in ("ok", "queued", "unchanged") for entry in entries)
+        result = {
+            "total": len(entries),
+            "ok": n_ok,
+            "failed": len(entries) - n_ok,
+            "documents": entries,
+        }
+        return OK_RETURN, 200 if n_ok == len(entries) else 207, result
+
+    def _validate_method_post(self, request):
+        """Only run the validator for submitted file. Nothing is
+        written to disk, so the validation runs in memory.
+        """
+        too_large = (
+            f"The file is larger than maximum size: {self._conf.max_permitted_size}",
+            413,
+        )
+        if (request.content_length or 0) > self._conf.max_permitted_size:
+            return too_large
+
+        data = self._read_body(request.stream, self._conf.max_permitted_size)
+        if data is None:
+            return too_large
 
         # Run the validator
-        worker = Worker(
+        valid, msg, _ = self._make_validator().validate(data)
+        if valid:
+            return OK_RETURN, 200
+        else:
+            return msg, 400
+
+    def _make_validator(self):
+        """Return a worker that is only used to validate documents."""
+        return Worker(
             "none",
+            None,
+            self._xsd_obj,
+            path_to_parent_list=self._conf.path_to_parent_list,
+        )
+
+    def _validate_cached_job(self, cmd, file_uuid):
+        """Run the validator on a cached job file. If the data is
+        modified by the validator, the cached file is updated.
+
+        Returns
+        -------
+        worker : Worker or None
+            The worker holding the validated job, or None if the job
+            was rejected or could not be cached
+        msg : str
+            The validation or error message
+        code : int
+            The HTTP status code of the result
+        """
+        full_path, reject_path = self._job_paths(file_uuid)
+        worker = Worker(
+            cmd,
             full_path,
             self._xsd_obj,
             path_to_parent_list=self._conf.path_to_parent_list,
+            journal=self._journal,
+            job_id=str(file_uuid),
         )
-        valid, msg, data = worker.validate(data)
-        self._handle_persist_file(True, full_path)
-        if valid:
-            return OK_RETURN, 200
+        valid, msg, data = worker.validate_file(full_path)
+        if not valid:
+            msg += f"\n Rejected persistent file : {file_uuid}.xml \n "
+            self._handle_persist_file(False, full_path, reject_path, msg)
+            return None, msg, 400
+
+        # Check if the data was modified in worker.validate_file(). If
+        # so we will need to write the modified data to disk.
+        if data is not None:
+            msg, code = self._persist_file(data, full_path)
+            if code != 200:
+                return None, msg, code
+
+        return worker, msg, 200
+
+    def _job_paths(self, file_uuid):
+        """Return the cache and rejected paths of a job file."""
+        full_path = os.path.join(self._conf.distributor_cache, f"{file_uuid}.xml")
+        reject_path = os.path.join(self._conf.rejected_jobs_path, f"{file_uuid}.xml")
+        return full_path, reject_path
+
+    def _queue_job(self, cmd, file_uuid, digest=None):
+        """Add a validated job to the async job queue."""
+        full_path, _ = self._job_paths(file_uuid)
+        try:
+            self._job_queue.submit(
+                str(file_uuid), cmd, full_path, self._conf.call_distributors, digest=digest
+            )
+        except Exception as e:
+            logger.error("Failed to queue job: %s", file_uuid)
+            logger.error(str(e))
+            return "Cannot write job to queue", 507
+        return f"Job accepted: {file_uuid}", 202
+
+    def _read_bulk_documents(self, request):
+        """Write the documents of a bulk request to job files in the
+        cache, one document at a time, so that the request is never
+        held in memory. Documents larger than max_permitted_size are
+        skipped.
+
+        Returns
+        -------
+        docs : list of tuple
+            The name, job file ID and digest of each document. The job
+            file ID is None if the document is too large, and the
+            digest is None if skip_unchanged is off.
+        msg : str
+            An error message if the body could not be read
+        code : int
+            The HTTP status code
+        """
+        max_size = self._conf.max_permitted_size
+        members, fail_msg = self._bulk_members(request)
+
+        docs = []
+        try:
+            for name, member, size in members:
+                if len(docs) >= self._conf.max_bulk_documents:
+                    self._remove_cached_documents(docs)
+                    return (
+                        [], f"The request has more than {self._conf.max_bulk_documents} documents",
+                        413,
+                    )
+                if size is not None and size > max_size:
+                    docs.append((name, None, None))
+                    continue
+
+                file_uuid = uuid.uuid4()
+                full_path, _ = self._job_paths(file_uuid)
+                hasher = DigestIndex.new_hasher() if self._digests is not None else None
+                msg, code = self._stream_to_file(member, full_path, max_size, hasher=hasher)
+                if code == 413:
+                    docs.append((name, None, None))
+                    continue
+                if code != 200:
+                    self._remove_cached_documents(docs)
+                    return [], msg, code
+                docs.append((name, file_uuid, hasher.hexdigest() if hasher else None))
+
+        except Exception as e:
+            logger.error(str(e))
+            self._remove_cached_documents(docs)
+            return [], fail_msg, 400
+
+        if not docs and request.mimetype == "multipart/form-data":
+            return [], "The multipart request has no files", 400
+
+        return docs, OK_RETURN, 200
+
+    def _validate_bulk_documents(self, request):
+        """Validate the documents of a bulk request one at a time, as
+        they are read from the request. Like a validate request, this
+        runs in memory and writes nothing to disk.
+
+        Returns
+        -------
+        entries : list of dict
+            The result of each document
+        msg : str
+            An error message if the body could not be read
+        code : int
+            The HTTP status code
+        """
+        max_size = self._conf.max_permitted_size
+        members, fail_msg = self._bulk_members(request, in_memory=True)
+
+        entries = []
+        try:
+            for name, member, size in members:
+                if len(entries) >= self._conf.max_bulk_documents:
+                    return (
+                        [], f"The request has more than {self._conf.max_bulk_documents} documents",
+                        413,
+                    )
+                entry = {"name": name}
+                entries.append(entry)
+                data = None
+                if size is None or size <= max_size:
+                    data = self._read_body(member, max_size)
+                if data is None:
+                    entry["status"] = "rejected"
+                    entry["message"] = f"The file is larger than maximum size: {max_size}"
+                    continue
+
+                worker = self._make_validator()
+                valid, entry["message"], _ = worker.validate(data)
+                entry["status"] = "ok" if valid else "rejected"
+                if worker._file_metadata_id is not None:
+                    entry["metadata_id"] = f"{worker._namespace}:{worker._file_metadata_id}"
+
+        except Exception as e:
+            logger.error(str(e))
+            return [], fail_msg, 400
+
+        if not entries and request.mimetype == "multipart/form-data":
+            return [], "The multipart request has no files", 400
+
+        return entries, OK_RETURN, 200
+
+    def _bulk_members(self, request, in_memory=False):
+        """List the documents of a bulk request. The body is either a
+        multipart form with one file per document, or a zip or tar
+        archive (optionally compressed) holding .xml files. A tar
+        archive is read from the request stream as it arrives. A zip
+        archive can only be read from its end, so it is first written
+        to a temporary file in the cache, or read into memory if
+        in_memory is set.
+
+        Returns
+        -------
+        members : iterator of tuple
+            The name, stream and size of each document. The size is
+            None if not known in advance, and the stream may be None if
+            the size is larger than max_permitted_size.
+        fail_msg : str
+            The error message if the body cannot be read
+        """
+        if request.mimetype == "multipart/form-data":
+            return self._multipart_members(request), "Could not read the multipart request"
+
+        head = request.stream.read(len(ZIP_MAGIC[0]))
+        if head in ZIP_MAGIC:
+            members = self._zip_members(head, request.stream, in_memory=in_memory)
+            return members, "Could not read the zip archive"
+
+        members = self._tar_members(head, request.stream)
+        return members, "The request must be a multipart form, or a zip or tar archive"
+
+    @staticmethod
+    def _multipart_members(request):
+        """List the files of a multipart bulk request."""
+        for key in request.files:
+            for part in request.files.getlist(key):
+                yield part.filename or key, part.stream, None
+
+    def _zip_members(self, head, stream, in_memory=False):
+        """List the .xml files of a zip archive sent as a request body,
+        where the first bytes have already been read.
+        """
+        if in_memory:
+            spool = io.BytesIO()
         else:
-            return msg, 400
+            spool = tempfile.TemporaryFile(dir=self._conf.distributor_cache)
+        with spool:
+            spool.write(head)
+            shutil.copyfileobj(stream, spool, STREAM_CHUNK_SIZE)
+            with zipfile.ZipFile(spool) as archive:
+                for info in archive.infolist():
+                    if info.is_dir() or not info.filename.lower().endswith(".xml"):
+                        continue
+                    if info.file_size > self._conf.max_permitted_size:
+                        yield info.filename, None, info.file_size
+                        continue
+                    with archive.open(info) as member:
+                        yield info.filename, member, info.file_size
 
-    def _distributor_wrapper(self, worker):
+    @staticmethod
+    def _tar_members(head, stream):
+        """List the .xml files of a tar archive sent as a request body,
+        where the first bytes have already been read. The archive is
+        read as a stream, so each file must be read before the next one
+        is listed.
+        """
+        body = PrefixedStream(head, stream)
+        with tarfile.open(fileobj=body, mode="r|*") as archive:
+            for member in archive:
+                if not member.isfile() or not member.name.lower().endswith(".xml"):
+                    continue
+                yield member.name, archive.extractfile(member), member.size
+
+    def _remove_cached_documents(self, docs):
+        """Remove the job files of bulk documents that are not run."""
+        for _, file_uuid, _ in docs:
+            if file_uuid is not None:
+                self._handle_persist_file(True, self._job_paths(file_uuid)[0])
+        return
+
+    def _distributor_wrapper(self, worker, summary=None, result=None):
         """Run the distributors and handle and parse the results and
-        parse and combine any error messages.
+        parse and combine any error messages. If a summary dictionary
+        is given, the status of each distributor is added to it. If the
+        result of the distributors is given, they are not run again.
         """
         err = []
-        status, valid, _, failed, skipped, failed_msg = worker.distribute()
+        if result is None:
+            result = worker.distribute()
+        status, valid, called, failed, skipped, failed_msg = result
+        if summary is not None:
+            for name in called:
+                summary[name] = {"status": "ok"}
+            for name, reason in zip(failed, failed_msg):
+                summary[name] = {"status": "failed", "message": reason}
+            for name in skipped:
+                summary[name] = {"status": "skipped"}
+
         if not status:
             err.append("The following distributors failed: %s" % ", ".join(failed))
             for name, reason in zip(failed, failed_msg):
@@ -245,6 +681,286 @@ class App(Flask):
 
         return err, failed
 
+    @staticmethod
+    def _digest_of(data):
+        """Return the digest of a document held in memory."""
+        hasher = DigestIndex.new_hasher()
+        hasher.update(data)
+        return hasher.hexdigest()
+
+    def _is_unchanged(self, digest, path):
+        """Check if a document is identical to the last one that was
+        successfully distributed for its metadata identifier.
+        """
+        if self._digests is None or digest is None:
+            return False
+        try:
+            metadata_id = self._digests.lookup(digest)
+        except Exception as e:
+            logger.error("Failed to look up document digest")
+            logger.error(str(e))
+            return False
+        if metadata_id is None:
+            return False
+
+        logger.info("Skipping unchanged update of %s", metadata_id)
+        UNCHANGED_SKIPPED.labels(path=path).inc()
+        return True
+
+    def _record_digest(self, worker, digest):
+        """Record the digest of a successfully distributed document."""
+        if self._digests is None or digest is None or worker._file_metadata_id is None:
+            return
+        try:
+            self._digests.record(f"{worker._namespace}:{worker._file_metadata_id}", digest)
+        except Exception as e:
+            logger.error("Failed to record document digest")
+            logger.error(str(e))
+        return
+
+    def _forget_job_digest(self, worker):
+        """Remove the digest of the record of a job before it is
+        distributed. A distributor may fail after others have stored
+        the new document, and the last document stored by all of them
+        must then not be skipped when it is sent again. The digest is
+        recorded again once all distributors have succeeded.
+        """
+        if worker._file_metadata_id is None:
+            return
+        self._forget_digest(f"{worker._namespace}:{worker._file_metadata_id}")
+        return
+
+    def _forget_digest(self, metadata_id):
+        """Remove a deleted record from the digest index, so that it
+        can be inserted again.
+        """
+        if self._digests is None:
+            return
+        try:
+            self._digests.forget(metadata_id)
+        except Exception as e:
+            logger.error("Failed to remove document digest")
+            logger.error(str(e))
+        return
+
+    @staticmethod
+    def _count_failed(failed, path):
+        """Increment the failure metrics of the failed distributors."""
+        if "file" in failed:
+            FILE_DIST_FAIL.labels(path=path).inc()
+        if "pycsw" in failed:
+            CSW_DIST_FAIL.labels(path=path).inc()
+        if "solr" in failed:
+            SOLR_DIST_FAIL.labels(path=path).inc()
+        return
+
+    def _start_job_runners(self):
+        """Set up the job queue and start the threads that run the
+        queued jobs.
+        """
+        queue_path = os.path.join(self._conf.distributor_cache, "jobs")
+        try:
+            self._job_queue = JobQueue(queue_path)
+            self._job_queue.recover()
+        except Exception as e:
+            logger.critical("Could not set up the job queue: %s" % queue_path)
+            logger.critical(str(e))
+            sys.exit(1)
+
+        for i in range(self._conf.async_workers):
+            runner = threading.Thread(
+                target=self._job_runner, name=f"dmci-job-runner-{i}", daemon=True
+            )
+            runner.start()
+
+        return
+
+    def _job_runner(self):
+        """Run queued jobs until the process exits."""
+        while True:
+            try:
+                job = self._job_queue.claim()
+                if job is None:
+                    self._job_queue.prune(self._conf.job_retention)
+                    self._job_queue.wait(JOB_POLL_INTERVAL)
+                    continue
+                self._run_job(job)
+            except Exception as e:
+                logger.error("Job runner failed")
+                logger.error(str(e))
+                self._job_queue.wait(JOB_POLL_INTERVAL)
+
+    def _start_journal_recovery(self):
+        """Resume the jobs left in the journal by a stopped process.
+        The jobs are run in a background thread, so that the API can
+        start at once.
+        """
+        try:
+            records = self._journal.recover()
+        except Exception as e:
+            logger.error("Could not read the journal")
+            logger.error(str(e))
+            return
+
+        if records:
+            recovery = threading.Thread(
+                target=self._resume_jobs, args=(records,),
+                name="dmci-journal-recovery", daemon=True,
+            )
+            recovery.start()
+
+        return
+
+    def _start_manifest_rebuild(self):
+        """Fill the archive manifest from the archive folders in a
+        background thread, if it is not complete. The file distributor
+        looks up files in the archive folders until it is. If the
+        manifest is switched off, it is marked as not complete, as the
+        archive changes are then not recorded.
+        """
+        db_path = self._conf.file_manifest_path
+        if db_path is None:
+            return
+
+        if not self._conf.file_manifest:
+            if not os.path.isfile(db_path):
+                return
+            try:
+                manifest = get_file_manifest(db_path, self._conf.file_durability)
+                if manifest is not None:
+                    manifest.mark_incomplete()
+            except Exception as e:
+                logger.error("Could not mark the archive manifest as out of date")
+                logger.error(str(e))
+            return
+
+        start_manifest_rebuild(db_path, self._conf.file_archive_path, self._conf.file_durability)
+
+        return
+
+    def _resume_jobs(self, records):
+        """Run the distributors that had not completed for each of the
+        interrupted jobs.
+        """
+        for record in records:
+            try:
+                job_id = record["id"]
+                logger.info("Resuming job %s", job_id)
+                err = self._distribute_cached(
+                    job_id, record["cmd"], record["file"], record.get("digest")
+                )
+                if err:
+                    logger.error("Resumed job %s failed", job_id)
+                    for line in err:
+                        logger.error(line)
+                else:
+                    logger.info("Resumed job %s", job_id)
+            except Exception as e:
+                logger.error("Could not resume job %s", record.get("id"))
+                logger.error(str(e))
+        return
+
+    def _begin_journal(self, job_id, cmd, full_path, digest=None, queued=False):
+        """Write the journal record of a job before it is distributed."""
+        if self._journal is None:
+            return
+        try:
+            self._journal.begin(job_id, cmd, full_path, digest=digest, queued=queued)
+        except Exception as e:
+            logger.error("Could not write the journal of job %s", job_id)
+            logger.error(str(e))
+        return
+
+    def _finish_journal(self, job_id):
+        """Remove the journal record of a finished job."""
+        if self._journal is None:
+            return
+        try:
+            self._journal.finish(job_id)
+        except Exception as e:
+            logger.error("Could not remove the journal of job %s", job_id)
+            logger.error(str(e))
+        return
+
+    def _release_job_file(self, worker, job_id, status, full_path, reject_path=None,
+                          reject_reason=""):
+        """Handle the job file and remove the journal record of a job
+        once none of its distributors are running. A distributor that
+        timed out may still be reading the job file.
+        """
+        def release():
+            self._handle_persist_file(status, full_path, reject_path, reject_reason)
+            self._finish_journal(job_id)
+
+        worker.when_finished(release)
+
+        return
+
+    def _run_job(self, job):
+        """Run the distributors for a queued job."""
+        job_id = job["id"]
+        logger.info("Running job %s", job_id)
+
+        summary = {}
+        self._begin_journal(job_id, job["cmd"], job["file"], job.get("digest"), queued=True)
+        err = self._distribute_cached(
+            job_id, job["cmd"], job["file"], job.get("digest"), summary=summary
+        )
+
+        self._job_queue.complete(job, not err, summary, err)
+        logger.info("Finished job %s", job_id)
+
+        return
+
+    def _distribute_cached(self, job_id, cmd, full_path, digest=None, summary=None):
+        """Run the distributors for a validated job file in the cache,
+        and handle the job file in the same way as for a synchronous
+        request. Distributors that have completed according to the
+        journal are not called again. The journal record of the job is
+        removed when the job file is released.
+
+        Returns
+        -------
+        list of str
+            The error messages, empty if the job succeeded
+        """
+        reject_path = os.path.join(self._conf.rejected_jobs_path, f"{job_id}.xml")
+        worker = Worker(
+            cmd,
+            full_path,
+            self._xsd_obj,
+            path_to_parent_list=self._conf.path_to_parent_list,
+            journal=self._journal,
+            job_id=job_id,
+        )
+        try:
+            with open(full_path, mode="rb") as infile:
+                data = infile.read()
+        except Exception as e:
+            logger.error(str(e))
+            data = None
+
+        if data is None:
+            err = ["Could not read the queued job file"]
+            self._finish_journal(job_id)
+        elif not worker.prepare(data):
+            err = ["Could not read the metadata_identifier of the queued job file"]
+            self._handle_persist_file(False, full_path, reject_path, "\n".join(err))
+            self._finish_journal(job_id)
+        else:
+            self._forget_job_digest(worker)
+            err, failed = self._distributor_wrapper(worker, summary=summary)
+            if err:
+                self._count_failed(failed, f"/v1/{cmd}")
+                self._release_job_file(
+                    worker, job_id, False, full_path, reject_path, "\n".join(err)
+                )
+            else:
+                self._record_digest(worker, digest)
+                self._release_job_file(worker, job_id, True, full_path)
+
+        return err
+
     @staticmethod
     def _check_metadata_id(metadata_id, env_string=None):
         """Check that the metadata_id is structured as
@@ -348,6 +1064,71 @@ class App(Flask):
 
         return True
 
+    @staticmethod
+    def _is_chunked(request):
+        """Check if the request body is sent with chunked encoding, in
+        which case it has no declared length.
+        """
+        return request.headers.get("Transfer-Encoding", "").lower() == "chunked"
+
+    @staticmethod
+    def _read_body(stream, max_size):
+        """Read a request body into memory in chunks, checking the size
+        as it is read. Returns None if the body is larger than
+        max_size.
+        """
+        chunks = []
+        size = 0
+        while True:
+            chunk = stream.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_size:
+                return None
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    @staticmethod
+    def _stream_to_file(stream, full_path, max_size, hasher=None):
+        """Write a request body to the persistent file in chunks. The
+        size is checked as the body is read, so that a body larger
+        than max_size is rejected also when its declared length is
+        wrong or missing. The body is written to a temporary file that
+        replaces the persistent file when complete. If a hash object
+        is given, it is updated with the body.
+        """
+        temp_path = f"{full_path}.part"
+        size = 0
+        try:
+            with open(temp_path, "wb") as queuefile:
+                while True:
+                    chunk = stream.read(STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > max_size:
+                        break
+                    queuefile.write(chunk)
+                    if hasher is not None:
+                        hasher.update(chunk)
+
+            if size > max_size:
+                os.unlink(temp_path)
+                return f"The file is larger than maximum size: {max_size}", 413
+
+            os.replace(temp_path, full_path)
+
+        except Exception as e:
+            logger.error(str(e))
+            try:
+                os.unlink(temp_path)
+            except Exception:
+                pass
+            return "Cannot write xml data to cache file", 507
+
+        return OK_RETURN, 200
+
     @staticmethod
     def _persist_file(data, full_path):
         """Write the persistent file."""
@@ -363,3 +1144,30 @@ class App(Flask):
 
 
 # END Class App
+
+
+class PrefixedStream():
+    """A read-only stream of some bytes followed by another stream,
+    used to put back the bytes read from the start of a request body.
+    """
+
+    def __init__(self, head, stream):
+
+        self._head = head
+        self._stream = stream
+
+        return
+
+    def read(self, size=-1):
+        if not self._head:
+            return self._stream.read(size)
+        if size is None or size < 0:
+            data = self._head + self._stream.read()
+        else:
+            data = self._head[:size]
+            if len(data) < size:
+                data += self._stream.read(size - len(data))
+        self._head = self._head[size:] if size is not None and size >= 0 else b""
+        return data
+
+# END Class PrefixedStream
@@ -0,0 +1,127 @@
+"""
+DMCI : Digest Index Class
+=========================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import hashlib
+import logging
+
+from dmci.tools.file_records import write_atomic
+
+logger = logging.getLogger(__name__)
+
+
+class DigestIndex():
+    """An index of the SHA-256 digest of the last successfully
+    distributed document of each metadata identifier, stored as small
+    files in an index folder so that it is shared by all processes.
+
+    The by_id folder holds the current digest of each identifier, and
+    the by_digest folder the identifier of each digest. A submitted
+    document can then be looked up from its digest alone, without
+    parsing it.
+    """
+
+    def __init__(self, index_path):
+
+        self._by_id = os.path.join(index_path, "by_id")
+        self._by_digest = os.path.join(index_path, "by_digest")
+
+        for path in (self._by_id, self._by_digest):
+            os.makedirs(path, exist_ok=True)
+
+        return
+
+    ##
+    #  Methods
+    ##
+
+    @staticmethod
+    def new_hasher():
+        """Return a hash object for computing a document digest."""
+        return hashlib.sha256()
+
+    def lookup(self, digest):
+        """Look up the identifier of a document with a given digest.
+
+        Returns
+        -------
+        str or None
+            The metadata identifier, or None if the document is not
+            the last one distributed for its identifier
+        """
+        metadata_id = self._read(os.path.join(self._by_digest, digest))
+        if metadata_id is None:
+            return None
+        if self._read(self._id_path(metadata_id)) != digest:
+            return None
+        return metadata_id
+
+    def record(self, metadata_id, digest):
+        """Record the digest of a successfully distributed document."""
+        id_path = self._id_path(metadata_id)
+        previous = self._read(id_path)
+
+        write_atomic(os.path.join(self._by_digest, digest), metadata_id, sync=False)
+        write_atomic(id_path, digest, sync=False)
+
+        if previous is not None and previous != digest:
+            self._remove(os.path.join(self._by_digest, previous))
+
+        return
+
+    def forget(self, metadata_id):
+        """Remove an identifier from the index, for instance when its
+        record has been deleted.
+        """
+        id_path = self._id_path(metadata_id)
+        previous = self._read(id_path)
+        self._remove(id_path)
+        if previous is not None:
+            self._remove(os.path.join(self._by_digest, previous))
+        return
+
+    ##
+    #  Internal Functions
+    ##
+
+    def _id_path(self, metadata_id):
+        """Return the file name of an identifier. The identifier is
+        hashed as it may hold characters that are not valid in file
+        names.
+        """
+        name = hashlib.sha256(metadata_id.encode("utf-8")).hexdigest()
+        return os.path.join(self._by_id, name)
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, mode="r", encoding="utf-8") as infile:
+                return infile.read()
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        return
+
+# END Class DigestIndex
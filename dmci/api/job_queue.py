@@ -0,0 +1,299 @@
+"""
+DMCI : Job Queue Class
+======================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import time
+import socket
+import logging
+import threading
+
+from datetime import datetime, timezone
+
+from dmci.tools.file_records import RecordLock, read_json_record, write_json_record
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueue():
+    """A durable queue of distributor jobs, stored as one JSON record
+    per job in a queue folder. A job record is moved between the
+    pending, running and done sub-folders as it is processed. Moving a
+    record is a rename, which is atomic, so several processes can take
+    jobs from the same queue without taking the same job twice. The
+    process running a job holds a lock on its record, see RecordLock,
+    so a running job that is not locked was interrupted.
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, queue_path):
+
+        self._queue_path = queue_path
+        self._pending = os.path.join(queue_path, "pending")
+        self._running = os.path.join(queue_path, "running")
+        self._done = os.path.join(queue_path, "done")
+
+        for path in (self._pending, self._running, self._done):
+            os.makedirs(path, exist_ok=True)
+
+        # Wakes up the job runners in this process when a job is added
+        self._new_job = threading.Condition()
+
+        # The record locks of the jobs run by this process, by job ID
+        self._owned = {}
+        self._owned_lock = threading.Lock()
+
+        return
+
+    ##
+    #  Methods
+    ##
+
+    def submit(self, job_id, cmd, xml_file, distributors, digest=None):
+        """Add a job to the queue.
+
+        Parameters
+        ----------
+        job_id : str
+            The job ID, which is also the name of the job file
+        cmd : str
+            The distributor command, insert or update
+        xml_file : str
+            Path to the validated xml file in the distributor cache
+        distributors : list of str
+            The distributors that will be called
+        digest : str, optional
+            The digest of the submitted document
+
+        Returns
+        -------
+        dict
+            The job record
+        """
+        job = {
+            "id": job_id,
+            "cmd": cmd,
+            "file": xml_file,
+            "status": self.QUEUED,
+            "submitted": self._now(),
+            "started": None,
+            "finished": None,
+            "distributors": {name: {"status": self.QUEUED} for name in distributors},
+            "errors": [],
+            "digest": digest,
+        }
+        write_json_record(os.path.join(self._pending, f"{job_id}.json"), job)
+        with self._new_job:
+            self._new_job.notify()
+
+        return job
+
+    def claim(self):
+        """Take the oldest pending job and mark it as running.
+
+        Returns
+        -------
+        dict or None
+            The job record, or None if there are no pending jobs
+        """
+        for name in self._list_records(self._pending):
+            pending_path = os.path.join(self._pending, name)
+            running_path = os.path.join(self._running, name)
+
+            # The job is locked before it is running, so that it is
+            # never seen as interrupted
+            lock = RecordLock(running_path)
+            if not lock.acquire():
+                continue
+            try:
+                os.rename(pending_path, running_path)
+            except FileNotFoundError:
+                # Taken by another job runner
+                lock.release()
+                continue
+
+            try:
+                job = read_json_record(running_path)
+            except Exception as e:
+                logger.error("Could not read job record: %s", running_path)
+                logger.error(str(e))
+                os.rename(running_path, os.path.join(self._done, name))
+                lock.release()
+                continue
+
+            job["status"] = self.RUNNING
+            job["started"] = self._now()
+            job["host"] = socket.gethostname()
+            job["pid"] = os.getpid()
+            for dist in job["distributors"]:
+                job["distributors"][dist] = {"status": self.RUNNING}
+            write_json_record(running_path, job)
+            with self._owned_lock:
+                self._owned[job["id"]] = lock
+
+            return job
+
+        return None
+
+    def complete(self, job, status, distributors, errors):
+        """Record the result of a job, and remove it from the running
+        jobs.
+
+        Parameters
+        ----------
+        job : dict
+            The job record returned by claim()
+        status : bool
+            True if all distributors succeeded
+        distributors : dict
+            The status of each distributor
+        errors : list of str
+            The error messages of the job
+        """
+        job["status"] = self.DONE if status else self.FAILED
+        job["finished"] = self._now()
+        job["distributors"].update(distributors)
+        job["errors"] = errors
+        write_json_record(os.path.join(self._done, f"{job['id']}.json"), job)
+
+        try:
+            os.unlink(os.path.join(self._running, f"{job['id']}.json"))
+        except Exception as e:
+            logger.error("Failed to remove running job record: %s", job["id"])
+            logger.error(str(e))
+
+        with self._owned_lock:
+            lock = self._owned.pop(job["id"], None)
+        if lock is not None:
+            lock.release()
+
+        return
+
+    def status(self, job_id):
+        """Look up a job record.
+
+        Returns
+        -------
+        dict or None
+            The job record, or None if the job is not known
+        """
+        # A job moves from pending to running to done, so done is
+        # checked again in case the job finished while we were looking
+        for path in (self._done, self._running, self._pending, self._done):
+            record = os.path.join(path, f"{job_id}.json")
+            try:
+                return read_json_record(record)
+            except FileNotFoundError:
+                continue
+            except Exception as e:
+                logger.error("Could not read job record: %s", record)
+                logger.error(str(e))
+                return None
+
+        return None
+
+    def wait(self, timeout):
+        """Wait until a job is added in this process, or until the
+        timeout. Jobs added by other processes are only seen when the
+        timeout has passed.
+        """
+        with self._new_job:
+            self._new_job.wait(timeout)
+        return
+
+    def recover(self):
+        """Put jobs back in the queue if they were left running by a
+        process that has stopped.
+
+        Returns
+        -------
+        int
+            The number of jobs put back in the queue
+        """
+        count = 0
+        for name in self._list_records(self._running):
+            running_path = os.path.join(self._running, name)
+            with self._owned_lock:
+                if name[:-5] in self._owned:
+                    continue
+            lock = RecordLock(running_path)
+            if not lock.acquire():
+                continue
+            try:
+                job = read_json_record(running_path)
+            except Exception:
+                lock.release()
+                continue
+
+            job["status"] = self.QUEUED
+            job["started"] = None
+            for dist in job["distributors"]:
+                job["distributors"][dist] = {"status": self.QUEUED}
+            write_json_record(running_path, job)
+            try:
+                os.rename(running_path, os.path.join(self._pending, name))
+            except FileNotFoundError:
+                continue
+            finally:
+                lock.release()
+
+            logger.warning("Job %s was interrupted, and has been queued again", job["id"])
+            count += 1
+
+        return count
+
+    def prune(self, max_age):
+        """Delete records of finished jobs older than max_age seconds."""
+        if max_age is None:
+            return
+        limit = time.time() - max_age
+        for name in self._list_records(self._done):
+            record = os.path.join(self._done, name)
+            try:
+                if os.path.getmtime(record) < limit:
+                    os.unlink(record)
+            except FileNotFoundError:
+                continue
+        return
+
+    ##
+    #  Internal Functions
+    ##
+
+    @staticmethod
+    def _now():
+        return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+    @staticmethod
+    def _list_records(path):
+        """List the job records in a folder, oldest first."""
+        records = []
+        for name in os.listdir(path):
+            if not name.endswith(".json"):
+                continue
+            try:
+                records.append((os.path.getmtime(os.path.join(path, name)), name))
+            except FileNotFoundError:
+                continue
+        return [name for _, name in sorted(records)]
+
+# END Class JobQueue
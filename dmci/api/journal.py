@@ -0,0 +1,236 @@
+"""
+DMCI : Distribution Journal Class
+=================================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import time
+import shutil
+import socket
+import logging
+import threading
+
+from dmci.tools.file_records import RecordLock, read_json_record, write_json_record
+
+logger = logging.getLogger(__name__)
+
+
+class Journal():
+    """A write-ahead journal of the jobs being distributed, stored as
+    one JSON record per job in a journal folder. A record is written
+    before the distributors are called, is updated each time a
+    distributor completes, and is removed when the job is finished.
+
+    The process running a job holds a lock on its record, see
+    RecordLock. A record that is not locked belongs to an interrupted
+    job, which can be resumed without calling the distributors that
+    had already completed.
+    """
+
+    def __init__(self, journal_path, ttl=None, rejected_path=None):
+
+        self._journal_path = journal_path
+        self._ttl = ttl
+        self._rejected_path = rejected_path
+        os.makedirs(journal_path, exist_ok=True)
+
+        # Distributors of the same job may complete at the same time
+        self._lock = threading.Lock()
+
+        # The record locks held by this process, by job ID
+        self._owned = {}
+
+        return
+
+    ##
+    #  Methods
+    ##
+
+    def begin(self, job_id, cmd, xml_file, digest=None, queued=False):
+        """Record that a job is about to be distributed. If the job
+        already has a record, it is resumed, and the distributors that
+        have completed are kept.
+
+        Parameters
+        ----------
+        job_id : str
+            The job ID, which is also the name of the record file
+        cmd : str
+            The distributor command, insert or update
+        xml_file : str
+            Path to the validated xml file in the distributor cache
+        digest : str, optional
+            The digest of the submitted document
+        queued : bool, optional
+            True if the job is run from the async job queue, which
+            resumes its own interrupted jobs
+
+        Returns
+        -------
+        dict
+            The journal record
+        """
+        with self._lock:
+            if not self._take_record(job_id):
+                logger.warning("The journal record of job %s is owned by another process", job_id)
+            try:
+                record = read_json_record(self._record_path(job_id))
+            except FileNotFoundError:
+                record = {
+                    "id": job_id,
+                    "cmd": cmd,
+                    "file": xml_file,
+                    "digest": digest,
+                    "queued": queued,
+                    "completed": [],
+                }
+            record["host"] = socket.gethostname()
+            record["pid"] = os.getpid()
+            write_json_record(self._record_path(job_id), record)
+
+        return record
+
+    def completed(self, job_id):
+        """Return the distributors that have completed for a job."""
+        try:
+            return read_json_record(self._record_path(job_id))["completed"]
+        except FileNotFoundError:
+            return []
+
+    def mark_done(self, job_id, dist):
+        """Record that a distributor has completed for a job."""
+        with self._lock:
+            path = self._record_path(job_id)
+            record = read_json_record(path)
+            if dist not in record["completed"]:
+                record["completed"].append(dist)
+                write_json_record(path, record)
+        return
+
+    def finish(self, job_id):
+        """Remove the record of a finished job."""
+        try:
+            os.unlink(self._record_path(job_id))
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            lock = self._owned.pop(job_id, None)
+        if lock is not None:
+            lock.release()
+        return
+
+    def recover(self):
+        """Take over the records of jobs that were left unfinished by
+        a process that has stopped. Jobs run from the async job queue
+        are left to the queue. Records that have not changed for longer
+        than the journal TTL are removed instead, as their jobs are too
+        old to resume, and the cached files of their jobs are moved to
+        the rejected folder.
+
+        Returns
+        -------
+        list of dict
+            The records of the jobs to resume
+        """
+        records = []
+        for name in sorted(os.listdir(self._journal_path)):
+            if not name.endswith(".json"):
+                continue
+            job_id = name[:-5]
+            path = os.path.join(self._journal_path, name)
+            try:
+                record = read_json_record(path)
+                age = time.time() - os.path.getmtime(path)
+            except Exception:
+                continue
+            stale = self._ttl is not None and age > self._ttl
+            if record.get("queued") and not stale:
+                continue
+
+            # The lock is held by the process running the job
+            with self._lock:
+                if job_id in self._owned or not self._take_record(job_id):
+                    continue
+
+            # The job may have finished before the lock was taken
+            if not os.path.isfile(path):
+                self.finish(job_id)
+                continue
+
+            if stale:
+                logger.warning("Dropping job %s, as it was interrupted %d seconds ago",
+                               job_id, age)
+                if not record.get("queued"):
+                    self._reject_file(record, (
+                        f"The job was interrupted {int(age)} seconds ago, "
+                        "and was dropped instead of resumed"
+                    ))
+                self.finish(job_id)
+                continue
+
+            record["host"] = socket.gethostname()
+            record["pid"] = os.getpid()
+            write_json_record(path, record)
+
+            logger.warning("Job %s was interrupted, and will be resumed", job_id)
+            records.append(record)
+
+        return records
+
+    ##
+    #  Internal Functions
+    ##
+
+    def _record_path(self, job_id):
+        return os.path.join(self._journal_path, f"{job_id}.json")
+
+    def _reject_file(self, record, reason):
+        """Move the cached file of a dropped job to the rejected folder,
+        with a text file giving the reason, as is done for failed jobs.
+        The file of a queued job belongs to the job queue.
+        """
+        xml_file = record.get("file")
+        if self._rejected_path is None or not xml_file or not os.path.isfile(xml_file):
+            return
+        reject_path = os.path.join(self._rejected_path, os.path.basename(xml_file))
+        try:
+            shutil.move(xml_file, reject_path)
+            with open(reject_path[:-3] + "txt", mode="w", encoding="utf-8") as ofile:
+                ofile.write(reason)
+        except Exception as e:
+            logger.error("Failed to move the file of job %s to: %s", record["id"], reject_path)
+            logger.error(str(e))
+        return
+
+    def _take_record(self, job_id):
+        """Lock the record of a job for this process. Must be called
+        with the journal lock held.
+
+        Returns
+        -------
+        bool
+            True if this process owns the record
+        """
+        if job_id in self._owned:
+            return True
+        lock = RecordLock(self._record_path(job_id))
+        if not lock.acquire():
+            return False
+        self._owned[job_id] = lock
+        return True
+
+# END Class Journal
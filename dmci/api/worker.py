@@ -19,16 +19,38 @@ limitations under the License.
 
 import logging
 import re
+import time
 import uuid
+import threading
+
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 
 from lxml import etree
 
 from dmci import CONFIG
 from dmci.distributors import FileDist, PyCSWDist, SolRDist
-from dmci.tools import CheckMMD
+from dmci.tools import CheckMMD, MMDDocument, MMDRecord
 
 logger = logging.getLogger(__name__)
 
+# The thread pool of the concurrent distributors in this process
+_EXECUTOR = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def get_distributor_executor(max_workers):
+    """Return the thread pool that runs the distributors concurrently.
+    The pool is created on first use, and is shared by all requests in
+    this process.
+    """
+    global _EXECUTOR
+    with _EXECUTOR_LOCK:
+        if _EXECUTOR is None:
+            _EXECUTOR = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="dmci-distributor"
+            )
+    return _EXECUTOR
+
 
 class Worker:
 
@@ -52,6 +74,16 @@ class Worker:
         self._file_metadata_id = None
         self._file_title_en = None
 
+        # The parsed document, shared with the distributors
+        self._doc = kwargs.get("doc", None)
+
+        # Journal of the distributors that have completed for this job
+        self._journal = kwargs.get("journal", None)
+        self._job_id = kwargs.get("job_id", None)
+
+        # Distributors that timed out, but are still running
+        self._pending = []
+
         # XML Validator
         # Created by the app object as it is potentially slow to set up
         self._xsd_obj = xsd_validator
@@ -82,94 +114,81 @@ class Worker:
         """
         # Takes in bytes-object data
         # Gives msg when both validating and not validating
-        valid = False
-        msg = ""
         if not isinstance(data, bytes):
             return False, "Input must be bytes type", data
 
-        # Check xml file against XML schema definition
         try:
-            valid = self._xsd_obj.validate(etree.fromstring(data))
-            msg = repr(self._xsd_obj.error_log)
+            doc = MMDDocument(data)
         except Exception as e:
             return False, str(e), data
 
-        if valid:
-            # Check information content
-            valid, msg = self._check_information_content(data)
-            if not valid:
-                return valid, msg, data
-
-            # Make sure that datasets in dev (e.g., no.met.dev) and
-            # staging (e.g., no.met.staging) cannot be added to wrong
-            # environments
-            if (".dev" in self._namespace and self._conf.env_string != "dev") or (
-                ".staging" in self._namespace and self._conf.env_string != "staging"
-            ):
-                msg = (
-                    f"Namespace {self._namespace} does not match "
-                    f"the env {self._conf.env_string}"
-                )
-                return False, msg, data
-
-            if self._conf.env_string:
-
-                # Append env string to namespace in metadata_identifier
-                logger.debug("Identifier namespace: %s" % self._namespace)
-                logger.debug("Environment customization: %s" % self._conf.env_string)
-                ns_re_pattern = re.compile(r"\w.\w." + self._conf.env_string)
-
-                if re.search(ns_re_pattern, self._namespace) is None:
-                    full_namespace = f"{self._namespace}.{self._conf.env_string}"
-                    data = re.sub(
-                        str.encode(f"<mmd:metadata_identifier>{self._namespace}"),
-                        str.encode(f"<mmd:metadata_identifier>{full_namespace}"),
-                        data,
-                    )
-                    self._namespace = full_namespace
-
-                # Append env string to the namespace in the parent block, if present
-                if bool(
-                    re.search(b'<mmd:related_dataset relation_type="parent">', data)
-                ):
-                    match_parent_block = re.search(
-                        b'<mmd:related_dataset relation_type="parent">(.+?)</mmd:related_dataset>',
-                        data,
-                    )
-                    found_parent_block_content = match_parent_block.group(1)
-                    found_parent_block_content = found_parent_block_content.split(b":")
-                    if len(found_parent_block_content) != 2:
-                        err = f"Malformed parent dataset identifier {found_parent_block_content}"
-                        logger.error(err)
-                        return False, err, data
-                    old_parent_namespace = found_parent_block_content[0].decode()
-                    logger.debug("Parent dataset namespace: %s" % old_parent_namespace)
-                    if re.search(ns_re_pattern, old_parent_namespace) is None:
-                        new_parent_namespace = (
-                            f"{old_parent_namespace}.{self._conf.env_string}"
-                        )
-                        data = re.sub(
-                            str.encode(
-                                f"<mmd:related_dataset "
-                                f'relation_type="parent">{old_parent_namespace}'
-                            ),
-                            str.encode(
-                                f"<mmd:related_dataset "
-                                f'relation_type="parent">{new_parent_namespace}'
-                            ),
-                            data,
-                        )
-
-            # Add landing page info
-            data = self._add_landing_page(
-                data, self._conf.catalog_url, self._file_metadata_id
-            )
+        valid, msg = self._validate_doc(doc)
+        if doc.is_modified():
+            data = doc.data
 
         return valid, msg, data
 
+    def validate_file(self, path):
+        """Validate an xml file in the same way as validate(). The file
+        is parsed directly, without reading it into memory first.
+
+        Parameters
+        ----------
+        path : str
+            Path to the xml file
+
+        Returns
+        -------
+        valid : bool
+            True if xsd and information content checks are passing
+        msg : str
+            Validation message
+        data : bytes or None
+            bytes representation of the modified xml data, or None if
+            the data was not modified
+        """
+        try:
+            doc = MMDDocument.from_file(path)
+        except Exception as e:
+            return False, str(e), None
+
+        valid, msg = self._validate_doc(doc)
+
+        return valid, msg, doc.data if doc.is_modified() else None
+
+    def prepare(self, data):
+        """Prepare the worker for distributing data that has already
+        been validated, without running the checks again.
+
+        Parameters
+        ----------
+        data : bytes
+            bytes representation of the validated xml data
+
+        Returns
+        -------
+        bool
+            True if the metadata identifier could be read
+        """
+        try:
+            self._doc = MMDDocument(data)
+        except Exception as e:
+            logger.error("Could not parse the validated data")
+            logger.error(str(e))
+            return False
+
+        self._extract_title(self._doc.record)
+        return self._extract_metadata_id(self._doc.record)
+
     def distribute(self):
         """Loop through all distributors listed in the config and call
-        them in the same order.
+        them in the same order, or run them concurrently if this is
+        enabled in the config. Distributors listed in the
+        distributor_dependencies config run after the ones they depend
+        on, and are not run if any of them failed. If the worker has a
+        journal, each
+        completed distributor is recorded in it, and distributors that
+        completed before the job was interrupted are not called again.
 
         Returns
         -------
@@ -193,45 +212,435 @@ class Worker:
         skipped = []
         failed_msg = []
 
-        for dist in self._conf.call_distributors:
-            if dist not in self.CALL_MAP:
+        done = self._completed_distributors()
+        jobs = []
+        for dist in dict.fromkeys(self._conf.call_distributors):
+            if dist in done:
+                logger.info("Distributor '%s' already completed, not called again", dist)
+                jobs.append((dist, None))
+                continue
+            obj = self._make_distributor(dist)
+            if obj is None and dist in self.CALL_MAP:
+                valid = False
+            jobs.append((dist, obj))
+
+        results = self._run_jobs(jobs)
+
+        for (dist, _), result in zip(jobs, results):
+            if dist in done:
+                called.append(dist)
+                continue
+            if result is None:
                 skipped.append(dist)
                 continue
-            obj = self.CALL_MAP[dist](
-                self._dist_cmd,
-                xml_file=self._dist_xml_file,
-                metadata_UUID=self._dist_metadata_id_uuid,
-                worker=self,
-                path_to_parent_list=self._kwargs.get("path_to_parent_list", None),
-            )
-            valid &= obj.is_valid()
-            if obj.is_valid():
-                obj_status, obj_msg = obj.run()
-                status &= obj_status
-                if obj_status:
+            obj_status, obj_msg = result
+            status &= obj_status
+            if obj_status:
+                called.append(dist)
+            else:
+                failed.append(dist)
+                failed_msg.append(obj_msg)
+
+        return status, valid, called, failed, skipped, failed_msg
+
+    @staticmethod
+    def distribute_batch(workers):
+        """Run the distributors for a batch of workers. Each distributor
+        in the config gets all the jobs of the batch at once, so that
+        it can send them to its service together. Distributors listed
+        in the distributor_dependencies config run after the ones they
+        depend on, and a job is not run if its dependencies failed.
+
+        Parameters
+        ----------
+        workers : list of Worker
+            The workers of the batch, which must all have the same
+            config
+
+        Returns
+        -------
+        list of tuple
+            The same tuple as returned by distribute(), per worker
+        """
+        if not workers:
+            return []
+
+        conf = workers[0]._conf
+        depends = conf.distributor_dependencies or {}
+        names = list(dict.fromkeys(conf.call_distributors))
+
+        # Put each distributor after the distributors it depends on,
+        # otherwise keep the config order
+        levels = Worker._dependency_levels(names, depends)
+        ordered = sorted(names, key=lambda dist: levels[dist])
+
+        results = [{} for _ in workers]
+        for dist in ordered:
+            batch = []
+            for idx, worker in enumerate(workers):
+                obj = worker._make_distributor(dist)
+                if obj is None:
+                    results[idx][dist] = None
+                    continue
+                failed_deps = [
+                    dep for dep in depends.get(dist, [])
+                    if results[idx].get(dep) is not None and not results[idx][dep][0]
+                ]
+                if failed_deps:
+                    results[idx][dist] = (
+                        False, "Not run since distributor '%s' failed" % failed_deps[0]
+                    )
+                    continue
+                batch.append((idx, obj))
+
+            if not batch:
+                continue
+            dist_class = type(batch[0][1])
+            try:
+                batch_results = dist_class.run_batch([obj for _, obj in batch])
+            except Exception as e:
+                logger.error("Distributor '%s' raised an exception", dist)
+                logger.error(str(e))
+                batch_results = [(False, "Internal error")]*len(batch)
+            for (idx, _), result in zip(batch, batch_results):
+                results[idx][dist] = result
+                if result[0]:
+                    workers[idx]._mark_done(dist)
+
+        summaries = []
+        for dist_results in results:
+            status = True
+            valid = True
+            called = []
+            failed = []
+            skipped = []
+            failed_msg = []
+            for dist in names:
+                result = dist_results[dist]
+                if result is None:
+                    valid &= dist not in Worker.CALL_MAP
+                    skipped.append(dist)
+                    continue
+                status &= result[0]
+                if result[0]:
                     called.append(dist)
                 else:
                     failed.append(dist)
-                    failed_msg.append(obj_msg)
-            else:
-                skipped.append(dist)
+                    failed_msg.append(result[1])
+            summaries.append((status, valid, called, failed, skipped, failed_msg))
 
-        return status, valid, called, failed, skipped, failed_msg
+        return summaries
+
+    def when_finished(self, callback):
+        """Call a function once no distributor of this worker is running.
+        This is at once, unless a distributor timed out and is still
+        running. The function is then called from the thread of the
+        last such distributor when it finishes. The job file must not be
+        removed before this, as the distributors may still read it.
+        """
+        pending = [future for future in self._pending if not future.done()]
+        if not pending:
+            callback()
+            return
+
+        remaining = [len(pending)]
+        lock = threading.Lock()
+
+        def on_done(future):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] > 0:
+                    return
+            try:
+                callback()
+            except Exception as e:
+                logger.error("Failed to finish job after timed out distributors")
+                logger.error(str(e))
+
+        for future in pending:
+            future.add_done_callback(on_done)
+
+        return
 
     ##
     #  Internal Functions
     ##
 
-    def _check_information_content(self, data):
-        """Check the information content in the submitted file."""
-        if not isinstance(data, bytes):
-            return False, "Input must be bytes type"
+    @staticmethod
+    def _dependency_levels(names, depends):
+        """Return the level of each distributor. It is 0 for the ones
+        that depend on none of the others, and otherwise one more than
+        the highest level of the ones it depends on. Circular
+        dependencies are rejected by the config check, and are ignored
+        here.
+        """
+        levels = {}
 
-        # Read XML file
-        xml_doc = etree.fromstring(data)
+        def get_level(dist, stack):
+            if dist not in levels:
+                level = 0
+                for dep in depends.get(dist, []):
+                    if dep in names and dep not in stack:
+                        level = max(level, get_level(dep, stack + [dist]) + 1)
+                levels[dist] = level
+            return levels[dist]
+
+        for dist in names:
+            get_level(dist, [])
+
+        return levels
+
+    def _make_distributor(self, dist):
+        """Create the distributor object for a distributor name.
+
+        Returns
+        -------
+        Distributor or None
+            The distributor object, or None if the distributor is
+            unknown or the job is invalid
+        """
+        if dist not in self.CALL_MAP:
+            return None
+        obj = self.CALL_MAP[dist](
+            self._dist_cmd,
+            xml_file=self._dist_xml_file,
+            metadata_UUID=self._dist_metadata_id_uuid,
+            worker=self,
+            path_to_parent_list=self._kwargs.get("path_to_parent_list", None),
+            doc=self._doc,
+        )
+        return obj if obj.is_valid() else None
+
+    def _completed_distributors(self):
+        """Return the distributors recorded as completed in the
+        journal.
+        """
+        if self._journal is None:
+            return []
+        try:
+            return self._journal.completed(self._job_id)
+        except Exception as e:
+            logger.error("Could not read the journal of job %s", self._job_id)
+            logger.error(str(e))
+            return []
+
+    def _run_distributor(self, dist, obj):
+        """Run a distributor, and record it in the journal if it
+        completed.
+        """
+        result = obj.run()
+        if result[0]:
+            self._mark_done(dist)
+        return result
+
+    def _mark_done(self, dist):
+        """Record in the journal that a distributor has completed."""
+        if self._journal is None:
+            return
+        try:
+            self._journal.mark_done(self._job_id, dist)
+        except Exception as e:
+            logger.error("Could not write the journal of job %s", self._job_id)
+            logger.error(str(e))
+        return
 
-        self._extract_title(xml_doc)
-        valid = self._extract_metadata_id(xml_doc)
+    def _run_jobs(self, jobs):
+        """Run the distributors one level of dependencies at a time.
+        A distributor is not run if any of the distributors it depends
+        on failed.
+
+        Parameters
+        ----------
+        jobs : list of tuple
+            The distributor names and objects, where the object is None
+            if the distributor should be skipped
+
+        Returns
+        -------
+        list
+            A (status, msg) tuple per job, or None for skipped jobs
+        """
+        depends = self._conf.distributor_dependencies or {}
+        levels = self._dependency_levels([dist for dist, _ in jobs], depends)
+        results = [None]*len(jobs)
+        finished = {}
+
+        for level in sorted(set(levels.values())):
+            in_level = [
+                idx for idx, (dist, obj) in enumerate(jobs)
+                if obj is not None and levels[dist] == level
+            ]
+            to_run = []
+            for idx in in_level:
+                failed_deps = [
+                    dep for dep in depends.get(jobs[idx][0], [])
+                    if dep in finished and not finished[dep][0]
+                ]
+                if failed_deps:
+                    msg = "Not run since distributor '%s' failed" % failed_deps[0]
+                    results[idx] = (False, msg)
+                else:
+                    to_run.append(idx)
+
+            if self._conf.concurrent_distributors:
+                level_results = self._run_concurrent([jobs[idx] for idx in to_run])
+            else:
+                level_results = [self._run_distributor(*jobs[idx]) for idx in to_run]
+
+            for idx, result in zip(to_run, level_results):
+                results[idx] = result
+            for idx in in_level:
+                finished.setdefault(jobs[idx][0], results[idx])
+
+        return results
+
+    def _run_concurrent(self, jobs):
+        """Run a number of distributors at the same time in the shared
+        thread pool, each limited to distributor_timeout seconds. A
+        distributor that times out before it has started is cancelled.
+        One that has started cannot be stopped, and is kept as pending
+        until it finishes, see when_finished().
+
+        Returns
+        -------
+        list of tuple
+            A (status, msg) tuple per job
+        """
+        timeout = self._conf.distributor_timeout
+        executor = get_distributor_executor(self._conf.distributor_pool_size)
+        futures = [executor.submit(self._run_distributor, dist, obj) for dist, obj in jobs]
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        results = []
+        for (dist, _), future in zip(jobs, futures):
+            wait_for = None if deadline is None else max(deadline - time.monotonic(), 0)
+            try:
+                results.append(future.result(timeout=wait_for))
+            except FutureTimeout:
+                if future.cancel():
+                    logger.error("Distributor '%s' timed out before it started", dist)
+                else:
+                    logger.error("Distributor '%s' timed out, and is still running", dist)
+                    future.add_done_callback(self._late_result_logger(dist))
+                    self._pending.append(future)
+                results.append((False, "Timed out after %s seconds" % timeout))
+            except Exception as e:
+                logger.error("Distributor '%s' raised an exception", dist)
+                logger.error(str(e))
+                results.append((False, "Internal error"))
+
+        return results
+
+    def _late_result_logger(self, dist):
+        """Return a callback that logs the result of a distributor that
+        finished after it timed out. The job was then reported as
+        failed, so a successful result must be reconciled by hand.
+        """
+        def log_result(future):
+            try:
+                status, msg = future.result()
+            except Exception as e:
+                status, msg = False, str(e)
+            logger.error(
+                "Distributor '%s' of job %s finished after it timed out, with status %s: %s",
+                dist, self._job_id or self._file_metadata_id, status, msg
+            )
+        return log_result
+
+    def _validate_doc(self, doc):
+        """Check a parsed document against the XML schema definition
+        and check its information content. The document is kept for
+        the distributors, and is changed in place for the environment
+        and landing page.
+        """
+        self._doc = doc
+        try:
+            valid = self._xsd_obj.validate(doc.xml_doc)
+            msg = repr(self._xsd_obj.error_log)
+        except Exception as e:
+            return False, str(e)
+
+        if not valid:
+            return valid, msg
+
+        # Check information content
+        valid, msg = self._check_information_content(None, doc.record)
+        if not valid:
+            return valid, msg
+
+        # Make sure that datasets in dev (e.g., no.met.dev) and
+        # staging (e.g., no.met.staging) cannot be added to wrong
+        # environments
+        if (".dev" in self._namespace and self._conf.env_string != "dev") or (
+            ".staging" in self._namespace and self._conf.env_string != "staging"
+        ):
+            msg = (
+                f"Namespace {self._namespace} does not match "
+                f"the env {self._conf.env_string}"
+            )
+            return False, msg
+
+        # All modifications are made on the parsed tree, which is
+        # serialised once when the data is requested
+        xml_doc = doc.xml_doc
+        changed = False
+
+        if self._conf.env_string:
+
+            # Append env string to namespace in metadata_identifier
+            logger.debug("Identifier namespace: %s" % self._namespace)
+            logger.debug("Environment customization: %s" % self._conf.env_string)
+            ns_re_pattern = re.compile(r"\w.\w." + self._conf.env_string)
+
+            if re.search(ns_re_pattern, self._namespace) is None:
+                full_namespace = f"{self._namespace}.{self._conf.env_string}"
+                id_elem = xml_doc.find("./{*}metadata_identifier")
+                id_elem.text = full_namespace + id_elem.text[len(self._namespace):]
+                self._namespace = full_namespace
+                changed = True
+
+            # Append env string to the namespace in the parent block, if present
+            for parent_elem in doc.record.parents:
+                parent_words = (parent_elem.text or "").split(":")
+                if len(parent_words) != 2:
+                    err = f"Malformed parent dataset identifier {parent_words}"
+                    logger.error(err)
+                    return False, err
+                old_parent_namespace = parent_words[0]
+                logger.debug("Parent dataset namespace: %s" % old_parent_namespace)
+                if re.search(ns_re_pattern, old_parent_namespace) is None:
+                    new_parent_namespace = (
+                        f"{old_parent_namespace}.{self._conf.env_string}"
+                    )
+                    parent_elem.text = f"{new_parent_namespace}:{parent_words[1]}"
+                    changed = True
+
+        # Add landing page info
+        changed |= self._add_landing_page(
+            xml_doc, self._conf.catalog_url, self._file_metadata_id
+        )
+
+        doc.namespace = self._namespace
+        if changed:
+            doc.tree_changed()
+
+        return valid, msg
+
+    def _check_information_content(self, data, xml_doc=None):
+        """Check the information content in the submitted file. If the
+        parsed document or its record is provided, the data is not
+        parsed again.
+        """
+        # Read XML file
+        if xml_doc is None:
+            if not isinstance(data, bytes):
+                return False, "Input must be bytes type"
+            xml_doc = etree.fromstring(data)
+
+        # The checks below share one pass over the document
+        record = MMDRecord.of(xml_doc)
+        self._extract_title(record)
+        valid = self._extract_metadata_id(record)
         if not valid:
             return (
                 False,
@@ -242,7 +651,7 @@ class Worker:
         # Check XML file
         logger.info("Performing in depth checking.")
         checker = CheckMMD()
-        valid = checker.full_check(xml_doc)
+        valid = checker.full_check(record)
         if valid:
             msg = "Input MMD XML file is ok"
         else:
@@ -256,41 +665,65 @@ class Worker:
 
         return valid, msg
 
-    def _add_landing_page(self, data, catalog_url, uuid):
-        """Inserts the landing page info in the data bytes string and returns the modified string
+    def _add_landing_page(self, xml_doc, catalog_url, uuid):
+        """Inserts the landing page info in the xml tree, or replaces
+        the content of an existing landing page block.
         <related_information>
            <type>Dataset landing page</type>
            <resource>https://data.met.no/dataset/{uuid}</resource>
-        </related_information>"""
-
-        # each of the related_information types has its own block so we do not eed to worry
-        # about there being other <mmd:related_information> </mmd:related_information> blocks
-        # already, unless it's a Dataset Landing Page block
-        if not bool(re.search(b"Dataset landing page", data)):
-            matchstring_end = b"\n</mmd:mmd>\n"
-            end_mod = str.encode(
-                f"\n  <mmd:related_information>\n    <mmd:type>Dataset landing page</mmd:type>"
-                f"\n    <mmd:description/>"
-                f"\n    <mmd:resource>{catalog_url}/dataset/{uuid}</mmd:resource>"
-                f"\n  </mmd:related_information>\n</mmd:mmd>\n"
-            )
-            data_mod = re.sub(matchstring_end, end_mod, data)
+        </related_information>
+
+        Returns
+        -------
+        bool
+            True if the tree was modified
+        """
+        resource = f"{catalog_url}/dataset/{uuid}"
+        mmd_ns = etree.QName(xml_doc).namespace
+        tag_prefix = "{%s}" % mmd_ns if mmd_ns else ""
+
+        # Each of the related_information types has its own block, so
+        # we only need to look for one with a Dataset landing page type
+        block = None
+        for elem in xml_doc.iterfind("./{*}related_information"):
+            if elem.findtext("./{*}type") == "Dataset landing page":
+                block = elem
+                break
+
+        if block is None:
+            if len(xml_doc) > 0:
+                xml_doc[-1].tail = "\n  "
+            block = etree.SubElement(xml_doc, tag_prefix + "related_information")
+            block.text = "\n    "
+            block.tail = "\n"
+            type_elem = etree.SubElement(block, tag_prefix + "type")
+            type_elem.text = "Dataset landing page"
         else:
-            # there is already a block of related_information with Dataset landing page,
-            # we replace whatever the content inside it
-            match_datasetlandingpage = re.search(
-                b"<mmd:type>Dataset landing page</mmd:type>(.+?)</mmd:related_information>",
-                data,
-                re.DOTALL,
-            )
-            found_datasetlandingpage = match_datasetlandingpage.group(1)
-            datasetlandingpage_mod = str.encode(
-                f"\n    <mmd:description/>\n    "
-                f"<mmd:resource>{catalog_url}/dataset/{uuid}</mmd:resource>\n  "
-            )
-            data_mod = re.sub(found_datasetlandingpage, datasetlandingpage_mod, data)
+            # Keep the block if it already has the expected content
+            children = list(block)
+            if len(children) == 3:
+                desc_elem, res_elem = children[1:]
+                desc_ok = etree.QName(desc_elem).localname == "description"
+                desc_ok &= desc_elem.text is None and len(desc_elem) == 0
+                res_ok = etree.QName(res_elem).localname == "resource"
+                res_ok &= res_elem.text == resource
+                if desc_ok and res_ok:
+                    return False
+
+            # Otherwise, replace whatever content follows the type
+            type_elem = block.find("./{*}type")
+            for elem in children:
+                if elem is not type_elem:
+                    block.remove(elem)
+
+        type_elem.tail = "\n    "
+        desc_elem = etree.SubElement(block, tag_prefix + "description")
+        desc_elem.tail = "\n    "
+        res_elem = etree.SubElement(block, tag_prefix + "resource")
+        res_elem.text = resource
+        res_elem.tail = "\n  "
 
-        return data_mod
+        return True
 
     def _extract_metadata_id(self, xml_doc):
         """Set the class variables namespace and file_metadata_id.
@@ -320,6 +753,9 @@ class Worker:
             logger.error(str(e))
             return False
         self._namespace = namespace
+        if self._doc is not None:
+            self._doc.metadata_id = self._file_metadata_id
+            self._doc.namespace = namespace
         return True
 
     @staticmethod
@@ -335,35 +771,31 @@ class Worker:
         """
         file_uuid = ""
         namespace = ""
-        for xml_entry in xml_doc:
-            local = etree.QName(xml_entry)
-            if local.localname == "metadata_identifier":
-                # only accept if format is uri:UUID, both need to be present
-                words = xml_entry.text.split(":")
-                if len(words) != 2:
-                    logger.error("metadata_identifier not formed as namespace:UUID")
-                    return "", ""
-                namespace, file_uuid = words
-
-                logger.info(
-                    "XML file metadata_identifier: %s:%s" % (namespace, file_uuid)
-                )
-                logger.debug("XML file metadata_identifier namespace: %s", namespace)
-                logger.debug("XML file metadata_identifier UUID: %s", file_uuid)
-                break
+        metadata_identifier = MMDRecord.of(xml_doc).metadata_identifier
+        if metadata_identifier is not None:
+            # only accept if format is uri:UUID, both need to be present
+            words = metadata_identifier.split(":")
+            if len(words) != 2:
+                logger.error("metadata_identifier not formed as namespace:UUID")
+                return "", ""
+            namespace, file_uuid = words
+
+            logger.info(
+                "XML file metadata_identifier: %s:%s" % (namespace, file_uuid)
+            )
+            logger.debug("XML file metadata_identifier namespace: %s", namespace)
+            logger.debug("XML file metadata_identifier UUID: %s", file_uuid)
         return namespace, file_uuid
 
     def _extract_title(self, xml_doc):
-        title = ""
-        for xml_entry in xml_doc:
-            local = etree.QName(xml_entry)
-            if local.localname == "title":
-                title = xml_entry.text
-                logger.info("XML file title:%s", title)
-                break
-        if title == "":
+        title = MMDRecord.of(xml_doc).title
+        if title != "":
+            logger.info("XML file title:%s", title)
+        else:
             logger.warning("No title found in XML file")
         self._file_title_en = title
+        if self._doc is not None:
+            self._doc.title = title
 
 
 # END Class Worker
@@ -36,12 +36,33 @@ class Config():
         self.distributor_cache = None
         self.rejected_jobs_path = None
         self.max_permitted_size = 100000  # Size of files permitted through API
+        self.max_bulk_size = 100000000  # Size of bulk requests permitted through API
+        self.max_bulk_documents = 10000
+        self.bulk_batch_size = 100  # Documents sent to the distributors together
         self.mmd_xsl_path = None
         self.mmd_xsd_path = None
         self.path_to_parent_list = None
+        self.vocab_ttl = 86400  # Seconds before the vocabularies are reloaded
+        self.concurrent_distributors = False
+        self.distributor_timeout = None  # Seconds each distributor may run
+        self.distributor_dependencies = {}  # Distributors that must finish first
+        self.distributor_pool_size = 16  # Threads shared by the concurrent distributors
+        self.async_mode = False
+        self.async_workers = 2  # Job runner threads per process
+        self.job_retention = 86400  # Seconds to keep the status of finished jobs
+        self.skip_unchanged = False  # Skip updates identical to the last distributed one
+        self.distribution_journal = False  # Resume interrupted jobs on restart
+        self.journal_ttl = 86400  # Seconds an interrupted job can be resumed
 
         # PyCSW Distributor
         self.csw_service_url = None
+        self.csw_pool_size = 10
+        self.csw_connect_timeout = 5  # Seconds
+        self.csw_read_timeout = 60  # Seconds
+        self.csw_batch_size = 1  # Records per transaction, 1 disables batching
+        self.csw_batch_wait = 0.05  # Seconds a record may wait for its batch
+        self.csw_batch_timeout = 300  # Seconds a record may wait for its result
+        self.csw_native_update = True  # Try csw:Update before delete and insert
 
         # Environment-dependent web catalog url
         self.catalog_url = None
@@ -50,11 +71,25 @@ class Config():
 
         # File Distributor
         self.file_archive_path = None
+        self.file_durability = "full"  # One of none, file or full
+        self.file_manifest = False
+        self.file_manifest_path = None  # The manifest database, on a local disk
+        self.file_versions = False
+        self.file_shard_positions = [7, 6, 5]  # Positions in the uuid hex, one per level
+        self.file_shard_width = 1  # Hex characters per level
+        self.file_previous_shard_positions = None  # Set while migrating the archive
+        self.file_previous_shard_width = 1
 
         # SolR Distributor
         self.solr_service_url = None
         self.solr_username = None
         self.solr_password = None
+        self.solr_pool_size = 10
+        self.solr_batch_size = 1  # Requests per add, 1 disables batching
+        self.solr_batch_wait = 0.05  # Seconds a request may wait for its batch
+        self.solr_batch_timeout = 300  # Seconds a request may wait for its result
+        self.solr_commit_within = None  # Milliseconds, None leaves commits to SolR
+        self.solr_soft_commit = False
         self.authentication = None
         self.fail_on_missing_parent = True
         self.commit_on_delete = False
@@ -107,9 +142,29 @@ class Config():
         self.distributor_cache = conf.get("distributor_cache", self.distributor_cache)
         self.rejected_jobs_path = conf.get("rejected_jobs_path", self.rejected_jobs_path)
         self.max_permitted_size = conf.get("max_permitted_size", self.max_permitted_size)
+        self.max_bulk_size = conf.get("max_bulk_size", self.max_bulk_size)
+        self.max_bulk_documents = conf.get("max_bulk_documents", self.max_bulk_documents)
+        self.bulk_batch_size = conf.get("bulk_batch_size", self.bulk_batch_size)
         self.mmd_xsl_path = conf.get("mmd_xsl_path", self.mmd_xsl_path)
         self.mmd_xsd_path = conf.get("mmd_xsd_path", self.mmd_xsd_path)
         self.path_to_parent_list = conf.get("path_to_parent_list", self.path_to_parent_list)
+        self.vocab_ttl = conf.get("vocab_ttl", self.vocab_ttl)
+        self.concurrent_distributors = conf.get(
+            "concurrent_distributors", self.concurrent_distributors
+        )
+        self.distributor_timeout = conf.get("distributor_timeout", self.distributor_timeout)
+        self.distributor_pool_size = conf.get(
+            "distributor_pool_size", self.distributor_pool_size
+        )
+        self.distributor_dependencies = conf.get(
+            "distributor_dependencies", self.distributor_dependencies
+        )
+        self.async_mode = conf.get("async_mode", self.async_mode)
+        self.async_workers = conf.get("async_workers", self.async_workers)
+        self.job_retention = conf.get("job_retention", self.job_retention)
+        self.skip_unchanged = conf.get("skip_unchanged", self.skip_unchanged)
+        self.distribution_journal = conf.get("distribution_journal", self.distribution_journal)
+        self.journal_ttl = conf.get("journal_ttl", self.journal_ttl)
 
         return
 
@@ -118,6 +173,13 @@ class Config():
         conf = self._raw_conf.get("pycsw", {})
 
         self.csw_service_url = conf.get("csw_service_url", self.csw_service_url)
+        self.csw_pool_size = conf.get("csw_pool_size", self.csw_pool_size)
+        self.csw_connect_timeout = conf.get("csw_connect_timeout", self.csw_connect_timeout)
+        self.csw_read_timeout = conf.get("csw_read_timeout", self.csw_read_timeout)
+        self.csw_batch_size = conf.get("csw_batch_size", self.csw_batch_size)
+        self.csw_batch_wait = conf.get("csw_batch_wait", self.csw_batch_wait)
+        self.csw_batch_timeout = conf.get("csw_batch_timeout", self.csw_batch_timeout)
+        self.csw_native_update = conf.get("csw_native_update", self.csw_native_update)
 
         return
 
@@ -129,6 +191,12 @@ class Config():
         self.commit_on_delete = conf.get("commit_on_delete", self.commit_on_delete)
         self.solr_username = conf.get("solr_username", self.solr_username)
         self.solr_password = conf.get("solr_password", self.solr_password)
+        self.solr_pool_size = conf.get("solr_pool_size", self.solr_pool_size)
+        self.solr_batch_size = conf.get("solr_batch_size", self.solr_batch_size)
+        self.solr_batch_wait = conf.get("solr_batch_wait", self.solr_batch_wait)
+        self.solr_batch_timeout = conf.get("solr_batch_timeout", self.solr_batch_timeout)
+        self.solr_commit_within = conf.get("solr_commit_within", self.solr_commit_within)
+        self.solr_soft_commit = conf.get("solr_soft_commit", self.solr_soft_commit)
 
         return
 
@@ -146,6 +214,18 @@ class Config():
         conf = self._raw_conf.get("file", {})
 
         self.file_archive_path = conf.get("file_archive_path", self.file_archive_path)
+        self.file_durability = conf.get("file_durability", self.file_durability)
+        self.file_manifest = conf.get("file_manifest", self.file_manifest)
+        self.file_manifest_path = conf.get("file_manifest_path", self.file_manifest_path)
+        self.file_versions = conf.get("file_versions", self.file_versions)
+        self.file_shard_positions = conf.get("file_shard_positions", self.file_shard_positions)
+        self.file_shard_width = conf.get("file_shard_width", self.file_shard_width)
+        self.file_previous_shard_positions = conf.get(
+            "file_previous_shard_positions", self.file_previous_shard_positions
+        )
+        self.file_previous_shard_width = conf.get(
+            "file_previous_shard_width", self.file_previous_shard_width
+        )
 
         return
 
@@ -164,11 +244,93 @@ class Config():
         if "pycsw" in self.call_distributors:
             valid &= self._check_file_exists(self.mmd_xsl_path, "mmd_xsl_path")
 
+        workers_ok = isinstance(self.async_workers, int) and self.async_workers > 0
+        if self.async_mode and not workers_ok:
+            logger.error("Config value 'async_workers' must be a positive integer")
+            valid = False
+
+        pool_ok = isinstance(self.distributor_pool_size, int) and self.distributor_pool_size > 0
+        if self.concurrent_distributors and not pool_ok:
+            logger.error("Config value 'distributor_pool_size' must be a positive integer")
+            valid = False
+
+        valid &= self._check_dependencies(
+            self.distributor_dependencies, "distributor_dependencies"
+        )
+
         if "file" in self.call_distributors:
             valid &= self._check_folder_exists(self.file_archive_path, "file_archive_path")
 
+        if self.file_manifest:
+            if not isinstance(self.file_manifest_path, str):
+                logger.error("Config value 'file_manifest_path' must be set")
+                valid = False
+            else:
+                valid &= self._check_folder_exists(
+                    os.path.dirname(os.path.abspath(self.file_manifest_path)),
+                    "file_manifest_path"
+                )
+
+        if self.file_durability not in ("none", "file", "full"):
+            logger.error("Config value 'file_durability' must be 'none', 'file' or 'full'")
+            valid = False
+
+        valid &= self._check_shard_layout(
+            self.file_shard_positions, self.file_shard_width, "file_shard"
+        )
+        if self.file_previous_shard_positions is not None:
+            valid &= self._check_shard_layout(
+                self.file_previous_shard_positions, self.file_previous_shard_width,
+                "file_previous_shard"
+            )
+
         return valid
 
+    def _check_dependencies(self, depends, setting):
+        """Check that a dependency mapping has lists of names as values,
+        and that it has no circular dependencies.
+        """
+        if depends is None:
+            return True
+        if not isinstance(depends, dict):
+            logger.error("Config value '%s' must be a mapping", setting)
+            return False
+        for name, deps in depends.items():
+            if not isinstance(deps, list):
+                logger.error("Config value '%s' must list the dependencies of '%s'",
+                             setting, name)
+                return False
+
+        def is_circular(name, stack):
+            if name in stack:
+                return True
+            return any(is_circular(dep, stack + [name]) for dep in depends.get(name, []))
+
+        for name in depends:
+            if is_circular(name, []):
+                logger.error("Config value '%s' has circular dependencies for '%s'",
+                             setting, name)
+                return False
+        return True
+
+    def _check_shard_layout(self, positions, width, setting):
+        """Check that an archive layout only uses characters of the 32
+        character hex of a uuid, and if not report error.
+        """
+        def is_int(value):
+            return isinstance(value, int) and not isinstance(value, bool)
+
+        valid = is_int(width) and width > 0
+        valid = valid and isinstance(positions, list) and len(positions) > 0
+        valid = valid and all(is_int(pos) and 0 <= pos <= 32 - width for pos in positions)
+        if not valid:
+            logger.error(
+                "Config values '%s_positions' and '%s_width' must select characters "
+                "of a 32 character uuid hex", setting, setting
+            )
+            return False
+        return True
+
     def _check_file_exists(self, path, setting):
         """Check if a file exists, and if not report error."""
         if not isinstance(path, str):
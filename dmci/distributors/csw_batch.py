@@ -0,0 +1,185 @@
+"""
+DMCI : CSW Transaction
+======================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import logging
+
+from xml.sax.saxutils import escape
+
+logger = logging.getLogger(__name__)
+
+
+class CSWTransaction():
+    """Builds a single CSW Transaction from a number of entries. Each
+    entry is a group of Delete, Insert and Update operations that
+    succeeds or fails as one, for instance the delete and insert of an
+    update. pyCSW only reports how many records a transaction deleted,
+    so a delete can only be checked in a transaction of its own.
+    """
+
+    HEADER = (
+        b'<?xml version="1.0" encoding="UTF-8"?>'
+        b'<csw:Transaction xmlns:ogc="http://www.opengis.net/ogc" '
+        b'xmlns:csw="http://www.opengis.net/cat/csw/2.0.2" '
+        b'xmlns:ows="http://www.opengis.net/ows" '
+        b'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+        b'xsi:schemaLocation="http://www.opengis.net/cat/csw/2.0.2 '
+        b'http://schemas.opengis.net/csw/2.0.2/CSW-publication.xsd" '
+        b'service="CSW" version="2.0.2">'
+    )
+    FOOTER = b'</csw:Transaction>'
+
+    def __init__(self):
+
+        self._operations = []
+        self._entries = []
+        self._args = []
+
+        return
+
+    def __len__(self):
+        return len(self._entries)
+
+    ##
+    #  Methods
+    ##
+
+    def add(self, deletes=(), inserts=(), updates=()):
+        """Add an entry to the transaction. The deletes of an entry are
+        run before its inserts, and the updates last.
+
+        Parameters
+        ----------
+        deletes : list of str
+            The identifiers of the records to delete
+        inserts : list of tuple
+            The identifier and ISO19139 bytes of each record to insert
+        updates : list of tuple
+            The identifier and ISO19139 bytes of each record to replace
+
+        Returns
+        -------
+        int
+            The index of the entry
+        """
+        for identifier in deletes:
+            self._operations.append(self.delete_operation(identifier))
+        for _, record in inserts:
+            self._operations.append(b"<csw:Insert>" + record + b"</csw:Insert>")
+        for _, record in updates:
+            self._operations.append(b"<csw:Update>" + record + b"</csw:Update>")
+
+        self._entries.append((
+            list(deletes),
+            [identifier for identifier, _ in inserts],
+            [identifier for identifier, _ in updates],
+        ))
+        self._args.append({
+            "deletes": list(deletes), "inserts": list(inserts), "updates": list(updates),
+        })
+
+        return len(self._entries) - 1
+
+    def entry(self, index):
+        """Return a transaction holding only one of the entries."""
+        transaction = CSWTransaction()
+        transaction.add(**self._args[index])
+        return transaction
+
+    def to_xml(self):
+        """Return the complete Transaction document."""
+        return self.HEADER + b"".join(self._operations) + self.FOOTER
+
+    def expected(self):
+        """Return the number of records to be inserted and deleted."""
+        n_ins = sum(len(inserts) for _, inserts, _ in self._entries)
+        n_del = sum(len(deletes) for deletes, _, _ in self._entries)
+        return n_ins, n_del
+
+    def results(self, summary, text):
+        """Work out the result of each entry from the summary of the
+        transaction response. Inserts are matched by the identifiers
+        in the InsertResult element. pyCSW only reports the number of
+        deleted and updated records, so the deletes or updates of all
+        entries succeed only if all records were deleted or updated.
+
+        Parameters
+        ----------
+        summary : dict
+            The transaction summary as returned by
+            PyCSWDist._read_transaction_summary
+        text : str
+            The response text, returned as the message of each entry
+
+        Returns
+        -------
+        list of tuple
+            A (status, msg) tuple per entry
+        """
+        n_ins, n_del = self.expected()
+        n_upd = sum(len(updates) for _, _, updates in self._entries)
+        inserted = summary["identifiers"]
+        all_inserted = summary["total_inserted"] >= n_ins
+        all_deleted = summary["total_deleted"] >= n_del
+        all_updated = summary["total_updated"] >= n_upd
+
+        results = []
+        for deletes, inserts, updates in self._entries:
+            if summary["error"] is not None:
+                results.append((False, text))
+                continue
+            if deletes and not all_deleted:
+                results.append((False, "Only %d of %d records were deleted: %s" % (
+                    summary["total_deleted"], n_del, text
+                )))
+                continue
+            missing = [
+                identifier for identifier in inserts
+                if (identifier not in inserted if inserted is not None else not all_inserted)
+            ]
+            if missing:
+                results.append((False, "Record %s was not inserted: %s" % (
+                    ", ".join(missing), text
+                )))
+                continue
+            if updates and not all_updated:
+                results.append((False, "Only %d of %d records were updated: %s" % (
+                    summary["total_updated"], n_upd, text
+                )))
+                continue
+            results.append((True, text))
+
+        return results
+
+    @staticmethod
+    def delete_operation(identifier):
+        """Return the Delete operation for a record identifier."""
+        return (
+            '<csw:Delete>'
+            '<csw:Constraint version="1.1.0">'
+            '<ogc:Filter>'
+            '<ogc:PropertyIsEqualTo>'
+            '<ogc:PropertyName>apiso:Identifier</ogc:PropertyName>'
+            '<ogc:Literal>%s</ogc:Literal>'
+            '</ogc:PropertyIsEqualTo>'
+            '</ogc:Filter>'
+            '</csw:Constraint>'
+            '</csw:Delete>'
+        ).encode("utf-8") % escape(identifier).encode("utf-8")
+
+# END Class CSWTransaction
@@ -24,6 +24,8 @@ import logging
 from enum import Enum
 
 from dmci import CONFIG
+from dmci.tools import MMDDocument
+from dmci.tools.parent_list import get_parent_list
 
 logger = logging.getLogger(__name__)
 
@@ -46,9 +48,10 @@ class Distributor():
 
         self._cmd = None
         self._xml_file = None
-        self._path_to_parent_list = None
+        self._parent_list = None
         self._metadata_UUID = None
         self._worker = worker
+        self._doc = kwargs.get("doc", None)
         self._kwargs = kwargs
 
         tmpcmd = str(cmd).upper()
@@ -83,13 +86,11 @@ class Distributor():
             self._valid = False
             return
 
-        self._path_to_parent_list = kwargs.get('path_to_parent_list', None)
-        if self._path_to_parent_list is not None:
-            if os.path.isfile(kwargs['path_to_parent_list']):
-                self._path_to_parent_list = kwargs['path_to_parent_list']
-                self._valid = True
-            else:
-                logger.error("File does not exist: %s" % str(kwargs['path_to_parent_list']))
+        # The parent list is loaded once per process, not per distributor
+        path_to_parent_list = kwargs.get("path_to_parent_list", None)
+        if path_to_parent_list is not None:
+            self._parent_list = get_parent_list(path_to_parent_list)
+            if self._parent_list is None:
                 self._valid = False
                 return
 
@@ -110,6 +111,24 @@ class Distributor():
         """The main run function to be implemented in each subclass."""
         raise NotImplementedError
 
+    @classmethod
+    def run_batch(cls, dists):
+        """Run a batch of jobs of the same distributor type. Subclasses
+        that can send several jobs in one request to their service
+        override this. By default, the jobs are run one by one.
+
+        Parameters
+        ----------
+        dists : list of Distributor
+            The valid distributor objects of the batch
+
+        Returns
+        -------
+        list of tuple
+            A (status, msg) tuple per job, in the same order
+        """
+        return [dist.run() for dist in dists]
+
     ##
     #  Getters
     ##
@@ -117,6 +136,18 @@ class Distributor():
     def is_valid(self):
         return self._valid
 
+    ##
+    #  Internal Functions
+    ##
+
+    def _get_doc(self):
+        """Return the parsed document. If the distributor was not given
+        one, the xml file is parsed on first use.
+        """
+        if self._doc is None:
+            self._doc = MMDDocument.from_file(self._xml_file)
+        return self._doc
+
     @staticmethod
     def _construct_identifier(namespace, metadata_id):
         """Helper function to construct identifier from namespace and
@@ -23,16 +23,34 @@ import shutil
 import logging
 
 from dmci.distributors.distributor import Distributor, DistCmd
+from dmci.distributors.file_history import FileHistory
+from dmci.distributors.file_manifest import (
+    FileManifest, get_file_manifest, start_manifest_rebuild,
+)
+from dmci.distributors.file_shards import ShardLayout, move_archived
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 logger = logging.getLogger(__name__)
 
+# The Linux ioctl that clones a file on file systems with reflinks
+FICLONE = 0x40049409
+
 
-def get_folder_names(fileUUID):
-    lvlA = "arch_%s" % fileUUID.hex[7]
-    lvlB = "arch_%s" % fileUUID.hex[6]
-    lvlC = "arch_%s" % fileUUID.hex[5]
+def get_folder_names(fileUUID, layout=None):
+    if layout is None:
+        layout = ShardLayout()
+    return tuple(layout.folder_names(fileUUID))
 
-    return lvlA, lvlB, lvlC
+
+def get_archive_file(archivePath, fileUUID, layout=None):
+    """Return the path of the archived file with a given uuid."""
+    if layout is None:
+        layout = ShardLayout()
+    return layout.file_path(archivePath, fileUUID)
 
 
 class FileDist(Distributor):
@@ -40,6 +58,14 @@ class FileDist(Distributor):
     def __init__(self, cmd, xml_file=None, metadata_UUID=None, **kwargs):
         super().__init__(cmd, xml_file, metadata_UUID, **kwargs)
 
+        # Folders to sync at the end of a batch, or None to sync them
+        # right away
+        self._batch_folders = None
+
+        # Manifest changes to record at the end of a batch, or None to
+        # record them right away
+        self._batch_changes = None
+
         return
 
     def run(self):
@@ -58,6 +84,29 @@ class FileDist(Distributor):
 
         return status, msg
 
+    @classmethod
+    def run_batch(cls, dists):
+        """Run a batch of jobs. With full durability, each archive
+        folder is synced once at the end of the batch instead of once
+        per file. The changes are recorded in the manifest in one
+        transaction.
+        """
+        folders = set()
+        changes = []
+        for dist in dists:
+            dist._batch_folders = folders
+            dist._batch_changes = changes
+
+        results = [dist.run() for dist in dists]
+
+        for folder in sorted(folders):
+            cls._fsync_folder(folder)
+
+        if changes:
+            dists[0]._apply_changes(changes)
+
+        return results
+
     ##
     #  Internal Functions
     ##
@@ -81,8 +130,10 @@ class FileDist(Distributor):
 
         fileName, archPath = self._make_full_path(fileUUID)
         archFile = os.path.join(archPath, fileName)
+        if not self._move_from_previous_layout(fileUUID, archFile):
+            return False, "Failed to archive file: %s" % fileName
 
-        if os.path.isfile(archFile):
+        if self._is_archived(fileUUID, archFile):
             if self._cmd == DistCmd.UPDATE:
                 status = "replaced"
             else:  # INSERT
@@ -95,6 +146,7 @@ class FileDist(Distributor):
                 logger.error("Cannot update non-existing file: %s", archFile)
                 return False, "Cannot update non-existing file: %s" % fileName
 
+        newFolder = not os.path.isdir(archPath)
         try:
             os.makedirs(archPath, exist_ok=True)
             logger.info("Created folder: %s", archPath)
@@ -103,13 +155,37 @@ class FileDist(Distributor):
             logger.error(str(e))
             return False, "Failed to archive file: %s" % fileName
 
+        # The file is written next to its final path, and then renamed
+        # into place, so the archive never holds a partial file
+        tempFile = None
         try:
-            shutil.copy2(self._xml_file, archFile)
+            tempFile = self._write_temp_file(archPath, fileName)
+            if self._cmd == DistCmd.INSERT:
+                created = self._create_exclusive(tempFile, archFile)
+            else:
+                self._add_to_history(archFile, lambda: os.replace(tempFile, archFile))
+                created = True
         except Exception as e:
             logger.error("Failed to archive file src: %s", self._xml_file)
             logger.error("Failed to archive file dst: %s", archFile)
             logger.error(str(e))
             return False, "Failed to archive file: %s" % fileName
+        finally:
+            if tempFile is not None and os.path.exists(tempFile):
+                os.unlink(tempFile)
+
+        if not created:
+            # Inserted by another request since the check above
+            logger.error("File already exists: %s", archFile)
+            return False, "File already exists: %s" % fileName
+
+        self._sync_folder(archPath)
+        if newFolder:
+            for _ in ShardLayout.from_config(self._conf).positions:
+                archPath = os.path.dirname(archPath)
+                self._sync_folder(archPath)
+
+        self._record_change(status, fileUUID, archFile)
 
         msg = "%s file: %s" % (status.title(), fileName)
         logger.info(msg)
@@ -126,10 +202,12 @@ class FileDist(Distributor):
 
         fileName, archPath = self._make_full_path(fileUUID)
         archFile = os.path.join(archPath, fileName)
+        if not self._move_from_previous_layout(fileUUID, archFile):
+            return False, "Failed to delete file: %s" % fileName
 
-        if os.path.isfile(archFile):
+        if self._is_archived(fileUUID, archFile):
             try:
-                os.unlink(archFile)
+                self._add_to_history(archFile, lambda: os.unlink(archFile))
             except Exception as e:
                 logger.error("Failed to delete file: %s", archFile)
                 logger.error(str(e))
@@ -138,14 +216,256 @@ class FileDist(Distributor):
             logger.error("File not found: %s", archFile)
             return False, "File not found: %s" % fileName
 
+        self._sync_folder(archPath)
+        self._record_change(FileManifest.DELETED, fileUUID, None)
+
         return True, "Deleted file: %s" % fileName
 
+    def _write_temp_file(self, archPath, fileName):
+        """Copy the xml file to a temporary file in the archive folder.
+        A file in the distributor cache on the same file system as the
+        archive is not copied, but hard linked, or reflinked where hard
+        links are not supported. The file is synced unless
+        file_durability is "none".
+        """
+        tempFile = os.path.join(archPath, ".%s.%s.tmp" % (fileName, uuid.uuid4().hex))
+        canLink = self._can_link(archPath)
+        if canLink:
+            try:
+                os.link(self._xml_file, tempFile)
+            except OSError as e:
+                logger.debug("Could not link %s: %s", self._xml_file, str(e))
+            else:
+                if self._conf.file_durability != "none":
+                    self._fsync_file(tempFile)
+                return tempFile
+
+        fd = os.open(tempFile, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            with os.fdopen(fd, mode="wb") as outfile:
+                with open(self._xml_file, mode="rb") as infile:
+                    if not (canLink and self._reflink(infile, outfile)):
+                        shutil.copyfileobj(infile, outfile)
+                if self._conf.file_durability != "none":
+                    outfile.flush()
+                    os.fsync(outfile.fileno())
+            shutil.copystat(self._xml_file, tempFile)
+        except Exception:
+            os.unlink(tempFile)
+            raise
+
+        return tempFile
+
+    def _can_link(self, archPath):
+        """Check if the xml file can share its data with the archive.
+        Only files in the distributor cache are linked, as they are
+        never written to after validation, and only if they are on the
+        same device as the archive folder.
+        """
+        cacheDir = self._conf.distributor_cache
+        if cacheDir is None:
+            return False
+
+        xmlFile = os.path.abspath(self._xml_file)
+        if os.path.dirname(xmlFile) != os.path.abspath(cacheDir):
+            return False
+
+        try:
+            return os.stat(xmlFile).st_dev == os.stat(archPath).st_dev
+        except OSError:
+            return False
+
+    @staticmethod
+    def _reflink(infile, outfile):
+        """Try to make outfile a copy-on-write clone of infile."""
+        if fcntl is None:
+            return False
+        try:
+            fcntl.ioctl(outfile.fileno(), FICLONE, infile.fileno())
+        except OSError:
+            return False
+        return True
+
+    @staticmethod
+    def _create_exclusive(tempFile, archFile):
+        """Move a temporary file to a path that must not exist yet.
+
+        Returns
+        -------
+        bool
+            True if the file was created, False if the path exists
+        """
+        try:
+            os.link(tempFile, archFile)
+        except FileExistsError:
+            return False
+        except OSError:
+            # No hard links on this file system, so reserve the path
+            # with an exclusive create and replace it
+            try:
+                fd = os.open(archFile, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+            except FileExistsError:
+                return False
+            os.close(fd)
+            os.replace(tempFile, archFile)
+
+        return True
+
+    def _sync_folder(self, path):
+        """Sync a folder if file_durability is "full". In a batch, the
+        folder is synced when the batch is done.
+        """
+        if self._conf.file_durability != "full":
+            return
+        if self._batch_folders is not None:
+            self._batch_folders.add(path)
+            return
+        self._fsync_folder(path)
+        return
+
+    @staticmethod
+    def _fsync_file(path):
+        """Flush the data of a file to disk."""
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        return
+
+    @staticmethod
+    def _fsync_folder(path):
+        """Flush the entries of a folder to disk."""
+        try:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except Exception as e:
+            logger.error("Failed to sync folder: %s", path)
+            logger.error(str(e))
+        return
+
+    def _move_from_previous_layout(self, fileUUID, archFile):
+        """While the archive is migrated to a new layout, look for a
+        file that is not found at its new path at its path in the
+        previous layout, and move it to the new path.
+
+        Returns
+        -------
+        bool
+            False if the file was found but could not be moved
+        """
+        previous = ShardLayout.from_config(self._conf, previous=True)
+        if previous is None or os.path.isfile(archFile):
+            return True
+
+        oldFile = previous.file_path(self._conf.file_archive_path, fileUUID)
+        if oldFile == archFile or not os.path.isfile(oldFile):
+            return True
+
+        try:
+            if move_archived(oldFile, archFile):
+                logger.info("Moved file to new archive layout: %s", archFile)
+                self._record_change(FileManifest.MOVED, fileUUID, archFile)
+        except Exception as e:
+            logger.error("Failed to move file to new archive layout: %s", oldFile)
+            logger.error(str(e))
+            return False
+
+        return True
+
+    def _add_to_history(self, archFile, update):
+        """Keep the current version of a file, if file_versions is
+        enabled, and then replace or delete it with update. The history
+        stays locked until the file is updated, so that a concurrent
+        update does not keep the same version twice.
+        """
+        if not self._conf.file_versions:
+            update()
+            return
+        version = FileHistory(archFile, self._conf.file_durability).add(archFile, update)
+        logger.debug("Kept version %d of file: %s", version, archFile)
+        return
+
+    def _is_archived(self, fileUUID, archFile):
+        """Check if a file is in the archive. If the manifest is
+        enabled and complete, it is looked up there instead of in the
+        archive folders.
+        """
+        manifest = self._get_manifest()
+        if manifest is not None:
+            try:
+                if manifest.is_complete():
+                    return manifest.exists(fileUUID)
+            except Exception as e:
+                logger.error("Failed to look up file in archive manifest: %s", fileUUID)
+                logger.error(str(e))
+        return os.path.isfile(archFile)
+
+    def _get_manifest(self):
+        """Return the archive manifest, or None if it is not enabled."""
+        if not self._conf.file_manifest:
+            return None
+        return get_file_manifest(self._conf.file_manifest_path, self._conf.file_durability)
+
+    def _record_change(self, action, fileUUID, archFile):
+        """Record a change to the archive in the manifest, if enabled.
+        In a batch, the change is recorded when the batch is done.
+        """
+        if not self._conf.file_manifest:
+            return
+
+        if archFile is None:
+            change = (action, fileUUID, None, None)
+        else:
+            relPath = os.path.relpath(archFile, self._conf.file_archive_path)
+            change = (action, fileUUID, relPath, os.path.getsize(archFile))
+
+        if self._batch_changes is not None:
+            self._batch_changes.append(change)
+        else:
+            self._apply_changes([change])
+
+        return
+
+    def _apply_changes(self, changes):
+        """Write changes to the manifest. The archived files are not
+        rolled back if this fails. Instead, the manifest is marked as
+        not complete, so that files are looked up in the archive
+        folders, and it is rebuilt from them in the background.
+        """
+        manifest = self._get_manifest()
+        if manifest is None:
+            return
+        try:
+            manifest.apply(changes)
+        except Exception as e:
+            logger.error("Failed to update archive manifest for %d file(s)", len(changes))
+            logger.error(str(e))
+        else:
+            return
+
+        try:
+            manifest.mark_incomplete()
+        except Exception as e:
+            logger.error("Could not mark the archive manifest as out of date")
+            logger.error(str(e))
+            return
+
+        start_manifest_rebuild(
+            self._conf.file_manifest_path, self._conf.file_archive_path,
+            self._conf.file_durability,
+        )
+
+        return
+
     def _make_full_path(self, fileUUID):
         """Make the file name and path for a file with a given uuid."""
-        lvlA, lvlB, lvlC = get_folder_names(fileUUID)
-
-        fileName = str(fileUUID) + ".xml"
-        archPath = os.path.join(self._conf.file_archive_path, lvlA, lvlB, lvlC)
+        layout = ShardLayout.from_config(self._conf)
+        archFile = layout.file_path(self._conf.file_archive_path, fileUUID)
+        archPath, fileName = os.path.split(archFile)
 
         return fileName, archPath
 
@@ -0,0 +1,163 @@
+"""
+DMCI : File Archive History
+===========================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import io
+import os
+import gzip
+import logging
+
+from datetime import datetime, timezone
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from dmci.tools.file_records import read_json_record, write_json_record
+
+logger = logging.getLogger(__name__)
+
+PACK_SUFFIX = ".versions"
+INDEX_SUFFIX = ".versions.json"
+
+
+class FileHistory():
+    """The previous versions of an archived file, kept next to it. Each
+    version is compressed as a separate gzip member and appended to a
+    pack file, and a small index file holds the offset of each member.
+    A version is then read with a single seek, without scanning the
+    pack or the archive folders.
+
+    The index is only replaced once the version is written to the pack,
+    so the data of an interrupted write is never listed. The pack is
+    locked while the current file is read, so concurrent writers each
+    keep a different version.
+    """
+
+    def __init__(self, archFile, durability="full"):
+
+        self._packFile = archFile + PACK_SUFFIX
+        self._indexFile = archFile + INDEX_SUFFIX
+        self._durability = durability
+
+        return
+
+    ##
+    #  Methods
+    ##
+
+    def add(self, srcFile, update=None):
+        """Add a copy of a file to the history as its newest version.
+
+        Parameters
+        ----------
+        srcFile : str
+            The file to add, usually the current archived file
+        update : callable, optional
+            Called before the pack is unlocked, to replace or delete
+            the file that was added
+
+        Returns
+        -------
+        int
+            The number of the new version
+        """
+        with open(self._packFile, mode="ab") as pack:
+            self._lock(pack)
+            with open(srcFile, mode="rb") as infile:
+                data = infile.read()
+            packed = self._compress(data)
+
+            versions = self.versions()
+            offset = pack.seek(0, os.SEEK_END)
+            pack.write(packed)
+            if self._durability != "none":
+                pack.flush()
+                os.fsync(pack.fileno())
+
+            version = versions[-1]["version"] + 1 if versions else 1
+            versions.append({
+                "version": version,
+                "offset": offset,
+                "length": len(packed),
+                "size": len(data),
+                "archived": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            })
+            write_json_record(self._indexFile, versions, sync=self._durability != "none")
+
+            if update is not None:
+                update()
+
+        return version
+
+    def versions(self):
+        """List the previous versions, oldest first.
+
+        Returns
+        -------
+        list of dict
+            The version number, pack offset and length, uncompressed
+            size and archive time of each version
+        """
+        try:
+            return read_json_record(self._indexFile)
+        except FileNotFoundError:
+            return []
+
+    def read(self, version):
+        """Read a previous version.
+
+        Returns
+        -------
+        bytes or None
+            The content of the version, or None if there is no such
+            version
+        """
+        for entry in self.versions():
+            if entry["version"] == version:
+                break
+        else:
+            return None
+
+        with open(self._packFile, mode="rb") as pack:
+            pack.seek(entry["offset"])
+            return gzip.decompress(pack.read(entry["length"]))
+
+    ##
+    #  Internal Functions
+    ##
+
+    @staticmethod
+    def _compress(data):
+        """Compress data to a gzip member with no timestamp, so that
+        the same data is always packed the same way.
+        """
+        buffer = io.BytesIO()
+        with gzip.GzipFile(fileobj=buffer, mode="wb", mtime=0) as member:
+            member.write(data)
+        return buffer.getvalue()
+
+    @staticmethod
+    def _lock(fileObj):
+        """Lock a file against other writers until it is closed."""
+        if fcntl is not None:
+            fcntl.flock(fileObj.fileno(), fcntl.LOCK_EX)
+        return
+
+# END Class FileHistory
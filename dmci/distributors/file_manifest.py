@@ -0,0 +1,366 @@
+"""
+DMCI : File Archive Manifest
+============================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import uuid
+import sqlite3
+import logging
+import threading
+
+from datetime import datetime, timezone
+
+from dmci.tools.file_records import RecordLock
+
+logger = logging.getLogger(__name__)
+
+# The SQLite synchronous setting for each file_durability value
+SYNCHRONOUS = {
+    "none": "OFF",
+    "file": "NORMAL",
+    "full": "FULL",
+}
+
+# Manifests opened in this process, by database path
+_MANIFESTS = {}
+_MANIFESTS_LOCK = threading.Lock()
+
+
+def get_file_manifest(db_path, durability="full"):
+    """Return the archive manifest stored in a given database file.
+    The manifest is opened once per process and shared by all
+    distributors. A new manifest is empty until it has been filled by
+    rebuild_file_manifest().
+
+    Parameters
+    ----------
+    db_path : str
+        The path of the SQLite database file
+    durability : str, optional
+        The file_durability setting, which sets how the manifest is
+        synced to disk
+
+    Returns
+    -------
+    FileManifest or None
+        The manifest, or None if it could not be opened
+    """
+    with _MANIFESTS_LOCK:
+        manifest = _MANIFESTS.get(db_path)
+        if manifest is None:
+            try:
+                manifest = FileManifest(db_path, durability=durability)
+            except Exception as e:
+                logger.error("Could not open archive manifest: %s", db_path)
+                logger.error(str(e))
+                return None
+            _MANIFESTS[db_path] = manifest
+
+    return manifest
+
+
+def rebuild_file_manifest(db_path, archive_path, durability="full"):
+    """Fill a manifest from the files in the archive, unless this has
+    already been done. Only one process rebuilds a manifest at a time,
+    and the others return at once.
+
+    Returns
+    -------
+    bool
+        True if the manifest is complete
+    """
+    manifest = get_file_manifest(db_path, durability)
+    if manifest is None:
+        return False
+
+    lock = RecordLock(db_path)
+    try:
+        if manifest.is_complete():
+            return True
+        if not lock.acquire():
+            logger.info("The archive manifest is being rebuilt by another process")
+            return False
+        if not manifest.is_complete():
+            count = manifest.rebuild(archive_path)
+            logger.info("Added %d archived files to the manifest: %s", count, db_path)
+    except Exception as e:
+        logger.error("Could not rebuild the archive manifest: %s", db_path)
+        logger.error(str(e))
+        return False
+    finally:
+        lock.release()
+
+    return True
+
+
+def start_manifest_rebuild(db_path, archive_path, durability="full"):
+    """Run rebuild_file_manifest() in a background thread.
+
+    Returns
+    -------
+    threading.Thread
+        The started thread
+    """
+    rebuild = threading.Thread(
+        target=rebuild_file_manifest,
+        args=(db_path, archive_path, durability),
+        name="dmci-manifest-rebuild", daemon=True,
+    )
+    rebuild.start()
+    return rebuild
+
+
+class FileManifest():
+    """An index of the files in the file archive, stored in an SQLite
+    database. The records table holds the path, size and modification
+    time of each archived file, and the changes table is an
+    append-only log of every add, replace, delete and move to a new
+    archive folder, so that other services can be reconciled with the
+    archive from a given change on, without walking the archive
+    folders. The meta table records when the manifest was last filled
+    from the archive. Until then, it is not complete, and must not be
+    used to look up files.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS records ("
+        "uuid TEXT PRIMARY KEY, path TEXT NOT NULL, size INTEGER, modified TEXT NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS records_modified ON records (modified)",
+        "CREATE TABLE IF NOT EXISTS changes ("
+        "seq INTEGER PRIMARY KEY AUTOINCREMENT, uuid TEXT NOT NULL, "
+        "action TEXT NOT NULL, time TEXT NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+    )
+
+    ADDED = "added"
+    REPLACED = "replaced"
+    DELETED = "deleted"
+    MOVED = "moved"
+
+    def __init__(self, db_path, durability="full"):
+
+        self._db_path = db_path
+        self._synchronous = SYNCHRONOUS.get(durability, "FULL")
+
+        # SQLite connections may not be shared between threads
+        self._local = threading.local()
+
+        with self._connect() as conn:
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+
+        return
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM records").fetchone()[0]
+
+    ##
+    #  Methods
+    ##
+
+    def apply(self, entries):
+        """Record a number of archive changes in one transaction.
+
+        Parameters
+        ----------
+        entries : list of tuple
+            An (action, uuid, path, size) tuple per change. The path is
+            relative to the archive folder, and the path and size are
+            None for deletes.
+        """
+        now = self._now()
+        with self._connect() as conn:
+            for action, file_uuid, path, size in entries:
+                file_uuid = str(file_uuid)
+                if action == self.DELETED:
+                    conn.execute("DELETE FROM records WHERE uuid = ?", (file_uuid,))
+                else:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO records (uuid, path, size, modified) "
+                        "VALUES (?, ?, ?, ?)", (file_uuid, path, size, now)
+                    )
+                conn.execute(
+                    "INSERT INTO changes (uuid, action, time) VALUES (?, ?, ?)",
+                    (file_uuid, action, now)
+                )
+        return
+
+    def is_complete(self):
+        """Check if the manifest holds all the archived files."""
+        row = self._connect().execute(
+            "SELECT value FROM meta WHERE key = 'complete'"
+        ).fetchone()
+        return row is not None
+
+    def mark_incomplete(self):
+        """Record that archive changes may have been missed, so that
+        the manifest is filled again before it is used.
+        """
+        with self._connect() as conn:
+            conn.execute("DELETE FROM meta WHERE key = 'complete'")
+        return
+
+    def exists(self, file_uuid):
+        """Check if a file is in the archive."""
+        row = self._connect().execute(
+            "SELECT 1 FROM records WHERE uuid = ?", (str(file_uuid),)
+        ).fetchone()
+        return row is not None
+
+    def get(self, file_uuid):
+        """Look up an archived file.
+
+        Returns
+        -------
+        dict or None
+            The uuid, path, size and modified time of the file, or None
+            if it is not in the archive
+        """
+        row = self._connect().execute(
+            "SELECT uuid, path, size, modified FROM records WHERE uuid = ?", (str(file_uuid),)
+        ).fetchone()
+        return self._record(row) if row is not None else None
+
+    def records(self, modified_since=None):
+        """List the archived files, oldest change first.
+
+        Parameters
+        ----------
+        modified_since : str, optional
+            Only list files changed at or after this ISO 8601 time
+
+        Yields
+        ------
+        dict
+            The uuid, path, size and modified time of each file
+        """
+        query = "SELECT uuid, path, size, modified FROM records"
+        params = ()
+        if modified_since is not None:
+            query += " WHERE modified >= ?"
+            params = (modified_since,)
+        query += " ORDER BY modified, uuid"
+
+        for row in self._connect().execute(query, params):
+            yield self._record(row)
+
+    def changes(self, since=0):
+        """List the changes to the archive after a given change.
+
+        Parameters
+        ----------
+        since : int, optional
+            The sequence number of the last change already seen
+
+        Yields
+        ------
+        dict
+            The sequence number, uuid, action and time of each change
+        """
+        rows = self._connect().execute(
+            "SELECT seq, uuid, action, time FROM changes WHERE seq > ? ORDER BY seq", (since,)
+        )
+        for seq, file_uuid, action, time in rows:
+            yield {"seq": seq, "uuid": file_uuid, "action": action, "time": time}
+
+    def rebuild(self, archive_path):
+        """Replace the records with the files found in the archive
+        folders, and mark the manifest as complete. The change log is
+        kept. Files changed while the folders are walked keep the
+        record of the change, so the archive can be used meanwhile.
+
+        Returns
+        -------
+        int
+            The number of archived files found
+        """
+        last_seq = self._connect().execute(
+            "SELECT COALESCE(MAX(seq), 0) FROM changes"
+        ).fetchone()[0]
+
+        files = []
+        for root, dirs, names in os.walk(archive_path):
+            dirs[:] = sorted(d for d in dirs if d.startswith("arch_"))
+            for name in sorted(names):
+                stem, ext = os.path.splitext(name)
+                if ext != ".xml":
+                    continue
+                try:
+                    file_uuid = str(uuid.UUID(stem))
+                except ValueError:
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                modified = datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+                files.append((
+                    file_uuid,
+                    os.path.relpath(path, archive_path),
+                    stat.st_size,
+                    modified.isoformat(timespec="microseconds"),
+                ))
+
+        with self._connect() as conn:
+            changed = set(
+                row[0] for row in conn.execute(
+                    "SELECT uuid FROM changes WHERE seq > ?", (last_seq,)
+                )
+            )
+            conn.execute(
+                "DELETE FROM records WHERE uuid NOT IN "
+                "(SELECT uuid FROM changes WHERE seq > ?)", (last_seq,)
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO records (uuid, path, size, modified) "
+                "VALUES (?, ?, ?, ?)", [entry for entry in files if entry[0] not in changed]
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('complete', ?)",
+                (self._now(),)
+            )
+
+        return len(files)
+
+    ##
+    #  Internal Functions
+    ##
+
+    def _connect(self):
+        """Return the connection of the current thread. Used as a
+        context manager, the connection commits on success and rolls
+        back on error.
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = %s" % self._synchronous)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _record(row):
+        return {"uuid": row[0], "path": row[1], "size": row[2], "modified": row[3]}
+
+    @staticmethod
+    def _now():
+        return datetime.now(timezone.utc).isoformat(timespec="microseconds")
+
+# END Class FileManifest
@@ -0,0 +1,208 @@
+"""
+DMCI : File Archive Sharding
+============================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import uuid
+import logging
+
+from dmci.distributors.file_history import INDEX_SUFFIX, PACK_SUFFIX
+from dmci.distributors.file_manifest import FileManifest
+
+logger = logging.getLogger(__name__)
+
+# Manifest changes are recorded in chunks of this size while migrating
+MIGRATE_CHUNK_SIZE = 1000
+
+
+class ShardLayout():
+    """The folder layout of the file archive. Each folder level is
+    named from a number of hex characters of the file uuid, starting at
+    a given position, so a level with a width of one has 16 folders,
+    and with a width of two 256 folders.
+    """
+
+    def __init__(self, positions=(7, 6, 5), width=1):
+
+        self.positions = tuple(positions)
+        self.width = width
+
+        return
+
+    def __eq__(self, other):
+        if not isinstance(other, ShardLayout):
+            return NotImplemented
+        return self.positions == other.positions and self.width == other.width
+
+    def __repr__(self):
+        return "ShardLayout(positions=%r, width=%d)" % (list(self.positions), self.width)
+
+    ##
+    #  Methods
+    ##
+
+    @classmethod
+    def from_config(cls, conf, previous=False):
+        """Return the layout set in the config, or the previous layout
+        of an archive being migrated, which is None if not set.
+        """
+        if previous:
+            if conf.file_previous_shard_positions is None:
+                return None
+            return cls(conf.file_previous_shard_positions, conf.file_previous_shard_width)
+        return cls(conf.file_shard_positions, conf.file_shard_width)
+
+    def folder_names(self, fileUUID):
+        """Return the folder names of a file uuid, top level first."""
+        return [
+            "arch_%s" % fileUUID.hex[pos:pos + self.width] for pos in self.positions
+        ]
+
+    def file_path(self, archivePath, fileUUID):
+        """Return the path of the archived file with a given uuid."""
+        return os.path.join(
+            archivePath, *self.folder_names(fileUUID), str(fileUUID) + ".xml"
+        )
+
+# END Class ShardLayout
+
+
+def move_archived(oldFile, newFile):
+    """Move an archived file and its history to a new path in the
+    archive. Files are only ever written at the path of the current
+    layout, so if the file is found at both paths, the file at the old
+    path is out of date and is removed.
+
+    Returns
+    -------
+    bool
+        True if the file was moved, False if it was not at the old path
+    """
+    os.makedirs(os.path.dirname(newFile), exist_ok=True)
+
+    # The history is moved first, so it is never left behind. Another
+    # process may be moving the same file, so a file that is gone from
+    # the old path has already been moved.
+    for suffix in (PACK_SUFFIX, INDEX_SUFFIX):
+        if not os.path.isfile(oldFile + suffix):
+            continue
+        if os.path.exists(newFile + suffix):
+            logger.warning("Not moving history, as it exists: %s", newFile + suffix)
+            continue
+        try:
+            os.rename(oldFile + suffix, newFile + suffix)
+        except FileNotFoundError:
+            continue
+
+    try:
+        os.link(oldFile, newFile)
+    except FileNotFoundError:
+        return False
+    except FileExistsError:
+        logger.warning("Removing out of date file: %s", oldFile)
+
+    try:
+        os.unlink(oldFile)
+    except FileNotFoundError:
+        pass
+
+    return True
+
+
+def migrate_archive(archivePath, layout, manifest=None):
+    """Move all archived files that are not in their place in a given
+    layout. The archive can be used while it is migrated, as long as
+    the distributors look up files in both layouts.
+
+    Parameters
+    ----------
+    archivePath : str
+        The root folder of the file archive
+    layout : ShardLayout
+        The layout to move the files to
+    manifest : FileManifest, optional
+        The archive manifest, which is updated with the new paths
+
+    Returns
+    -------
+    moved : int
+        The number of files moved
+    failed : int
+        The number of files that could not be moved
+    """
+    archivePath = os.path.abspath(archivePath)
+    moved = 0
+    failed = 0
+    changes = []
+    oldFolders = set()
+
+    for root, dirs, names in os.walk(archivePath):
+        dirs[:] = sorted(d for d in dirs if d.startswith("arch_"))
+        for name in sorted(names):
+            if name.endswith(".xml"):
+                stem = name[:-4]
+            elif name.endswith(".xml" + INDEX_SUFFIX):
+                # The history of a deleted file
+                stem = name[:-len(".xml" + INDEX_SUFFIX)]
+                if os.path.isfile(os.path.join(root, stem + ".xml")):
+                    continue
+            else:
+                continue
+
+            try:
+                fileUUID = uuid.UUID(stem)
+            except ValueError:
+                continue
+
+            oldFile = os.path.join(root, stem + ".xml")
+            newFile = layout.file_path(archivePath, fileUUID)
+            if os.path.abspath(oldFile) == os.path.abspath(newFile):
+                continue
+
+            try:
+                if move_archived(oldFile, newFile):
+                    moved += 1
+                    changes.append((
+                        FileManifest.MOVED, fileUUID,
+                        os.path.relpath(newFile, archivePath), os.path.getsize(newFile),
+                    ))
+                oldFolders.add(root)
+            except Exception as e:
+                logger.error("Failed to move file: %s", oldFile)
+                logger.error(str(e))
+                failed += 1
+
+            if manifest is not None and len(changes) >= MIGRATE_CHUNK_SIZE:
+                manifest.apply(changes)
+                changes = []
+
+    if manifest is not None and changes:
+        manifest.apply(changes)
+
+    # Remove the folders of the old layout that are now empty
+    for folder in sorted(oldFolders, reverse=True):
+        while folder != archivePath:
+            try:
+                os.rmdir(folder)
+            except OSError:
+                break
+            folder = os.path.dirname(folder)
+
+    logger.info("Moved %d archived file(s), %d failed", moved, failed)
+
+    return moved, failed
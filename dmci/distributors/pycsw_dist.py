@@ -17,16 +17,169 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import os
 import uuid
 import logging
 import requests
+import threading
 
 from lxml import etree
+from prometheus_client import Counter
+from requests.adapters import HTTPAdapter
+from urllib.parse import quote, unquote
+from xml.sax.saxutils import escape
 
+from dmci.distributors.csw_batch import CSWTransaction
 from dmci.distributors.distributor import Distributor, DistCmd
+from dmci.tools import RequestBatcher
 
 logger = logging.getLogger(__name__)
 
+XSLT_CACHE_HITS = Counter("xslt_cache_hits", "Number of compiled XSLT cache hits")
+XSLT_CACHE_MISSES = Counter("xslt_cache_misses", "Number of compiled XSLT cache misses")
+
+# URL scheme of the parent list passed to the stylesheet
+PARENT_LIST_SCHEME = "dmci-parent-list:"
+
+
+class _ParentListResolver(etree.Resolver):
+    """Serves the parent list loaded by DMCI to the stylesheet. Instead
+    of the full file, the stylesheet gets a document that holds only
+    the identifier of the record being translated if it is a parent,
+    and no identifiers otherwise.
+    """
+
+    def resolve(self, url, pubid, context):
+        if not url.startswith(PARENT_LIST_SCHEME):
+            return None
+        metadata_id = unquote(url[len(PARENT_LIST_SCHEME):])
+        if metadata_id:
+            doc = "<parent><id>%s</id></parent>" % escape(metadata_id)
+        else:
+            doc = "<parent/>"
+        return self.resolve_string(doc, context)
+
+# END Class _ParentListResolver
+
+
+# Compiled XSLT transforms per stylesheet path, with the stylesheet
+# modification time they were compiled from
+_XSLT_CACHE = {}
+_XSLT_CACHE_LOCK = threading.Lock()
+
+
+def get_xslt_transform(xsl_path):
+    """Return the compiled XSLT transform for a stylesheet. The
+    transform is compiled once per process, and recompiled if the
+    stylesheet has been modified on disk since it was compiled.
+
+    Parameters
+    ----------
+    xsl_path : str
+        Path to the XSLT stylesheet
+
+    Returns
+    -------
+    lxml.etree.XSLT
+        The compiled transform
+    """
+    mtime = os.path.getmtime(xsl_path)
+    with _XSLT_CACHE_LOCK:
+        cached = _XSLT_CACHE.get(xsl_path)
+        if cached is not None and cached[0] == mtime:
+            XSLT_CACHE_HITS.inc()
+            return cached[1]
+
+        XSLT_CACHE_MISSES.inc()
+        parser = etree.XMLParser()
+        parser.resolvers.add(_ParentListResolver())
+        transform = etree.XSLT(etree.parse(xsl_path, parser))
+        _XSLT_CACHE[xsl_path] = (mtime, transform)
+        logger.debug("Compiled XSLT stylesheet: %s", xsl_path)
+
+    return transform
+
+
+# HTTP session used for all transactions in this process, with the
+# process id it was created in
+_CSW_SESSION = None
+_CSW_SESSION_PID = None
+_CSW_SESSION_LOCK = threading.Lock()
+
+
+def get_csw_session(conf):
+    """Return the HTTP session used for PyCSW transactions. The session
+    is created once per process and shared by all PyCSWDist instances,
+    so that connections to PyCSW are kept alive and reused. A forked
+    process gets its own session.
+
+    Parameters
+    ----------
+    conf : Config
+        The config object holding the pool size
+
+    Returns
+    -------
+    requests.Session
+        The shared session
+    """
+    global _CSW_SESSION
+    global _CSW_SESSION_PID
+
+    with _CSW_SESSION_LOCK:
+        if _CSW_SESSION is None or _CSW_SESSION_PID != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=conf.csw_pool_size)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _CSW_SESSION = session
+            _CSW_SESSION_PID = os.getpid()
+            logger.debug("Created PyCSW session with pool size %d", conf.csw_pool_size)
+
+    return _CSW_SESSION
+
+
+# Transaction batcher shared by all PyCSWDist instances in this process
+_CSW_BATCHER = None
+_CSW_BATCHER_LOCK = threading.Lock()
+
+
+def get_csw_batcher(conf):
+    """Return the transaction batcher shared by all PyCSWDist
+    instances. It is created on first use from the batch settings in
+    the config.
+
+    Parameters
+    ----------
+    conf : Config
+        The config object holding the batch settings
+
+    Returns
+    -------
+    RequestBatcher
+        The shared batcher, which takes transaction entries
+    """
+    global _CSW_BATCHER
+
+    def send(entries):
+        transaction = CSWTransaction()
+        for entry in entries:
+            transaction.add(**entry)
+        return PyCSWDist._send_transaction(conf, transaction)
+
+    with _CSW_BATCHER_LOCK:
+        if _CSW_BATCHER is None:
+            _CSW_BATCHER = RequestBatcher(
+                send, conf.csw_batch_size, conf.csw_batch_wait, conf.csw_batch_timeout
+            )
+
+    return _CSW_BATCHER
+
+
+# Services that have answered that csw:Update is not supported, so that
+# updates to them are sent as a delete and an insert straight away
+_CSW_UPDATE_REJECTED = set()
+
 
 class PyCSWDist(Distributor):
 
@@ -62,16 +215,64 @@ class PyCSWDist(Distributor):
 
         return status, msg
 
+    @classmethod
+    def run_batch(cls, dists):
+        """Run a batch of jobs. The inserts are sent to pyCSW in a
+        single Transaction. pyCSW does not report which records a
+        transaction deleted, so each delete is sent on its own, and
+        the record of an update is only inserted if its delete
+        succeeded.
+        """
+        results = [None]*len(dists)
+        valid = [idx for idx, dist in enumerate(dists) if dist.is_valid()]
+        for idx, dist in enumerate(dists):
+            if idx not in valid:
+                results[idx] = dist.run()
+
+        if len(valid) == 1:
+            results[valid[0]] = dists[valid[0]].run()
+            return results
+        if not valid:
+            return results
+
+        transaction = CSWTransaction()
+        entries = {}
+        for idx in valid:
+            dist = dists[idx]
+            if dist._cmd == DistCmd.DELETE:
+                results[idx] = dist._delete()
+                continue
+            if dist._cmd == DistCmd.UPDATE:
+                status, msg = dist._read_metadata_uuid()
+                if status:
+                    status, msg = dist._delete()
+                if not status:
+                    results[idx] = (status, msg)
+                    continue
+            status, entry = dist._make_entry()
+            if not status:
+                results[idx] = (False, entry)
+                continue
+            entries[idx] = transaction.add(**entry)
+
+        if entries:
+            batch_results = cls._send_transaction(dists[0]._conf, transaction)
+            for idx, entry_idx in entries.items():
+                status, msg = batch_results[entry_idx]
+                if status and dists[idx]._cmd == DistCmd.UPDATE:
+                    msg = msg.replace("insert", "update")
+                results[idx] = (status, msg)
+
+        return results
+
     def _translate(self):
         """Convert from MMD to ISO19139, Norwegian INSPIRE profile."""
         result = b""
         try:
-            xml_doc = etree.ElementTree(file=self._xml_file)
-            transform = etree.XSLT(etree.parse(self._conf.mmd_xsl_path))
-            # If the dataset is a parent dataset, the
-            # self._xml_file needs to contain the string "parent"
+            xml_doc = self._get_doc().xml_doc
+            transform = get_xslt_transform(self._conf.mmd_xsl_path)
             new_doc = transform(xml_doc, path_to_parent_list=etree.XSLT.strparam(
-                self._path_to_parent_list))
+                self._parent_list_url(xml_doc)))
             result = etree.tostring(new_doc, pretty_print=False, encoding="utf-8")
         except Exception as e:
             logger.error("Failed to translate MMD to ISO19139")
@@ -79,51 +280,62 @@ class PyCSWDist(Distributor):
 
         return b"" if result is None else result
 
-    def _insert(self):
-        """Insert in pyCSW using a Transaction."""
+    def _parent_list_url(self, xml_doc):
+        """Return the parent list URL for the stylesheet. The URL is
+        resolved by _ParentListResolver, so the stylesheet does not
+        read the parent list file itself.
+        """
+        if self._parent_list is None:
+            return ""
+        metadata_id = xml_doc.findtext("./{*}metadata_identifier")
+        if metadata_id is None or not self._parent_list.is_parent(metadata_id):
+            return PARENT_LIST_SCHEME
+        return PARENT_LIST_SCHEME + quote(metadata_id, safe="")
+
+    def _insert(self, record=None):
+        """Insert in pyCSW using a Transaction. The record is
+        translated unless given.
+        """
+        if record is None:
+            record = self._translate()
+        if self._conf.csw_batch_size > 1:
+            return self._submit_batched(record)
+
         headers = requests.structures.CaseInsensitiveDict()
         headers["Content-Type"] = "application/xml"
         headers["Accept"] = "application/xml"
-        xml = (
-            b'<?xml version="1.0" encoding="UTF-8"?>'
-            b'<csw:Transaction xmlns:csw="http://www.opengis.net/cat/csw/2.0.2" '
-            b'xmlns:ows="http://www.opengis.net/ows" '
-            b'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
-            b'xsi:schemaLocation="http://www.opengis.net/cat/csw/2.0.2 '
-            b'http://schemas.opengis.net/csw/2.0.2/CSW-publication.xsd" '
-            b'service="CSW" version="2.0.2"><csw:Insert>'
-        )
-        xml += self._translate()
-        xml += b"</csw:Insert></csw:Transaction>"
+        transaction = CSWTransaction()
+        transaction.add(inserts=[(None, record)])
+        xml = transaction.to_xml()
         return self._post_request(headers, xml, "insert", self.TOTAL_INSERTED)
 
     def _update(self):
         """Update current entry.
 
-        Note: in pycsw updates are made on elements, not full documents. The
-        way dmci is designed, it is easier to update the full document by first
-        deleting the current entry, then inserting the new version.
+        The full record is replaced with a single csw:Update. If the
+        service answers that it does not support Update, the current
+        entry is deleted and the new version inserted instead.
         """
-        from dmci.api.worker import Worker
-        with open(self._xml_file) as fn:
-            data = fn.read()
-        xml_doc = etree.fromstring(data)
-        namespace, file_uuid = Worker._get_metadata_id(xml_doc)
-        if file_uuid == "":
-            return False, "No UUID found in XML file"
-        if namespace == "":
-            return False, "No namespace found in XML file"
-        try:
-            self._metadata_UUID = uuid.UUID(file_uuid)
-            logger.debug("File UUID: %s", str(file_uuid))
-        except Exception as e:
-            logger.error(str(e))
-            return False, f"Could not parse UUID: {str(file_uuid)}"
+        status, msg = self._read_metadata_uuid()
+        if not status:
+            return status, msg
+
+        record = self._translate()
+
+        # Batched updates are sent as a delete of their own, so that it
+        # can be checked, and a batched insert
+        url = self._conf.csw_service_url
+        batched = self._conf.csw_batch_size > 1
+        if not batched and self._conf.csw_native_update and url not in _CSW_UPDATE_REJECTED:
+            status, msg, fallback = self._native_update(record)
+            if not fallback:
+                return status, msg
+            logger.info("PyCSW does not support Update, using delete and insert instead")
 
         del_status, del_response_text = self._delete()
         if not del_status:
             return del_status, del_response_text
-        ins_status, ins_response_text = self._insert()
+        ins_status, ins_response_text = self._insert(record)
         if not ins_status:
             return ins_status, ins_response_text
         else:
@@ -131,6 +343,57 @@ class PyCSWDist(Distributor):
         # Handle insertion
         return ins_status, response_text
 
+    def _native_update(self, record):
+        """Replace the full record with a csw:Update transaction.
+
+        Parameters
+        ----------
+        record : bytes
+            The translated ISO19139 record
+
+        Returns
+        -------
+        status : bool
+            True if the record was updated
+        msg : str
+            The response text or error message
+        fallback : bool
+            True if the service does not support Update, so that the
+            update should be made with a delete and an insert instead
+        """
+        transaction = CSWTransaction()
+        transaction.add(updates=[(None, record)])
+
+        headers = requests.structures.CaseInsensitiveDict()
+        headers["Content-Type"] = "application/xml"
+        headers["Accept"] = "application/xml"
+        timeout = (self._conf.csw_connect_timeout, self._conf.csw_read_timeout)
+        try:
+            resp = get_csw_session(self._conf).post(
+                self._conf.csw_service_url, headers=headers, data=transaction.to_xml(),
+                timeout=timeout,
+            )
+        except Exception as e:
+            logger.error(str(e))
+            return False, (
+                "%s: service unavailable. Failed to update." % self._conf.csw_service_url
+            ), False
+
+        if self._get_transaction_status(self.TOTAL_UPDATED, resp):
+            logger.debug("update status: True. With response: " + resp.text)
+            return True, resp.text, False
+
+        # Only fall back to delete and insert, and remember the
+        # service, if it does not support Update at all. Any other
+        # failure fails the update.
+        summary = self._read_transaction_summary(resp.text)
+        if summary["error_code"] != "OperationNotSupported":
+            return False, resp.text, False
+
+        _CSW_UPDATE_REJECTED.add(self._conf.csw_service_url)
+
+        return False, resp.text, True
+
     def _delete(self):
         """Delete entry with a specified metadata_id."""
         identifier = self._construct_identifier(self._worker._namespace, self._metadata_UUID)
@@ -139,28 +402,126 @@ class PyCSWDist(Distributor):
         headers = requests.structures.CaseInsensitiveDict()
         headers["Content-Type"] = "application/xml"
         headers["Accept"] = "application/xml"
-        xml_as_string = (
-            '<?xml version="1.0" encoding="UTF-8"?>'
-            '<csw:Transaction xmlns:ogc="http://www.opengis.net/ogc" '
-            'xmlns:csw="http://www.opengis.net/cat/csw/2.0.2" '
-            'xmlns:ows="http://www.opengis.net/ows" '
-            'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
-            'xsi:schemaLocation="http://www.opengis.net/cat/csw/2.0.2 '
-            'http://schemas.opengis.net/csw/2.0.2/CSW-publication.xsd" '
-            'service="CSW" version="2.0.2">'
-            '  <csw:Delete>'
-            '    <csw:Constraint version="1.1.0">'
-            '      <ogc:Filter>'
-            '        <ogc:PropertyIsEqualTo>'
-            '          <ogc:PropertyName>apiso:Identifier</ogc:PropertyName>'
-            '          <ogc:Literal>%s</ogc:Literal>'
-            '        </ogc:PropertyIsEqualTo>'
-            '      </ogc:Filter>'
-            '    </csw:Constraint>'
-            '  </csw:Delete>'
-            '</csw:Transaction>'
-        ) % identifier
-        return self._post_request(headers, xml_as_string, "delete", self.TOTAL_DELETED)
+        transaction = CSWTransaction()
+        transaction.add(deletes=[identifier])
+        xml = transaction.to_xml()
+        return self._post_request(headers, xml, "delete", self.TOTAL_DELETED)
+
+    def _read_metadata_uuid(self):
+        """Set the metadata UUID of an update from the document."""
+        from dmci.api.worker import Worker
+        doc = self._get_doc()
+        if doc.metadata_id is not None:
+            # Already extracted by the worker
+            self._metadata_UUID = doc.metadata_id
+            return True, ""
+
+        namespace, file_uuid = Worker._get_metadata_id(doc.record)
+        if file_uuid == "":
+            return False, "No UUID found in XML file"
+        if namespace == "":
+            return False, "No namespace found in XML file"
+        try:
+            self._metadata_UUID = uuid.UUID(file_uuid)
+            logger.debug("File UUID: %s", str(file_uuid))
+        except Exception as e:
+            logger.error(str(e))
+            return False, f"Could not parse UUID: {str(file_uuid)}"
+
+        return True, ""
+
+    def _make_entry(self, record=None):
+        """Build the transaction entry that inserts the record of the
+        job. The delete of an update is not part of the entry. The
+        record is translated unless given.
+
+        Returns
+        -------
+        status : bool
+            True if the entry could be built
+        entry : dict or str
+            The inserts of the entry, or an error message
+        """
+        if record is None:
+            record = self._translate()
+        identifier = self._get_file_identifier(record)
+        if identifier is None:
+            return False, "Failed to translate MMD to ISO19139"
+
+        return True, {"inserts": [(identifier, record)]}
+
+    def _submit_batched(self, record=None):
+        """Add the job to the shared transaction batch, and wait for
+        its result.
+        """
+        status, entry = self._make_entry(record)
+        if not status:
+            return status, entry
+        return get_csw_batcher(self._conf).submit(entry)
+
+    @classmethod
+    def _send_transaction(cls, conf, transaction):
+        """Send a transaction with several entries to pyCSW. If pyCSW
+        rejects the transaction, or only some of its entries succeed,
+        the failed entries are sent again on their own, so that one bad
+        record does not fail the other entries.
+
+        Returns
+        -------
+        list of tuple
+            A (status, msg) tuple per entry of the transaction
+        """
+        results, answered = cls._post_transaction(conf, transaction)
+        if len(transaction) < 2 or not answered:
+            return results
+
+        for idx, (status, _) in enumerate(results):
+            if not status:
+                results[idx] = cls._post_transaction(conf, transaction.entry(idx))[0][0]
+
+        return results
+
+    @classmethod
+    def _post_transaction(cls, conf, transaction):
+        """Post a transaction to pyCSW.
+
+        Returns
+        -------
+        results : list of tuple
+            A (status, msg) tuple per entry of the transaction
+        answered : bool
+            False if pyCSW could not be reached
+        """
+        headers = requests.structures.CaseInsensitiveDict()
+        headers["Content-Type"] = "application/xml"
+        headers["Accept"] = "application/xml"
+        timeout = (conf.csw_connect_timeout, conf.csw_read_timeout)
+        try:
+            resp = get_csw_session(conf).post(
+                conf.csw_service_url, headers=headers, data=transaction.to_xml(),
+                timeout=timeout,
+            )
+        except Exception as e:
+            logger.error(str(e))
+            msg = "%s: service unavailable. Failed to send transaction." % conf.csw_service_url
+            return [(False, msg)]*len(transaction), False
+
+        if not (resp.status_code >= 200 and resp.status_code < 300):
+            logger.error(resp.text)
+            return [(False, resp.text)]*len(transaction), True
+
+        summary = cls._read_transaction_summary(resp.text)
+        logger.debug("Transaction with %d entries. Response: %s", len(transaction), resp.text)
+        return transaction.results(summary, resp.text), True
+
+    @staticmethod
+    def _get_file_identifier(record):
+        """Read the fileIdentifier of a translated ISO19139 record."""
+        try:
+            root = etree.fromstring(record)
+        except Exception:
+            return None
+        return root.findtext("./{*}fileIdentifier/{*}CharacterString")
 
     def _get_transaction_status(self, key, resp):
         """Check response status, read response text, and get status.
@@ -205,59 +566,92 @@ class PyCSWDist(Distributor):
 
         Returns
         -------
-        dict
-            status of insert, update and delete
+        bool
+            True if at least one record was inserted, updated or
+            deleted, depending on the key
         """
         if key not in self.STATUS:
             logger.error("Input key must be one of: %s", ", ".join(self.STATUS))
             return False
 
-        status = False
+        summary = self._read_transaction_summary(text)
+
+        # In principle, we can insert, update or delete multiple datasets
+        return summary[key] >= 1
+
+    @classmethod
+    def _read_transaction_summary(cls, text):
+        """Read the transaction summary from a pyCSW response. The
+        counts are the totals of all operations in the transaction.
+
+        Parameters
+        ----------
+        text : str
+            xml representation of the pycsw result
+
+        Returns
+        -------
+        dict
+            The total_inserted, total_updated and total_deleted counts,
+            the identifiers of the inserted records (None if they are
+            not listed), and the error message and exception code (None
+            if no error)
+        """
+        summary = {
+            cls.TOTAL_INSERTED: 0,
+            cls.TOTAL_UPDATED: 0,
+            cls.TOTAL_DELETED: 0,
+            "identifiers": None,
+            "error": None,
+            "error_code": None,
+        }
         try:
             root = etree.fromstring(text.encode("utf-8").strip())
         except Exception as e:
             logger.error("Could not parse response XML from PyCSW")
             logger.debug(str(e))
-            return status
+            summary["error"] = "Could not parse response XML from PyCSW"
+            return summary
 
         ns_ows = root.nsmap.get("ows", "")
         ns_csw = root.nsmap.get("csw", "")
 
-        n_ins = "0"
-        n_upd = "0"
-        n_del = "0"
-
         if root.tag == "{%s}ExceptionReport" % ns_ows:
             node = root.find("{%s}Exception" % ns_ows, root.nsmap)
             msg = "Unknown Error"
             if node is not None:
                 msg = node.findtext("{%s}ExceptionText" % ns_ows, "Unknown Error", root.nsmap)
+                summary["error_code"] = node.get("exceptionCode")
             else:
                 msg = "Unknown Error"
             logger.error(msg)
+            summary["error"] = msg
 
         elif root.tag == "{%s}TransactionResponse" % ns_csw:
             node = root.find("{%s}TransactionSummary" % ns_csw, root.nsmap)
             if node is not None:
-                n_ins = node.findtext("{%s}totalInserted" % ns_csw, "0", root.nsmap)
-                n_upd = node.findtext("{%s}totalUpdated" % ns_csw, "0", root.nsmap)
-                n_del = node.findtext("{%s}totalDeleted" % ns_csw, "0", root.nsmap)
+                summary[cls.TOTAL_INSERTED] = int(
+                    node.findtext("{%s}totalInserted" % ns_csw, "0", root.nsmap)
+                )
+                summary[cls.TOTAL_UPDATED] = int(
+                    node.findtext("{%s}totalUpdated" % ns_csw, "0", root.nsmap)
+                )
+                summary[cls.TOTAL_DELETED] = int(
+                    node.findtext("{%s}totalDeleted" % ns_csw, "0", root.nsmap)
+                )
+            if root.find("{%s}InsertResult" % ns_csw) is not None:
+                summary["identifiers"] = {
+                    elem.text.strip()
+                    for elem in root.iterfind(".//{%s}InsertResult//{*}identifier" % ns_csw)
+                    if elem.text
+                }
 
         else:
             msg = "This should not happen"
             logger.error(msg)
+            summary["error"] = msg
 
-        res_dict = {
-            self.TOTAL_INSERTED: n_ins,
-            self.TOTAL_UPDATED: n_upd,
-            self.TOTAL_DELETED: n_del,
-        }
-
-        # In principle, we can insert, update or delete multiple datasets
-        if int(res_dict[key]) >= 1:
-            status = True
-
-        return status
+        return summary
 
     def _post_request(self, headers, xml, cmd, key):
         """Send an HTTP POST request to pyCSW using a Transaction.
@@ -281,8 +675,11 @@ class PyCSWDist(Distributor):
             failed (False), and a string providing additional information about the transaction
             status or error message.
         """
+        timeout = (self._conf.csw_connect_timeout, self._conf.csw_read_timeout)
         try:
-            resp = requests.post(self._conf.csw_service_url, headers=headers, data=xml)
+            resp = get_csw_session(self._conf).post(
+                self._conf.csw_service_url, headers=headers, data=xml, timeout=timeout
+            )
         except Exception as e:
             logger.error(str(e))
             return False, (
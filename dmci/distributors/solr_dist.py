@@ -17,12 +17,19 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import os
+import copy
 import logging
+import requests
+import threading
 
 from solrindexer.indexdata import MMD4SolR, IndexMMD
+from prometheus_client import Counter
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 
 from dmci.distributors.distributor import Distributor, DistCmd
+from dmci.tools import RequestBatcher
 
 logger = logging.getLogger(__name__)
 
@@ -31,6 +38,229 @@ TODO: Maybe read this from env variable SOLRINDEXER_LOGLEVEL?
 """
 logging.getLogger('solrindexer').setLevel(logging.WARNING)
 
+SOLR_CLIENT_CREATED = Counter("solr_client_created", "Number of SolR clients created")
+SOLR_CLIENT_REUSED = Counter("solr_client_reused", "Number of times a SolR client was reused")
+SOLR_CLIENT_RESETS = Counter(
+    "solr_client_resets", "Number of SolR clients dropped after connection errors"
+)
+
+# SolR client used by all SolRDist instances in this process, with the
+# process id and settings it was created with
+_SOLR_CLIENT = None
+_SOLR_CLIENT_KEY = None
+_SOLR_CLIENT_LOCK = threading.Lock()
+
+
+def get_solr_client(conf):
+    """Return the SolR client shared by all SolRDist instances. The
+    client is created on first use, and again if the SolR settings have
+    changed, if the process has been forked, or if it was dropped after
+    a connection error.
+
+    Parameters
+    ----------
+    conf : Config
+        The config object holding the SolR settings
+
+    Returns
+    -------
+    IndexMMD
+        The shared client
+    """
+    global _SOLR_CLIENT
+    global _SOLR_CLIENT_KEY
+
+    key = (os.getpid(), conf.solr_service_url, conf.solr_username, conf.solr_password)
+    with _SOLR_CLIENT_LOCK:
+        if _SOLR_CLIENT is not None and _SOLR_CLIENT_KEY == key:
+            SOLR_CLIENT_REUSED.inc()
+            return _SOLR_CLIENT
+
+        client = IndexMMD(conf.solr_service_url, always_commit=False,
+                          authentication=_init_authentication(conf), config={})
+
+        # Let concurrent requests keep their own connections alive
+        solrc = getattr(client, "solrc", None)
+        if solrc is not None and hasattr(solrc, "get_session"):
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=conf.solr_pool_size)
+            session = solrc.get_session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+
+        _SOLR_CLIENT = client
+        _SOLR_CLIENT_KEY = key
+        SOLR_CLIENT_CREATED.inc()
+        logger.debug("Created SolR client for %s", conf.solr_service_url)
+
+    return client
+
+
+def reset_solr_client():
+    """Drop the shared SolR client so that the next request creates a
+    new one.
+    """
+    global _SOLR_CLIENT
+    global _SOLR_CLIENT_KEY
+
+    with _SOLR_CLIENT_LOCK:
+        if _SOLR_CLIENT is not None:
+            SOLR_CLIENT_RESETS.inc()
+        _SOLR_CLIENT = None
+        _SOLR_CLIENT_KEY = None
+
+    return
+
+
+def _init_authentication(conf):
+    """Return the SolR authentication, if set in the config."""
+    if conf.solr_username is not None and conf.solr_password is not None:
+        return HTTPBasicAuth(conf.solr_username, conf.solr_password)
+    return None
+
+
+def _is_connection_error(error):
+    """Check if an exception was caused by a failed connection. The
+    SolR client wraps these in its own exception type, so the chain of
+    exceptions is searched.
+    """
+    while error is not None:
+        if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def _reset_on_connection_error(error):
+    """Drop the shared SolR client if the error was a connection error."""
+    if _is_connection_error(error):
+        logger.warning("Lost connection to SolR, the client will be recreated")
+        reset_solr_client()
+    return
+
+
+# Add batcher shared by all SolRDist instances in this process
+_SOLR_BATCHER = None
+_SOLR_BATCHER_LOCK = threading.Lock()
+
+
+def get_solr_batcher(conf):
+    """Return the add batcher shared by all SolRDist instances. It is
+    created on first use from the batch settings in the config.
+
+    Parameters
+    ----------
+    conf : Config
+        The config object holding the batch settings
+
+    Returns
+    -------
+    RequestBatcher
+        The shared batcher, which takes the list of documents of a
+        request
+    """
+    global _SOLR_BATCHER
+
+    with _SOLR_BATCHER_LOCK:
+        if _SOLR_BATCHER is None:
+            _SOLR_BATCHER = RequestBatcher(
+                lambda batches: send_solr_docs(conf, batches),
+                conf.solr_batch_size,
+                conf.solr_batch_wait,
+                conf.solr_batch_timeout,
+            )
+
+    return _SOLR_BATCHER
+
+
+def send_solr_docs(conf, batches):
+    """Send the documents of several requests to SolR in one add
+    request, using the commit policy in the config. If SolR rejects
+    the request, the documents of each request are sent again on their
+    own, so that one bad document does not fail the other requests.
+
+    Parameters
+    ----------
+    conf : Config
+        The config object holding the SolR settings
+    batches : list of list
+        The documents of each request
+
+    Returns
+    -------
+    list of tuple
+        A (status, msg) tuple per request
+    """
+    docs = [doc for batch in batches for doc in batch]
+    try:
+        get_solr_client(conf).solrc.add(docs, **_commit_args(conf))
+    except Exception as e:
+        _reset_on_connection_error(e)
+        msg = "Could not add documents to SolR. Reason: %s" % str(e)
+        logger.error(msg)
+        if len(batches) > 1 and not _is_connection_error(e):
+            return [send_solr_docs(conf, [batch])[0] for batch in batches]
+        return [(False, msg)]*len(batches)
+
+    logger.info("Added %d documents from %d requests to SolR", len(docs), len(batches))
+
+    return [(True, "Added %d documents to SolR" % len(batch)) for batch in batches]
+
+
+def _commit_args(conf):
+    """Return the commit arguments of an add request. If no commit
+    policy is set, the documents are committed by the autocommit
+    settings of the SolR core.
+    """
+    args = {}
+    if conf.solr_commit_within is not None:
+        args["commitWithin"] = conf.solr_commit_within
+    if conf.solr_soft_commit:
+        args["softCommit"] = True
+    return args
+
+
+def _collecting_client(client):
+    """Return a copy of an IndexMMD client that collects the documents
+    it indexes instead of sending them, and the collector. If the
+    client does not expose its pysolr client, it is returned as is,
+    with no collector.
+
+    solrindexer has no public API for indexing a document without
+    sending it, so this relies on IndexMMD keeping its pysolr client in
+    the solrc attribute, and on index_record() adding the documents
+    through it. If a later solrindexer no longer has solrc, each job
+    sends its own documents. If index_record() sends them some other
+    way, nothing is collected, and they are already in SolR.
+    """
+    solrc = getattr(client, "solrc", None)
+    if solrc is None:
+        return client, None
+    collector = _SolRAddCollector(solrc)
+    collecting = copy.copy(client)
+    collecting.solrc = collector
+    return collecting, collector
+
+
+class _SolRAddCollector():
+    """Wraps the pysolr client of an IndexMMD object, and collects the
+    documents it is asked to add instead of sending them to SolR. All
+    other calls are passed on to the wrapped client.
+    """
+
+    def __init__(self, solrc):
+        self._solrc = solrc
+        self.docs = []
+        return
+
+    def add(self, docs, **kwargs):
+        self.docs.extend(docs)
+        return
+
+    def __getattr__(self, name):
+        return getattr(self._solrc, name)
+
+# END Class _SolRAddCollector
+
 
 class SolRDist(Distributor):
 
@@ -43,18 +273,26 @@ class SolRDist(Distributor):
 
         super().__init__(cmd, xml_file, metadata_UUID, worker, **kwargs)
 
-        self.authentication = self._init_authentication()
+        # The connection to solr is made on first use
+        self._mysolr = None
+        # Client used for indexing when the job is part of a batch
+        self._batch_client = None
 
-        #  Create connection to solr
-        self.mysolr = IndexMMD(self._conf.solr_service_url, always_commit=False,
-                               authentication=self.authentication, config={})
         return
 
+    @property
+    def mysolr(self):
+        """The shared SolR client."""
+        if self._mysolr is None:
+            self._mysolr = get_solr_client(self._conf)
+        return self._mysolr
+
+    @property
+    def authentication(self):
+        return self._init_authentication()
+
     def _init_authentication(self):
-        if self._conf.solr_username is not None and self._conf.solr_password is not None:
-            return HTTPBasicAuth(self._conf.solr_username,
-                                 self._conf.solr_password)
-        return None
+        return _init_authentication(self._conf)
 
     def run(self):
         """Run function to handle insert, update or delete
@@ -70,15 +308,86 @@ class SolRDist(Distributor):
         if not self.is_valid():
             return False, "The run job is invalid"
 
-        if self._cmd == DistCmd.UPDATE:
-            status, msg = self._add()
-        elif self._cmd == DistCmd.DELETE:
-            status, msg = self._delete()
-        elif self._cmd == DistCmd.INSERT:
-            status, msg = self._add()
+        try:
+            self._mysolr = get_solr_client(self._conf)
+        except Exception as e:
+            msg = "Failed to connect to SolR: %s" % str(e)
+            logger.error(msg)
+            return False, msg
+
+        try:
+            if self._cmd == DistCmd.UPDATE:
+                status, msg = self._add()
+            elif self._cmd == DistCmd.DELETE:
+                status, msg = self._delete()
+            elif self._cmd == DistCmd.INSERT:
+                status, msg = self._add()
+        except Exception as e:
+            _reset_on_connection_error(e)
+            raise
 
         return status, msg
 
+    @classmethod
+    def run_batch(cls, dists):
+        """Run a batch of jobs. Each insert or update is checked and
+        converted as in a single job, but the documents are sent to
+        SolR in a single add request. Deletes are run one by one.
+        """
+        results = [None]*len(dists)
+        adds = []
+        for idx, dist in enumerate(dists):
+            if dist.is_valid() and dist._cmd in (DistCmd.INSERT, DistCmd.UPDATE):
+                adds.append(idx)
+            else:
+                results[idx] = dist.run()
+
+        if len(adds) < 2:
+            for idx in adds:
+                results[idx] = dists[idx].run()
+            return results
+
+        try:
+            client = get_solr_client(dists[0]._conf)
+        except Exception as e:
+            msg = "Failed to connect to SolR: %s" % str(e)
+            logger.error(msg)
+            for idx in adds:
+                results[idx] = (False, msg)
+            return results
+
+        # Index with a copy of the client that collects the documents
+        batch_client, collector = _collecting_client(client)
+        if collector is None:
+            for idx in adds:
+                results[idx] = dists[idx].run()
+            return results
+
+        pending = []
+        for idx in adds:
+            dist = dists[idx]
+            dist._mysolr = client
+            dist._batch_client = batch_client
+            n_docs = len(collector.docs)
+            try:
+                status, msg = dist._add()
+            except Exception as e:
+                _reset_on_connection_error(e)
+                status, msg = False, "Failed to index in SolR: %s" % str(e)
+            finally:
+                dist._batch_client = None
+            if status and len(collector.docs) > n_docs:
+                pending.append((idx, msg, collector.docs[n_docs:]))
+            else:
+                results[idx] = (status, msg)
+
+        if pending:
+            sent = send_solr_docs(dists[0]._conf, [docs for _, _, docs in pending])
+            for (idx, msg, _), (status, error) in zip(pending, sent):
+                results[idx] = (True, msg) if status else (False, error)
+
+        return results
+
     def _add(self):
         """Index to SolR."""
         try:
@@ -120,6 +429,7 @@ class SolRDist(Distributor):
                         fail_on_missing=self._conf.fail_on_missing_parent
                     )
                 except Exception as e:
+                    _reset_on_connection_error(e)
                     msg = "Failed to update parent in SolR.Reason: %s" % str(e)
                     logger.error(msg)
                     return False, msg
@@ -142,19 +452,41 @@ class SolRDist(Distributor):
 
     def _index_record(self, newdoc, add_thumbnail=False, level=1):
         """ Wrapper function to return correct parameters (status and msg).
+        The documents are collected and sent with the commit policy in
+        the config, together with those of other requests if batching
+        is enabled. In a batch job, they are sent by run_batch.
         """
+        if self._batch_client is not None:
+            client, collector = self._batch_client, None
+        else:
+            client, collector = _collecting_client(self.mysolr)
         try:
-            status, msg = self.mysolr.index_record(
+            status, msg = client.index_record(
                 newdoc, addThumbnail=add_thumbnail, level=level)
-            logger.info("Indexed document %s in SolR"
-                        % newdoc['metadata_identifier'])
         except Exception as e:
+            _reset_on_connection_error(e)
             msg = "Could not index file %s, in SolR. Reason: %s" % (
                 self._xml_file, str(e))
             logger.error(msg)
-            status = False
+            return False, msg
+
+        if status and collector is not None and collector.docs:
+            sent, error = self._send_docs(collector.docs)
+            if not sent:
+                return False, error
+
+        logger.info("Indexed document %s in SolR" % newdoc['metadata_identifier'])
+
         return status, msg
 
+    def _send_docs(self, docs):
+        """Send the documents of this job to SolR, through the shared
+        batcher if batching is enabled.
+        """
+        if self._conf.solr_batch_size > 1:
+            return get_solr_batcher(self._conf).submit(docs)
+        return send_solr_docs(self._conf, [docs])[0]
+
     def _delete(self):
         """Delete entry with a specified metadata_id."""
         identifier = self._construct_identifier(self._worker._namespace,
@@ -21,7 +21,19 @@ limitations under the License.
 """
 
 from dmci.tools.check_mmd import CheckMMD
+from dmci.tools.mmd_doc import MMDDocument
+from dmci.tools.mmd_record import MMDRecord
+from dmci.tools.parent_list import ParentList
+from dmci.tools.request_batcher import RequestBatcher
+from dmci.tools.schema_pool import SchemaPool
+from dmci.tools.vocab_registry import VocabRegistry
 
 __all__ = [
     "CheckMMD",
+    "MMDDocument",
+    "MMDRecord",
+    "ParentList",
+    "RequestBatcher",
+    "SchemaPool",
+    "VocabRegistry",
 ]
@@ -19,40 +19,86 @@ limitations under the License.
 
 import logging
 
-from metvocab import CFStandard, MMDVocab
-
 from lxml import etree
+from functools import lru_cache
 from urllib.parse import urlparse
 
+from dmci.tools.mmd_record import MMDRecord
+from dmci.tools.vocab_registry import VOCAB_REGISTRY
+
 logger = logging.getLogger(__name__)
 
+# Number of URL check results kept per process
+URL_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=URL_CACHE_SIZE)
+def _check_url(url, allow_no_path):
+    """Check a URL. The result only depends on the URL, so it is cached
+    and shared by all requests in the process.
+
+    Returns
+    -------
+    bool
+        True if valid, otherwise False
+    tuple of str
+        The error messages
+    """
+    ok = True
+    err = []
+    try:
+        url.encode("ascii")
+    except Exception:
+        err.append("URL contains non-ASCII characters.")
+        ok = False
+
+    try:
+        parsed = urlparse(url)
+        if parsed.scheme not in ("http", "https", "ftp", "sftp"):
+            err.append("URL scheme '%s' not allowed." % parsed.scheme)
+            ok = False
+
+        if not (parsed.netloc and "." in parsed.netloc):
+            err.append("Domain '%s' is not valid." % parsed.netloc)
+            ok = False
+
+        if not (parsed.path or allow_no_path):
+            err.append("URL contains no path. At least '/' is required.")
+            ok = False
+
+    except Exception:
+        err.append("URL cannot be parsed by urllib.")
+        ok = False
+
+    return ok, tuple(err)
+
 
 class CheckMMD():
 
-    def __init__(self):
+    def __init__(self, vocabs=None):
 
         self._status_pass = []
         self._status_fail = []
         self._status_ok = True
 
-        self._cf_standard = CFStandard()
-        self._cf_standard.init_vocab()
+        # The vocabularies are shared by all instances in the process
+        # unless a specific set is provided
+        if vocabs is None:
+            vocabs = VOCAB_REGISTRY.get()
+
+        self._cf_standard = vocabs["cf_standard"]
         self._status_ok &= self._cf_standard.is_initialised
 
-        self._access_constraing = MMDVocab("mmd", "https://vocab.met.no/mmd/Access_Constraint")
-        self._access_constraing.init_vocab()
+        self._access_constraing = vocabs["access_constraint"]
         self._status_ok &= self._access_constraing.is_initialised
 
-        self._activity_type = MMDVocab("mmd", "https://vocab.met.no/mmd/Activity_Type")
-        self._activity_type.init_vocab()
+        self._activity_type = vocabs["activity_type"]
         self._status_ok &= self._activity_type.is_initialised
 
-        self._operational_status = MMDVocab("mmd", "https://vocab.met.no/mmd/Operational_Status")
-        self._operational_status.init_vocab()
+        self._operational_status = vocabs["operational_status"]
         self._status_ok &= self._operational_status.is_initialised
 
-        self._use_constraint = MMDVocab("mmd", "https://vocab.met.no/mmd/Use_Constraint")
-        self._use_constraint.init_vocab()
+        self._use_constraint = vocabs["use_constraint"]
         self._status_ok &= self._use_constraint.is_initialised
 
         return
@@ -149,32 +195,7 @@ class CheckMMD():
         bool
             True if valid, otherwise False
         """
-        ok = True
-        err = []
-        try:
-            url.encode("ascii")
-        except Exception:
-            err.append("URL contains non-ASCII characters.")
-            ok = False
-
-        try:
-            parsed = urlparse(url)
-            if parsed.scheme not in ("http", "https", "ftp", "sftp"):
-                err.append("URL scheme '%s' not allowed." % parsed.scheme)
-                ok = False
-
-            if not (parsed.netloc and "." in parsed.netloc):
-                err.append("Domain '%s' is not valid." % parsed.netloc)
-                ok = False
-
-            if not (parsed.path or allow_no_path):
-                err.append("URL contains no path. At least '/' is required.")
-                ok = False
-
-        except Exception:
-            err.append("URL cannot be parsed by urllib.")
-            ok = False
-
+        ok, err = self._url_result(url, allow_no_path)
         self._log_result(f"URL Check on '{url}'", ok, err)
 
         return ok, err
@@ -184,8 +205,8 @@ class CheckMMD():
 
         Parameters
         ----------
-            xmldoc : :obj:`lxml.ElementTree`
-                The XML tree to validate
+            xmldoc : :obj:`lxml.ElementTree` or :obj:`MMDRecord`
+                The XML tree to validate, or its extracted record
 
         Returns
         -------
@@ -195,12 +216,10 @@ class CheckMMD():
         ok = True
         err = []
 
-        cf_elements = xmldoc.findall(
-            "./{*}keywords[@vocabulary=\"Climate and Forecast Standard Names\"]"
-        )
-        n_cf = len(cf_elements)
+        cf_keywords = MMDRecord.of(xmldoc).cf_keywords
+        n_cf = len(cf_keywords)
         if n_cf == 1:
-            cf_list = [elem.text for elem in cf_elements[0]]
+            cf_list = cf_keywords[0]
             if len(cf_list) > 1:
                 err.append("Only one CF name should be provided, got %d." % len(cf_list))
                 ok &= False
@@ -241,8 +260,9 @@ class CheckMMD():
 
         Parameters
         ----------
-        xmldoc : :obj:`lxml.ElementTree
-            XML element containing the full XML document
+        xmldoc : :obj:`lxml.ElementTree` or :obj:`MMDRecord`
+            XML element containing the full XML document, or its
+            extracted record
 
         Returns
         -------
@@ -261,25 +281,20 @@ class CheckMMD():
         err = []
         num = 0
 
+        found = MMDRecord.of(xmldoc).vocabularies
         for element_name, f_name in vocabularies.items():
-            if element_name == "use_constraint":
-                elems_found = xmldoc.findall("./{*}" + element_name + "/{*}identifier")
-            else:
-                elems_found = xmldoc.findall("./{*}" + element_name)
-
-            if len(elems_found) >= 1:
-                for rep in elems_found:
-                    num += 1
-                    try:
-                        v_ok = f_name(rep.text)
-                        if not v_ok:
-                            err.append("Incorrect vocabulary '%s' for element '%s'." % (
-                                rep.text, element_name
-                            ))
-                            ok &= False
-                    except Exception:
-                        err.append("Internal Error: '%s' vocabulary lookup failed." % element_name)
+            for value in found[element_name]:
+                num += 1
+                try:
+                    v_ok = f_name(value)
+                    if not v_ok:
+                        err.append("Incorrect vocabulary '%s' for element '%s'." % (
+                            value, element_name
+                        ))
                         ok &= False
+                except Exception:
+                    err.append("Internal Error: '%s' vocabulary lookup failed." % element_name)
+                    ok &= False
 
         if num > 0:
             self._log_result("Controlled Vocabularies Check", ok, err)
@@ -296,8 +311,9 @@ class CheckMMD():
 
         Parameters
         ----------
-        doc : :obj:`lxml.ElementTree
-            XML element containing the full XML document
+        doc : :obj:`lxml.ElementTree` or :obj:`MMDRecord`
+            XML element containing the full XML document, or its
+            extracted record
 
         Returns
         -------
@@ -307,27 +323,40 @@ class CheckMMD():
         self.clear()
         valid = True
 
-        # Get elements with urls and check for OK response
-        urls = doc.findall(".//{*}resource")
+        # All checks use the same record, so the document is only
+        # traversed once
+        record = MMDRecord.of(doc)
+
+        # Get elements with urls and check for OK response. Each
+        # distinct URL is checked once, and only failed URLs are listed
+        # one by one, as a record may have hundreds of them.
+        urls = record.resources
         if len(urls) > 0:
             logger.debug("Checking element(s) containing URL ...")
-            for elem in urls:
-                urls_ok, _ = self.check_url(elem.text)
-                valid &= urls_ok
+            n_passed = 0
+            for url in dict.fromkeys(urls):
+                url_ok, err = self._url_result(url)
+                if url_ok:
+                    n_passed += 1
+                    continue
+                self._log_result(f"URL Check on '{url}'", False, err)
+                valid = False
+            if n_passed > 0:
+                self._log_result(f"URL Check on {n_passed} URL(s)", True, [])
 
         # If there is an element geographic_extent/rectangle, check that lat/lon are valid
-        rectangle = doc.findall("./{*}geographic_extent/{*}rectangle")
+        rectangle = record.rectangles
         if len(rectangle) > 0:
             logger.debug("Checking element geographic_extent/rectangle ...")
             rect_ok, _ = self.check_rectangle(rectangle)
             valid &= rect_ok
 
         # Check that cf name provided exist in reference Standard Name Table
-        cf_ok, _, _ = self.check_cf(doc)
+        cf_ok, _, _ = self.check_cf(record)
         valid &= cf_ok
 
         # Check controlled vocabularies
-        voc_ok, _ = self.check_vocabulary(doc)
+        voc_ok, _ = self.check_vocabulary(record)
         valid &= voc_ok
 
         return valid
@@ -336,6 +365,16 @@ class CheckMMD():
     #  Internal Functions
     ##
 
+    @staticmethod
+    def _url_result(url, allow_no_path=False):
+        """Return the cached result of a URL check."""
+        try:
+            ok, err = _check_url(url, allow_no_path)
+        except TypeError:
+            # Not hashable, so it can't be cached
+            ok, err = _check_url.__wrapped__(url, allow_no_path)
+        return ok, list(err)
+
     def _log_result(self, check, ok, err):
         """Write the result of a check to the status variables."""
         if ok:
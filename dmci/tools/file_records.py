@@ -0,0 +1,149 @@
+"""
+DMCI : File Record Tools
+========================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import json
+import logging
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+def write_atomic(path, data, sync=True):
+    """Write a file in one step. The data is written to a temporary
+    file next to it, which then replaces the file, so that the file is
+    never read half-written.
+
+    Parameters
+    ----------
+    path : str
+        The file to write
+    data : str or bytes
+        The content of the file
+    sync : bool, optional
+        Sync the data to disk before the file is replaced, so that it
+        also survives a crash
+    """
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    mode = "wb" if isinstance(data, bytes) else "w"
+    encoding = None if isinstance(data, bytes) else "utf-8"
+    try:
+        with open(temp_path, mode=mode, encoding=encoding) as outfile:
+            outfile.write(data)
+            if sync:
+                outfile.flush()
+                os.fsync(outfile.fileno())
+        os.replace(temp_path, path)
+    except Exception:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+    return
+
+
+def read_json_record(path):
+    """Read a JSON record written by write_json_record()."""
+    with open(path, mode="r", encoding="utf-8") as infile:
+        return json.load(infile)
+
+
+def write_json_record(path, record, sync=True):
+    """Write a JSON record in one step, see write_atomic()."""
+    write_atomic(path, json.dumps(record), sync=sync)
+    return
+
+
+class RecordLock():
+    """An exclusive lock on a record file, held by the process that
+    owns the record. The lock is a flock on a lock file next to the
+    record, so the kernel releases it when the owner exits, however it
+    exits. Unlike a host name and pid, this also holds when the owner
+    runs in a container that is replaced, and when a pid is reused.
+
+    Without flock, the lock is always taken, so a record can then only
+    be taken over safely when no other process uses it.
+    """
+
+    SUFFIX = ".lock"
+
+    def __init__(self, path):
+
+        self._lock_path = path + self.SUFFIX
+        self._fd = None
+
+        return
+
+    ##
+    #  Methods
+    ##
+
+    def acquire(self):
+        """Take the lock without waiting.
+
+        Returns
+        -------
+        bool
+            True if the lock was taken, False if another process or
+            lock object holds it
+        """
+        if self._fd is not None:
+            return True
+
+        while True:
+            fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+            if fcntl is None:
+                self._fd = fd
+                return True
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return False
+
+            # The previous owner may have removed the lock file while
+            # we were waiting for it, in which case it is taken again
+            try:
+                current = os.stat(self._lock_path).st_ino == os.fstat(fd).st_ino
+            except FileNotFoundError:
+                current = False
+            if current:
+                self._fd = fd
+                return True
+            os.close(fd)
+
+    def release(self):
+        """Remove the lock file and release the lock."""
+        if self._fd is None:
+            return
+        try:
+            os.unlink(self._lock_path)
+        except FileNotFoundError:
+            pass
+        os.close(self._fd)
+        self._fd = None
+        return
+
+# END Class RecordLock
@@ -0,0 +1,161 @@
+"""
+DMCI : MMD Document
+===================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import re
+import logging
+
+from lxml import etree
+
+from dmci.tools.mmd_record import MMDRecord
+
+logger = logging.getLogger(__name__)
+
+# The XML declaration and the whitespace that follows it
+XML_DECLARATION = re.compile(rb"^\s*<\?xml[^>]*\?>\s*")
+
+# Bytes read from each end of a file to find its declaration and tail
+EDGE_SIZE = 256
+
+
+class MMDDocument():
+    """A parsed MMD document that is passed between the processing
+    stages of a single request. It holds both the raw bytes and the
+    parsed XML tree, and only converts between the two when one of them
+    has been changed. A document read from a file is parsed directly
+    from the file, and its bytes are only read if they are requested.
+    """
+
+    def __init__(self, data=None, path=None):
+
+        if data is None and path is not None:
+            with open(path, mode="rb") as infile:
+                head = infile.read(EDGE_SIZE)
+                infile.seek(max(0, infile.seek(0, 2) - EDGE_SIZE))
+                tail = infile.read()
+                infile.seek(0)
+                self._xml_doc = etree.parse(infile).getroot()
+        elif isinstance(data, bytes):
+            head = tail = data
+            self._xml_doc = etree.fromstring(data)
+        else:
+            raise TypeError("Input must be bytes type")
+
+        self._data = data
+        self._path = path
+        self._modified = False
+        self._record = None
+
+        self._prolog = b""
+        self._tail = b""
+        self._keep_edges(head, tail)
+
+        # Identifiers extracted from the document
+        self.namespace = None
+        self.metadata_id = None
+        self.title = None
+
+        return
+
+    @classmethod
+    def from_file(cls, path):
+        """Create a document from an XML file."""
+        return cls(path=path)
+
+    ##
+    #  Properties
+    ##
+
+    @property
+    def data(self):
+        """The bytes representation of the document. The tree is only
+        serialised if it has been changed.
+        """
+        if self._data is None and not self._modified:
+            with open(self._path, mode="rb") as infile:
+                self._data = infile.read()
+        elif self._data is None:
+            tree = self._xml_doc.getroottree()
+            self._data = self._prolog + etree.tostring(
+                tree, xml_declaration=False, encoding=tree.docinfo.encoding or "UTF-8"
+            ) + self._tail
+        return self._data
+
+    @property
+    def xml_doc(self):
+        """The root element of the document. The bytes are only parsed
+        again if they have been replaced.
+        """
+        if self._xml_doc is None:
+            self._xml_doc = etree.fromstring(self._data)
+        return self._xml_doc
+
+    @property
+    def record(self):
+        """The elements used by the worker and the checks, extracted
+        once until the document is changed.
+        """
+        if self._record is None:
+            self._record = MMDRecord.from_xml(self.xml_doc)
+        return self._record
+
+    ##
+    #  Methods
+    ##
+
+    def set_data(self, data):
+        """Replace the bytes representation of the document. The tree
+        is parsed again on next access.
+        """
+        if data == self._data:
+            return
+        self._data = data
+        self._xml_doc = None
+        self._record = None
+        self._keep_edges(data, data)
+        self._modified = True
+        return
+
+    def tree_changed(self):
+        """Mark the tree as changed. The bytes are serialised again on
+        next access.
+        """
+        self._data = None
+        self._record = None
+        self._modified = True
+        return
+
+    def is_modified(self):
+        """Check if the document was changed after it was created."""
+        return self._modified
+
+    ##
+    #  Internal Functions
+    ##
+
+    def _keep_edges(self, head, tail):
+        """Keep the XML declaration and the trailing whitespace of the
+        submitted data as they were, so that they are unchanged when a
+        changed tree is serialised.
+        """
+        match = XML_DECLARATION.match(head)
+        self._prolog = match.group(0).lstrip() if match else b""
+        self._tail = tail[len(tail.rstrip()):]
+        return
+
+# END Class MMDDocument
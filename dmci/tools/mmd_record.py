@@ -0,0 +1,118 @@
+"""
+DMCI : MMD Record
+=================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class MMDRecord():
+    """The elements of an MMD document that are used by the worker
+    and the checks, extracted in a single pass over the children of
+    the root element.
+    """
+
+    CF_VOCABULARY = "Climate and Forecast Standard Names"
+
+    # Elements checked against controlled vocabularies. For
+    # use_constraint, the identifier sub-element is checked.
+    VOCABULARY_ELEMENTS = (
+        "access_constraint",
+        "activity_type",
+        "operational_status",
+        "use_constraint",
+    )
+
+    def __init__(self):
+
+        self.title = ""
+        self.metadata_identifier = None
+
+        # Elements are kept where the worker may change them
+        self.parents = []
+        self.rectangles = []
+
+        self.resources = []
+        self.cf_keywords = []
+        self.vocabularies = {name: [] for name in self.VOCABULARY_ELEMENTS}
+
+        return
+
+    @classmethod
+    def from_xml(cls, xml_doc):
+        """Extract the record from an XML document.
+
+        Parameters
+        ----------
+        xml_doc : :obj:`lxml.etree._Element` or :obj:`lxml.ElementTree`
+            The root element or the tree of the document
+
+        Returns
+        -------
+        MMDRecord
+            The extracted record
+        """
+        if hasattr(xml_doc, "getroot"):
+            xml_doc = xml_doc.getroot()
+
+        record = cls()
+        has_title = False
+        for child in xml_doc:
+            if not isinstance(child.tag, str):
+                # Comments and processing instructions
+                continue
+
+            # Resources can be at any depth in the document
+            record.resources.extend(elem.text for elem in child.iter("{*}resource"))
+
+            name = child.tag.rpartition("}")[2]
+            if name == "title":
+                if not has_title:
+                    record.title = child.text
+                    has_title = True
+            elif name == "metadata_identifier":
+                if record.metadata_identifier is None:
+                    record.metadata_identifier = child.text or ""
+            elif name == "related_dataset":
+                if child.get("relation_type") == "parent":
+                    record.parents.append(child)
+            elif name == "geographic_extent":
+                record.rectangles.extend(child.iterfind("{*}rectangle"))
+            elif name == "keywords":
+                if child.get("vocabulary") == cls.CF_VOCABULARY:
+                    record.cf_keywords.append([elem.text for elem in child])
+            elif name == "use_constraint":
+                record.vocabularies[name].extend(
+                    elem.text for elem in child.iterfind("{*}identifier")
+                )
+            elif name in record.vocabularies:
+                record.vocabularies[name].append(child.text)
+
+        return record
+
+    @classmethod
+    def of(cls, xml_doc):
+        """Return the record of an XML document, or the record itself
+        if one is given.
+        """
+        if isinstance(xml_doc, cls):
+            return xml_doc
+        return cls.from_xml(xml_doc)
+
+# END Class MMDRecord
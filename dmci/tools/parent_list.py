@@ -0,0 +1,117 @@
+"""
+DMCI : Parent List
+==================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import logging
+import threading
+
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+# Parent lists loaded in this process, by path
+_PARENT_LISTS = {}
+_PARENT_LISTS_LOCK = threading.Lock()
+
+
+def get_parent_list(path):
+    """Return the parent list for a file. The list is loaded once per
+    process and shared by all distributors.
+
+    Parameters
+    ----------
+    path : str
+        Path to the parent list XML file
+
+    Returns
+    -------
+    ParentList or None
+        The parent list, or None if the file could not be loaded
+    """
+    with _PARENT_LISTS_LOCK:
+        parent_list = _PARENT_LISTS.get(path)
+        if parent_list is None:
+            parent_list = ParentList(path)
+            try:
+                parent_list.refresh()
+            except Exception as e:
+                logger.error("Could not load parent list: %s", str(path))
+                logger.error(str(e))
+                return None
+            _PARENT_LISTS[path] = parent_list
+
+    return parent_list
+
+
+class ParentList():
+    """The metadata identifiers of the parent datasets, read from a
+    file of the form <parent><id>namespace:UUID</id>...</parent>. The
+    file is read into a set once, and read again when its modification
+    time changes.
+    """
+
+    def __init__(self, path):
+
+        self._path = path
+        self._lock = threading.Lock()
+
+        self._ids = None
+        self._mtime = None
+
+        return
+
+    def __len__(self):
+        return len(self._ids) if self._ids is not None else 0
+
+    ##
+    #  Methods
+    ##
+
+    def is_parent(self, metadata_id):
+        """Check if a metadata identifier is in the parent list. The
+        file is read again first if it has changed on disk. If that
+        fails, the previously loaded identifiers are used.
+        """
+        try:
+            self.refresh()
+        except Exception as e:
+            logger.warning("Could not reload parent list, using the previous list")
+            logger.warning(str(e))
+
+        return self._ids is not None and metadata_id in self._ids
+
+    def refresh(self):
+        """Read the file if it has changed since it was last read."""
+        mtime = os.path.getmtime(self._path)
+        with self._lock:
+            if self._ids is not None and mtime == self._mtime:
+                return
+
+            ids = set()
+            for _, elem in etree.iterparse(self._path, events=("end",), tag="id"):
+                ids.add(elem.text or "")
+                elem.clear()
+
+            self._ids = ids
+            self._mtime = mtime
+            logger.debug("Loaded %d parent identifiers from %s", len(ids), self._path)
+
+        return
+
+# END Class ParentList
@@ -0,0 +1,139 @@
+"""
+DMCI : Request Batcher
+======================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import logging
+import threading
+
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+logger = logging.getLogger(__name__)
+
+
+class RequestBatcher():
+    """Collects items from concurrent requests and sends them to a
+    service together. A batch is sent when it has reached the batch
+    size, or when its first item has waited for the maximum wait time.
+    Each caller waits for the result of its own item, for at most the
+    given timeout. An item that times out is still sent with its batch,
+    so its result may differ from the one returned to the caller.
+
+    Items are only batched if several threads submit them at once. In
+    a process handling one request at a time, each item waits for the
+    maximum wait time and is then sent alone.
+
+    Parameters
+    ----------
+    send : callable
+        Called with the list of items of a batch, and must return a
+        (status, msg) tuple per item
+    size : int
+        The maximum number of items in a batch
+    wait : float
+        The maximum number of seconds an item waits for its batch
+    timeout : float, optional
+        The maximum number of seconds an item waits for its result,
+        unlimited if None
+    """
+
+    def __init__(self, send, size, wait, timeout=None):
+
+        self._send = send
+        self._size = size
+        self._wait = wait
+        self._timeout = timeout
+
+        self._lock = threading.Lock()
+        self._items = []
+        self._timer = None
+
+        return
+
+    ##
+    #  Methods
+    ##
+
+    def submit(self, item):
+        """Add an item to the next batch, and wait for its result.
+
+        Returns
+        -------
+        tuple of (bool, str)
+            The status and message of the item
+        """
+        future = Future()
+        batch = None
+        with self._lock:
+            self._items.append((item, future))
+            if len(self._items) >= self._size:
+                batch = self._take()
+            elif len(self._items) == 1:
+                self._timer = threading.Timer(self._wait, self._flush_timed, args=(future,))
+                self._timer.daemon = True
+                self._timer.start()
+
+        if batch is not None:
+            self._flush(batch)
+
+        try:
+            return future.result(timeout=self._timeout)
+        except FutureTimeout:
+            msg = "No result from the batch after %s seconds" % self._timeout
+            logger.error(msg)
+            return False, msg
+
+    ##
+    #  Internal Functions
+    ##
+
+    def _take(self):
+        """Take the current batch. Must be called with the lock held."""
+        batch = self._items
+        self._items = []
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return batch
+
+    def _flush_timed(self, first):
+        """Send the batch if it is still the one that started the
+        timer.
+        """
+        with self._lock:
+            if not self._items or self._items[0][1] is not first:
+                return
+            batch = self._take()
+        self._flush(batch)
+        return
+
+    def _flush(self, batch):
+        """Send a batch and hand out the results."""
+        try:
+            results = self._send([item for item, _ in batch])
+        except Exception as e:
+            logger.error("Failed to send batch")
+            logger.error(str(e))
+            results = [(False, "Internal error")]*len(batch)
+
+        logger.debug("Sent batch with %d items", len(batch))
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+        return
+
+# END Class RequestBatcher
@@ -0,0 +1,90 @@
+"""
+DMCI : XML Schema Pool
+======================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import logging
+import threading
+
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+
+class SchemaPool():
+    """Holds one compiled XML schema per thread. An lxml XMLSchema
+    object keeps the error log of its last validation, so it cannot be
+    shared by threads. The schema file is parsed once, and each thread
+    compiles its own schema from it on first use.
+
+    The pool can be used in place of an XMLSchema object, as it has the
+    same validate() method and error_log property, which both use the
+    schema of the calling thread.
+
+    Parameters
+    ----------
+    xsd_path : str
+        Path to the XML schema definition file
+    """
+
+    def __init__(self, xsd_path):
+
+        self._xsd_doc = etree.parse(xsd_path)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._count = 0
+
+        # Compile the first schema now, so that errors in the schema
+        # are raised to the caller
+        self.get()
+
+        return
+
+    def __len__(self):
+        return self._count
+
+    ##
+    #  Properties
+    ##
+
+    @property
+    def error_log(self):
+        """The error log of the last validation in this thread."""
+        return self.get().error_log
+
+    ##
+    #  Methods
+    ##
+
+    def get(self):
+        """Return the compiled schema of the calling thread."""
+        schema = getattr(self._local, "schema", None)
+        if schema is None:
+            # The parsed schema document is shared, so compile one at
+            # a time
+            with self._lock:
+                schema = etree.XMLSchema(self._xsd_doc)
+                self._count += 1
+            self._local.schema = schema
+            logger.debug("Compiled XML schema for thread %s", threading.current_thread().name)
+        return schema
+
+    def validate(self, xml_doc):
+        """Validate a document with the schema of the calling thread."""
+        return self.get().validate(xml_doc)
+
+# END Class SchemaPool
@@ -0,0 +1,147 @@
+"""
+DMCI : Vocabulary Registry
+==========================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import time
+import logging
+import threading
+
+from metvocab import CFStandard, MMDVocab
+
+from dmci import CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class VocabRegistry():
+    """Process-wide holder of the controlled vocabularies used by
+    CheckMMD. The vocabularies are loaded on first use and reloaded
+    when they are older than the configured time to live, or when
+    refresh() is called. If a load fails, it is tried again after
+    RETRY_INTERVAL seconds.
+    """
+
+    RETRY_INTERVAL = 60
+
+    MMD_VOCABS = {
+        "access_constraint":  "https://vocab.met.no/mmd/Access_Constraint",
+        "activity_type":      "https://vocab.met.no/mmd/Activity_Type",
+        "operational_status": "https://vocab.met.no/mmd/Operational_Status",
+        "use_constraint":     "https://vocab.met.no/mmd/Use_Constraint",
+    }
+
+    def __init__(self, ttl=None):
+
+        self._ttl = ttl
+        self._lock = threading.Lock()
+
+        self._vocabs = None
+        self._loaded_at = None
+        self._retry_at = None
+
+        return
+
+    def get(self):
+        """Return the vocabularies, loading them if they have not been
+        loaded yet or if they have expired.
+
+        Returns
+        -------
+        dict
+            The vocabulary objects, with "cf_standard" holding the
+            CFStandard object and the MMD element names holding their
+            MMDVocab objects
+        """
+        with self._lock:
+            if self._vocabs is None or self._is_expired():
+                self._load()
+            return self._vocabs
+
+    def refresh(self):
+        """Force a reload of the vocabularies.
+
+        Returns
+        -------
+        bool
+            True if all vocabularies were successfully initialised
+        """
+        with self._lock:
+            return self._load()
+
+    def is_loaded(self):
+        return self._vocabs is not None
+
+    ##
+    #  Internal Functions
+    ##
+
+    def _is_expired(self):
+        """Check if the loaded vocabularies have passed their TTL, or
+        if a failed load is due to be tried again.
+        """
+        if self._retry_at is not None:
+            return time.monotonic() >= self._retry_at
+
+        ttl = self._ttl if self._ttl is not None else CONFIG.vocab_ttl
+        if ttl is None or self._loaded_at is None:
+            return False
+        return time.monotonic() - self._loaded_at > ttl
+
+    def _load(self):
+        """Initialise a new set of vocabularies. The new set replaces
+        the current one only if all vocabularies were initialised, or
+        if there is no current set. In the latter case, errors are
+        raised to the caller.
+        """
+        vocabs = {}
+        status_ok = True
+        try:
+            vocabs["cf_standard"] = CFStandard()
+            vocabs["cf_standard"].init_vocab()
+            status_ok &= vocabs["cf_standard"].is_initialised
+
+            for name, uri in self.MMD_VOCABS.items():
+                vocabs[name] = MMDVocab("mmd", uri)
+                vocabs[name].init_vocab()
+                status_ok &= vocabs[name].is_initialised
+
+        except Exception as e:
+            logger.error("Failed to initialise vocabularies")
+            logger.error(str(e))
+            if self._vocabs is None:
+                raise
+            status_ok = False
+
+        if status_ok:
+            self._loaded_at = time.monotonic()
+            self._retry_at = None
+        else:
+            self._retry_at = time.monotonic() + self.RETRY_INTERVAL
+
+        if status_ok or self._vocabs is None:
+            self._vocabs = vocabs
+            logger.info("Loaded vocabularies")
+        else:
+            logger.warning("Vocabulary refresh failed, keeping the previous vocabularies")
+
+        return status_ok
+
+# END Class VocabRegistry
+
+
+VOCAB_REGISTRY = VocabRegistry()
@@ -17,14 +17,19 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import io
 import os
 import uuid
 import pytest
 import flask
+import tarfile
+import zipfile
+import threading
 
 from tools import readFile
 from tools import writeFile
 
+from tools import causeException
 from tools import causeOSError
 from tools import causePermissionError
 from tools import causeSameFileError
@@ -33,6 +38,8 @@ from tools import causeShUtilError
 from prometheus_client import REGISTRY
 
 from dmci.api import App
+from dmci.api.app import OK_RETURN, UNCHANGED_RETURN
+from dmci.distributors.file_manifest import get_file_manifest
 
 MOCK_XML = b"<xml />"
 MOCK_XML_MOD = b"<xml mod />"
@@ -43,8 +50,7 @@ def client(tmpDir, tmpConf, mockXsd, monkeypatch):
     """Create an instance of the API."""
     workDir = os.path.join(tmpDir, "api")
     rejectDir = os.path.join(tmpDir, "api", "rejected")
-    if not os.path.isdir(workDir):
-        os.mkdir(workDir)
+    os.makedirs(rejectDir, exist_ok=True)
 
     monkeypatch.setattr("dmci.CONFIG", tmpConf)
     tmpConf.distributor_cache = workDir
@@ -163,37 +169,53 @@ def testApiApp_InsertUpdateRequests(client, monkeypatch):
 
     # Data is valid
     with monkeypatch.context() as mp:
-        mp.setattr("dmci.api.app.Worker.validate", lambda *a: (True, "", MOCK_XML))
+        mp.setattr("dmci.api.app.Worker.validate_file", lambda *a: (True, "", None))
         assert client.post("/v1/insert", data=MOCK_XML).status_code == 200
         assert client.post("/v1/update", data=MOCK_XML).status_code == 200
 
         # Data is valid and gets modified by validate
-        mp.setattr("dmci.api.app.Worker.validate", lambda *a: (True, "", MOCK_XML_MOD))
+        mp.setattr("dmci.api.app.Worker.validate_file", lambda *a: (True, "", MOCK_XML_MOD))
         assert client.post("/v1/insert", data=MOCK_XML).status_code == 200
         assert client.post("/v1/update", data=MOCK_XML).status_code == 200
 
-    # first _persist_file fails
+    # Streaming the body to the cache fails
     with monkeypatch.context() as mp:
-        mp.setattr("dmci.api.app.Worker.validate", lambda *a: (True, "", MOCK_XML))
+        mp.setattr("dmci.api.app.Worker.validate_file", lambda *a: (True, "", None))
         mp.setattr(
-            "dmci.api.app.App._persist_file",
-            lambda *a: ("Failed to write the file", 666),
+            "dmci.api.app.App._stream_to_file",
+            lambda *a, **k: ("Failed to write the file", 666),
         )
         assert client.post("/v1/insert", data=MOCK_XML).status_code == 666
         assert client.post("/v1/update", data=MOCK_XML).status_code == 666
 
-    # first _persist_file works
+    # Unmodified data is not written again
     with monkeypatch.context() as mp:
-        mp.setattr("dmci.api.app.Worker.validate", lambda *a: (True, "", MOCK_XML))
-        mp.setattr(
-            "dmci.api.app.App._persist_file", lambda *a: ("Everything is OK", 200)
-        )
+        mp.setattr("dmci.api.app.Worker.validate_file", lambda *a: (True, "", None))
+        mp.setattr("dmci.api.app.App._persist_file", causeException)
         assert client.post("/v1/insert", data=MOCK_XML).status_code == 200
         assert client.post("/v1/update", data=MOCK_XML).status_code == 200
 
+    # A chunked body has no declared length
+    with monkeypatch.context() as mp:
+        mp.setattr("dmci.api.app.Worker.validate_file", lambda *a: (True, "", None))
+        response = client.post(
+            "/v1/insert",
+            input_stream=io.BytesIO(MOCK_XML),
+            headers={"Transfer-Encoding": "chunked"},
+            environ_overrides={"wsgi.input_terminated": True},
+        )
+        assert response.status_code == 200
+        response = client.post(
+            "/v1/insert",
+            input_stream=io.BytesIO(tooLargeFile),
+            headers={"Transfer-Encoding": "chunked"},
+            environ_overrides={"wsgi.input_terminated": True},
+        )
+        assert response.status_code == 413
+
     # Data is not valid
     with monkeypatch.context() as mp:
-        mp.setattr("dmci.api.app.Worker.validate", lambda *a: (False, "", MOCK_XML))
+        mp.setattr("dmci.api.app.Worker.validate_file", lambda *a: (False, "", None))
         assert client.post("/v1/insert", data=MOCK_XML).status_code == 400
         assert client.post("/v1/update", data=MOCK_XML).status_code == 400
 
@@ -202,7 +224,7 @@ def testApiApp_InsertUpdateRequests(client, monkeypatch):
         f = ["A", "B"]
         s = ["C"]
         e = ["Reason A", "Reason B"]
-        mp.setattr("dmci.api.app.Worker.validate", lambda *a: (True, "", MOCK_XML))
+        mp.setattr("dmci.api.app.Worker.validate_file", lambda *a: (True, "", None))
         mp.setattr(
             "dmci.api.app.Worker.distribute", lambda *a: (False, False, [], f, s, e)
         )
@@ -230,7 +252,7 @@ def testApiApp_InsertUpdateRequests(client, monkeypatch):
         f = ["file", "solr", "pycsw"]
         s = ["C"]
         e = ["Reason A", "Reason B", "Reason C"]
-        mp.setattr("dmci.api.app.Worker.validate", lambda *a: (True, "", MOCK_XML))
+        mp.setattr("dmci.api.app.Worker.validate_file", lambda *a: (True, "", None))
         mp.setattr(
             "dmci.api.app.Worker.distribute", lambda *a: (False, False, [], f, s, e)
         )
@@ -266,7 +288,7 @@ def testApiApp_InsertUpdateRequests(client, monkeypatch):
     # Data is valid, distribute OK.
     with monkeypatch.context() as mp:
 
-        mp.setattr("dmci.api.app.Worker.validate", lambda *a: (True, "", MOCK_XML))
+        mp.setattr("dmci.api.app.Worker.validate_file", lambda *a: (True, "", None))
         mp.setattr(
             "dmci.api.app.Worker.distribute", lambda *a: (True, True, [], [], [], [])
         )
@@ -281,30 +303,463 @@ def testApiApp_InsertUpdateRequests(client, monkeypatch):
 @pytest.mark.api
 def testApiApp_PersistAgainAfterModification(client, monkeypatch):
 
-    outputs = iter(
-        [
-            ("Everything is OK", 200),
-            ("Failure in persisting", 666),
-            ("Everything is OK", 200),
-            ("Failure in persisting", 666),
-        ]
-    )
+    written = []
 
     @staticmethod
     def fake_output(data, full_path):
-        return next(outputs)
+        written.append(data)
+        return "Failure in persisting", 666
 
     with monkeypatch.context() as mp:
         # Data is valid but failure to persist again after modifications
-        mp.setattr("dmci.api.app.Worker.validate", lambda *a: (True, "", MOCK_XML_MOD))
+        mp.setattr("dmci.api.app.Worker.validate_file", lambda *a: (True, "", MOCK_XML_MOD))
         mp.setattr("dmci.api.app.App._persist_file", fake_output)
         assert client.post("/v1/insert", data=MOCK_XML).status_code == 666
         assert client.post("/v1/update", data=MOCK_XML).status_code == 666
+        assert written == [MOCK_XML_MOD, MOCK_XML_MOD]
 
 
 # END Test testApiApp_PersistAgainAfterModification
 
 
+@pytest.mark.api
+def testApiApp_AsyncRequests(tmpDir, tmpConf, mockXsd, monkeypatch):
+    """Test api insert and update requests in async mode."""
+    workDir = os.path.join(tmpDir, "api_async")
+    rejectDir = os.path.join(workDir, "rejected")
+    os.makedirs(rejectDir, exist_ok=True)
+
+    monkeypatch.setattr("dmci.CONFIG", tmpConf)
+    tmpConf.distributor_cache = workDir
+    tmpConf.rejected_jobs_path = rejectDir
+    tmpConf.mmd_xsd_path = mockXsd
+    tmpConf.path_to_parent_list = mockXsd
+    tmpConf.call_distributors = ["file", "solr"]
+    tmpConf.async_mode = True
+
+    # The jobs are run by the test instead of the runner threads
+    monkeypatch.setattr("dmci.api.app.App._job_runner", lambda self: None)
+    app = App()
+    queue = app._job_queue
+    assert queue is not None
+
+    with app.test_client() as client:
+        assert client.get("/v1/jobs/blabla").status_code == 400
+        assert client.get("/v1/jobs/%s" % uuid.uuid4()).status_code == 404
+
+        with monkeypatch.context() as mp:
+            mp.setattr("dmci.api.app.Worker.validate_file", lambda *a: (True, "", None))
+            mp.setattr("dmci.api.app.Worker.prepare", lambda *a: True)
+
+            # Distribution succeeds
+            response = client.post("/v1/insert", data=MOCK_XML)
+            assert response.status_code == 202
+            job_id = response.data.decode().split()[-1]
+            assert client.get("/v1/jobs/%s" % job_id).json["status"] == "queued"
+
+            mp.setattr(
+                "dmci.api.app.Worker.distribute",
+                lambda *a: (True, True, ["file", "solr"], [], [], [])
+            )
+            app._run_job(queue.claim())
+            job = client.get("/v1/jobs/%s" % job_id).json
+            assert job["status"] == "done"
+            assert job["distributors"] == {"file": {"status": "ok"}, "solr": {"status": "ok"}}
+            assert "file" not in job
+            assert not os.path.isfile(os.path.join(workDir, f"{job_id}.xml"))
+
+            # Distribution fails
+            response = client.post("/v1/update", data=MOCK_XML)
+            assert response.status_code == 202
+            job_id = response.data.decode().split()[-1]
+
+            before = REGISTRY.get_sample_value(
+                "failed_solr_dist_total", {"path": "/v1/update"}
+            ) or 0
+            mp.setattr(
+                "dmci.api.app.Worker.distribute",
+                lambda *a: (False, True, ["file"], ["solr"], [], ["Reason"])
+            )
+            app._run_job(queue.claim())
+            job = client.get("/v1/jobs/%s" % job_id).json
+            assert job["status"] == "failed"
+            assert job["distributors"]["solr"] == {"status": "failed", "message": "Reason"}
+            assert job["errors"] == [
+                "The following distributors failed: solr", " - solr: Reason"
+            ]
+            assert os.path.isfile(os.path.join(rejectDir, f"{job_id}.xml"))
+            assert REGISTRY.get_sample_value(
+                "failed_solr_dist_total", {"path": "/v1/update"}
+            ) == before + 1
+
+            # Invalid data is still rejected at once
+            mp.setattr("dmci.api.app.Worker.validate_file", lambda *a: (False, "", None))
+            assert client.post("/v1/insert", data=MOCK_XML).status_code == 400
+            assert queue.claim() is None
+
+    # The job endpoint is not available in sync mode
+    tmpConf.async_mode = False
+    with App().test_client() as client:
+        assert client.get("/v1/jobs/%s" % job_id).status_code == 404
+
+
+# END Test testApiApp_AsyncRequests
+
+
+@pytest.mark.api
+def testApiApp_SkipUnchanged(tmpDir, tmpConf, mockXsd, monkeypatch):
+    """Test that identical updates are not distributed again."""
+    workDir = os.path.join(tmpDir, "api_unchanged")
+    rejectDir = os.path.join(workDir, "rejected")
+    os.makedirs(rejectDir, exist_ok=True)
+
+    monkeypatch.setattr("dmci.CONFIG", tmpConf)
+    tmpConf.distributor_cache = workDir
+    tmpConf.rejected_jobs_path = rejectDir
+    tmpConf.mmd_xsd_path = mockXsd
+    tmpConf.path_to_parent_list = mockXsd
+    tmpConf.skip_unchanged = True
+
+    mdUUID = uuid.uuid4()
+    distributed = []
+
+    def mockValidate(self, *args):
+        self._namespace = "no.test"
+        self._file_metadata_id = mdUUID
+        return True, "", None
+
+    def mockDistribute(self):
+        distributed.append(self._dist_cmd)
+        return True, True, [], [], [], []
+
+    def mockDistributeFail(self):
+        distributed.append("failed")
+        return False, True, ["file"], ["pycsw"], [], ["Reason"]
+
+    app = App()
+    with app.test_client() as client, monkeypatch.context() as mp:
+        mp.setattr("dmci.api.app.Worker.validate_file", mockValidate)
+        mp.setattr("dmci.api.app.Worker.distribute", mockDistribute)
+
+        def skipped(path="/v1/update"):
+            return REGISTRY.get_sample_value("skipped_unchanged_total", {"path": path})
+
+        # The first update is distributed, and an identical one is not
+        response = client.post("/v1/update", data=MOCK_XML)
+        assert response.data == b"Everything is OK\n"
+        response = client.post("/v1/update", data=MOCK_XML)
+        assert response.status_code == 200
+        assert response.data == UNCHANGED_RETURN.encode() + b"\n"
+        assert distributed == ["update"]
+        assert skipped() == 1
+        assert sorted(os.listdir(workDir)) == ["digests", "rejected"]
+
+        # A changed document, or an insert, is distributed
+        assert client.post("/v1/update", data=MOCK_XML_MOD).status_code == 200
+        assert client.post("/v1/insert", data=MOCK_XML_MOD).status_code == 200
+        assert distributed == ["update", "update", "insert"]
+
+        # The same applies to bulk updates
+        response = client.post("/v1/bulk/update", data={
+            "file": [(io.BytesIO(MOCK_XML_MOD), "a.xml"), (io.BytesIO(MOCK_XML), "b.xml")]
+        })
+        assert response.status_code == 200
+        assert [doc["status"] for doc in response.json["documents"]] == ["unchanged", "ok"]
+        assert skipped("/v1/bulk/update") == 1
+
+        # A deleted record can be updated again
+        assert client.post("/v1/update", data=MOCK_XML).data.startswith(b"Unchanged")
+        assert client.post(f"/v1/delete/no.test:{mdUUID}").status_code == 200
+        assert client.post("/v1/update", data=MOCK_XML).data == b"Everything is OK\n"
+
+        # If a changed document fails in a distributor, the services may
+        # hold part of it, so the previous document is sent again
+        distributed.clear()
+        with monkeypatch.context() as mpFail:
+            mpFail.setattr("dmci.api.app.Worker.distribute", mockDistributeFail)
+            assert client.post("/v1/update", data=MOCK_XML_MOD).status_code == 500
+        assert client.post("/v1/update", data=MOCK_XML).data == b"Everything is OK\n"
+        assert distributed == ["failed", "update"]
+
+# END Test testApiApp_SkipUnchanged
+
+
+@pytest.mark.api
+def testApiApp_Journal(tmpDir, tmpConf, mockXsd, monkeypatch):
+    """Test that jobs are journaled, and resumed after a restart."""
+    workDir = os.path.join(tmpDir, "api_journal")
+    rejectDir = os.path.join(workDir, "rejected")
+    journalDir = os.path.join(workDir, "journal")
+    os.makedirs(rejectDir, exist_ok=True)
+
+    monkeypatch.setattr("dmci.CONFIG", tmpConf)
+    tmpConf.distributor_cache = workDir
+    tmpConf.rejected_jobs_path = rejectDir
+    tmpConf.mmd_xsd_path = mockXsd
+    tmpConf.path_to_parent_list = mockXsd
+    tmpConf.distribution_journal = True
+
+    journaled = []
+
+    def mockDistribute(self):
+        journaled.append(os.listdir(journalDir))
+        return True, True, ["file"], [], [], []
+
+    # The journal record only exists while the job is distributed
+    app = App()
+    with app.test_client() as client, monkeypatch.context() as mp:
+        mp.setattr("dmci.api.app.Worker.validate_file", lambda *a: (True, "", None))
+        mp.setattr("dmci.api.app.Worker.distribute", mockDistribute)
+        assert client.post("/v1/insert", data=MOCK_XML).status_code == 200
+        assert len(journaled) == 1
+        assert [name[-5:] for name in sorted(journaled[0])] == [".json", ".lock"]
+        assert os.listdir(journalDir) == []
+
+    # A job left by a stopped process is resumed when the app starts
+    jobId = str(uuid.uuid4())
+    jobFile = os.path.join(workDir, f"{jobId}.xml")
+    writeFile(jobFile, MOCK_XML.decode())
+    app._journal.begin(jobId, "update", jobFile)
+    app._journal.mark_done(jobId, "file")
+    os.close(app._journal._owned.pop(jobId)._fd)
+
+    resumed = []
+    with monkeypatch.context() as mp:
+        mp.setattr("dmci.api.app.App._resume_jobs", lambda self, records: resumed.extend(records))
+        app = App()
+    assert [entry["id"] for entry in resumed] == [jobId]
+
+    # Only the distributors that had not completed are run
+    completed = []
+
+    def mockJournalDistribute(self):
+        completed.extend(self._completed_distributors())
+        return True, True, ["file", "solr"], [], [], []
+
+    with monkeypatch.context() as mp:
+        mp.setattr("dmci.api.app.Worker.prepare", lambda *a: True)
+        mp.setattr("dmci.api.app.Worker.distribute", mockJournalDistribute)
+        app._resume_jobs(resumed)
+    assert completed == ["file"]
+    assert os.listdir(journalDir) == []
+    assert not os.path.isfile(jobFile)
+
+    # Bulk jobs are journaled while the batch is distributed
+    def mockDistributeBatch(workers):
+        journaled.append(os.listdir(journalDir))
+        return [(True, True, ["file"], [], [], [])]*len(workers)
+
+    journaled.clear()
+    with app.test_client() as client, monkeypatch.context() as mp:
+        mp.setattr("dmci.api.app.Worker.validate_file", lambda *a: (True, "", None))
+        mp.setattr("dmci.api.app.Worker.distribute_batch", mockDistributeBatch)
+        response = client.post("/v1/bulk/insert", data={
+            "file": [(io.BytesIO(MOCK_XML), "a.xml"), (io.BytesIO(MOCK_XML), "b.xml")]
+        })
+        assert response.status_code == 200
+        assert len(journaled) == 1
+        assert len([name for name in journaled[0] if name.endswith(".json")]) == 2
+        assert os.listdir(journalDir) == []
+
+    # A job whose file is gone is dropped
+    resumed[0]["file"] = os.path.join(workDir, "missing.xml")
+    app._journal.begin(jobId, "update", resumed[0]["file"])
+    app._resume_jobs(resumed)
+    assert os.listdir(journalDir) == []
+
+    # The journal is off by default
+    tmpConf.distribution_journal = False
+    assert App()._journal is None
+
+# END Test testApiApp_Journal
+
+
+@pytest.mark.api
+def testApiApp_ManifestRebuild(tmpDir, tmpConf, mockXsd, fncDir, monkeypatch):
+    """Test that the archive manifest is filled when the app starts."""
+    archDir = os.path.join(fncDir, "archive", "arch_f", "arch_0", "arch_f")
+    dbPath = os.path.join(fncDir, "manifest.sqlite")
+    os.makedirs(archDir)
+    writeFile(os.path.join(archDir, "a1ddaf0f-cae0-4a15-9b37-3468e9cb1a2b.xml"), "<mmd/>")
+
+    monkeypatch.setattr("dmci.CONFIG", tmpConf)
+    monkeypatch.setattr("dmci.distributors.file_manifest._MANIFESTS", {})
+    tmpConf.distributor_cache = os.path.join(tmpDir, "api")
+    tmpConf.mmd_xsd_path = mockXsd
+    tmpConf.path_to_parent_list = mockXsd
+    tmpConf.file_archive_path = os.path.join(fncDir, "archive")
+    tmpConf.file_manifest_path = dbPath
+
+    def waitForRebuild():
+        for thread in threading.enumerate():
+            if thread.name == "dmci-manifest-rebuild":
+                thread.join()
+
+    # The manifest is filled in the background
+    tmpConf.file_manifest = True
+    App()
+    waitForRebuild()
+    manifest = get_file_manifest(dbPath)
+    assert manifest.is_complete() is True
+    assert len(manifest) == 1
+
+    # A manifest that is switched off is marked as out of date
+    tmpConf.file_manifest = False
+    App()
+    assert manifest.is_complete() is False
+
+    # Errors are logged
+    with monkeypatch.context() as mp:
+        mp.setattr(manifest, "mark_incomplete", causeOSError)
+        App()
+
+# END Test testApiApp_ManifestRebuild
+
+
+@pytest.mark.api
+def testApiApp_BulkRequests(client, monkeypatch):
+    """Test api bulk insert, update and validate requests."""
+    def makeZip(files):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, mode="w") as archive:
+            for name, data in files.items():
+                archive.writestr(name, data)
+        return buffer.getvalue()
+
+    def makeTar(files):
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+            for name, data in files.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+        return buffer.getvalue()
+
+    files = {"a.xml": MOCK_XML, "b.xml": MOCK_XML, "readme.txt": b"Not MMD"}
+
+    assert client.post("/v1/bulk/delete", data=makeZip(files)).status_code == 404
+    assert client.post("/v1/bulk/insert").status_code == 400
+    assert client.post("/v1/bulk/insert", data=b"<xml />").status_code == 400
+
+    with monkeypatch.context() as mp:
+        mp.setattr("dmci.api.app.Worker.validate_file", lambda *a: (True, "", None))
+        mp.setattr(
+            "dmci.api.app.Worker.distribute_batch",
+            lambda workers: [(True, True, ["file"], [], [], [])]*len(workers)
+        )
+
+        # Zip, tar and multipart bodies
+        for cmd in ("insert", "update"):
+            response = client.post(f"/v1/bulk/{cmd}", data=makeZip(files))
+            assert response.status_code == 200
+            assert response.json["total"] == 2
+            assert response.json["ok"] == 2
+            assert [doc["name"] for doc in response.json["documents"]] == ["a.xml", "b.xml"]
+            assert response.json["documents"][0]["distributors"] == {"file": {"status": "ok"}}
+
+        response = client.post("/v1/bulk/insert", data=makeTar(files))
+        assert response.status_code == 200
+        assert response.json["ok"] == 2
+
+        # Archives are read from the request stream, not all at once
+        with monkeypatch.context() as mpData:
+            mpData.setattr("flask.Request.get_data", causeException)
+            for body in (makeZip(files), makeTar(files)):
+                response = client.post("/v1/bulk/insert", data=body)
+                assert response.status_code == 200
+                assert response.json["ok"] == 2
+
+        response = client.post("/v1/bulk/insert", data={
+            "file": [(io.BytesIO(MOCK_XML), "c.xml"), (io.BytesIO(MOCK_XML), "d.xml")]
+        })
+        assert response.status_code == 200
+        assert [doc["name"] for doc in response.json["documents"]] == ["c.xml", "d.xml"]
+
+        # Limits on the number and size of documents
+        mp.setattr(client.application._conf, "max_bulk_documents", 1)
+        assert client.post("/v1/bulk/insert", data=makeZip(files)).status_code == 413
+        mp.setattr(client.application._conf, "max_bulk_documents", 10)
+
+        response = client.post("/v1/bulk/insert", data=makeZip({"big.xml": bytes(3000000)}))
+        assert response.status_code == 207
+        assert response.json["documents"][0]["status"] == "rejected"
+
+        response = client.post("/v1/bulk/insert", data={
+            "file": [(io.BytesIO(bytes(3000000)), "big.xml"), (io.BytesIO(MOCK_XML), "c.xml")]
+        })
+        assert response.status_code == 207
+        assert [doc["status"] for doc in response.json["documents"]] == ["rejected", "ok"]
+
+        mp.setattr(client.application._conf, "max_bulk_size", 10)
+        assert client.post("/v1/bulk/insert", data=makeZip(files)).status_code == 413
+
+    # The documents cannot be written to the cache
+    with monkeypatch.context() as mp:
+        mp.setattr("dmci.api.app.App._stream_to_file", lambda *a, **k: ("Failed", 507))
+        assert client.post("/v1/bulk/insert", data=makeZip(files)).status_code == 507
+        assert client.post("/v1/bulk/insert", data=makeTar(files)).status_code == 507
+
+    # Some documents are invalid, or fail in the distributors
+    with monkeypatch.context() as mp:
+        valid = iter([False, True, True])
+        mp.setattr(
+            "dmci.api.app.Worker.validate_file", lambda *a: (next(valid), "Invalid", None)
+        )
+        mp.setattr(
+            "dmci.api.app.Worker.distribute_batch",
+            lambda workers: [
+                (True, True, ["file"], [], [], []),
+                (False, True, [], ["file"], [], ["Reason"]),
+            ]
+        )
+        files = {"a.xml": MOCK_XML, "b.xml": MOCK_XML, "c.xml": MOCK_XML}
+        response = client.post("/v1/bulk/insert", data=makeZip(files))
+        assert response.status_code == 207
+        assert response.json["ok"] == 1
+        assert response.json["failed"] == 2
+        docs = response.json["documents"]
+        assert docs[0]["status"] == "rejected"
+        assert docs[1]["status"] == "ok"
+        assert docs[2]["status"] == "failed"
+        assert docs[2]["distributors"] == {"file": {"status": "failed", "message": "Reason"}}
+
+    # Validation only, in memory and without distributing
+    with monkeypatch.context() as mp:
+        valid = iter([True, False]*3)
+        mp.setattr("builtins.open", causeOSError)
+        mp.setattr("dmci.api.app.tempfile", None)
+        mp.setattr(
+            "dmci.api.app.Worker.validate", lambda *a: (next(valid), "Checked", MOCK_XML)
+        )
+        mp.setattr("dmci.api.app.Worker.distribute_batch", causeException)
+        files = {"a.xml": MOCK_XML, "b.xml": MOCK_XML}
+        response = client.post("/v1/bulk/validate", data=makeZip(files))
+        assert response.status_code == 207
+        assert response.json["ok"] == 1
+        docs = response.json["documents"]
+        assert docs[0] == {"name": "a.xml", "status": "ok", "message": "Checked"}
+        assert docs[1] == {"name": "b.xml", "status": "rejected", "message": "Checked"}
+
+        response = client.post("/v1/bulk/validate", data=makeTar(files))
+        assert response.status_code == 207
+        assert [doc["status"] for doc in response.json["documents"]] == ["ok", "rejected"]
+
+        response = client.post("/v1/bulk/validate", data={
+            "file": [(io.BytesIO(MOCK_XML), "a.xml"), (io.BytesIO(bytes(200000)), "big.xml")]
+        })
+        assert response.status_code == 207
+        docs = response.json["documents"]
+        assert docs[0]["status"] == "ok"
+        assert docs[1]["message"].startswith("The file is larger than maximum size")
+
+        mp.setattr(client.application._conf, "max_bulk_documents", 1)
+        assert client.post("/v1/bulk/validate", data=makeZip(files)).status_code == 413
+        assert client.post("/v1/bulk/validate", data=b"<xml />").status_code == 400
+
+
+# END Test testApiApp_BulkRequests
+
+
 @pytest.mark.api
 def testApiApp_DeleteRequests(client, monkeypatch):
     """Test api delete request."""
@@ -356,13 +811,18 @@ def testApiApp_ValidateRequests(client, monkeypatch):
     tooLargeFile = bytes(3000000)
     assert client.post("/v1/validate", data=tooLargeFile).status_code == 413
 
-    # Fail caching the file
-    with monkeypatch.context() as mp:
-        mp.setattr("builtins.open", causeOSError)
-        assert client.post("/v1/validate", data=MOCK_XML).status_code == 507
+    # The body size is also checked as it is read
+    response = client.post(
+        "/v1/validate",
+        input_stream=io.BytesIO(tooLargeFile),
+        headers={"Transfer-Encoding": "chunked"},
+        environ_overrides={"wsgi.input_terminated": True},
+    )
+    assert response.status_code == 413
 
-    # Data is valid
+    # Data is valid, and nothing is written to disk
     with monkeypatch.context() as mp:
+        mp.setattr("builtins.open", causeOSError)
         mp.setattr("dmci.api.app.Worker.validate", lambda *a: (True, "", MOCK_XML))
         assert client.post("/v1/validate", data=MOCK_XML).status_code == 200
 
@@ -394,6 +854,36 @@ def testApiApp_PersistFile(tmpDir, monkeypatch):
 # END Test testApiApp_PersistFile
 
 
+@pytest.mark.api
+def testApiApp_StreamToFile(tmpDir, monkeypatch):
+    """Test writing a request body to the cache in chunks."""
+    outFile = os.path.join(tmpDir, "app_stream_to_file.xml")
+
+    # The body is written in chunks
+    monkeypatch.setattr("dmci.api.app.STREAM_CHUNK_SIZE", 3)
+    assert App._stream_to_file(io.BytesIO(MOCK_XML), outFile, 100) == (OK_RETURN, 200)
+    with open(outFile, mode="rb") as inFile:
+        assert inFile.read() == MOCK_XML
+    assert not os.path.exists(outFile + ".part")
+    os.unlink(outFile)
+
+    # A body larger than the limit is rejected while it is read
+    assert App._stream_to_file(io.BytesIO(bytes(10)), outFile, 9) == (
+        "The file is larger than maximum size: 9", 413
+    )
+    assert not os.path.exists(outFile)
+    assert not os.path.exists(outFile + ".part")
+
+    # Failing to write the file
+    assert App._stream_to_file(io.BytesIO(MOCK_XML), None, 100)[1] == 507
+    with monkeypatch.context() as mp:
+        mp.setattr("builtins.open", causeOSError)
+        assert App._stream_to_file(io.BytesIO(MOCK_XML), outFile, 100)[1] == 507
+    assert not os.path.exists(outFile)
+
+# END Test testApiApp_StreamToFile
+
+
 @pytest.mark.api
 def testApiApp_CheckMetadataId():
     testUUID = "7278888a-96a5-4ee5-845a-2051bb8994c8"
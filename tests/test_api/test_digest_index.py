@@ -0,0 +1,61 @@
+"""
+DMCI : Digest Index Class Test
+==============================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import pytest
+
+from dmci.api.digest_index import DigestIndex
+
+
+@pytest.mark.api
+def testApiDigestIndex_Lookup(fncDir):
+    """Test recording and looking up document digests."""
+    indexPath = os.path.join(fncDir, "digests")
+    index = DigestIndex(indexPath)
+
+    hasher = DigestIndex.new_hasher()
+    hasher.update(b"<xml />")
+    digestA = hasher.hexdigest()
+    digestB = "b" * 64
+
+    assert index.lookup(digestA) is None
+
+    # A recorded digest is found from the digest alone
+    index.record("no.test:1", digestA)
+    assert index.lookup(digestA) == "no.test:1"
+
+    # The index is shared with other instances
+    assert DigestIndex(indexPath).lookup(digestA) == "no.test:1"
+
+    # A new version replaces the old one
+    index.record("no.test:1", digestB)
+    assert index.lookup(digestA) is None
+    assert index.lookup(digestB) == "no.test:1"
+    assert os.listdir(os.path.join(indexPath, "by_digest")) == [digestB]
+
+    # The same document under a new identifier
+    index.record("no.test:2", digestB)
+    assert index.lookup(digestB) == "no.test:2"
+
+    # A forgotten identifier is no longer found
+    index.forget("no.test:2")
+    assert index.lookup(digestB) is None
+    index.forget("no.test:3")
+
+# END Test testApiDigestIndex_Lookup
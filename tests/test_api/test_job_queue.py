@@ -0,0 +1,117 @@
+"""
+DMCI : Job Queue Class Test
+===========================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import time
+import pytest
+
+from dmci.api.job_queue import JobQueue
+
+
+@pytest.mark.api
+def testApiJobQueue_Process(fncDir):
+    """Test a job moving through the queue."""
+    queue = JobQueue(os.path.join(fncDir, "jobs"))
+    assert queue.claim() is None
+    assert queue.status("job1") is None
+
+    job = queue.submit("job1", "insert", "job1.xml", ["file", "solr"])
+    assert job["status"] == "queued"
+    assert queue.status("job1")["distributors"] == {
+        "file": {"status": "queued"}, "solr": {"status": "queued"}
+    }
+
+    # Claim the job
+    job = queue.claim()
+    assert job["id"] == "job1"
+    assert job["status"] == "running"
+    assert job["pid"] == os.getpid()
+    assert queue.status("job1")["status"] == "running"
+    assert queue.claim() is None
+
+    # Complete the job
+    distributors = {"file": {"status": "ok"}, "solr": {"status": "failed", "message": "oops"}}
+    queue.complete(job, False, distributors, ["solr failed"])
+    status = queue.status("job1")
+    assert status["status"] == "failed"
+    assert status["distributors"] == distributors
+    assert status["errors"] == ["solr failed"]
+    assert status["finished"] is not None
+    assert os.listdir(os.path.join(fncDir, "jobs", "running")) == []
+
+    # Jobs are claimed oldest first
+    queue.submit("job2", "insert", "job2.xml", ["file"])
+    queue.submit("job3", "update", "job3.xml", ["file"])
+    os.utime(os.path.join(fncDir, "jobs", "pending", "job2.json"), (1, 1))
+    assert queue.claim()["id"] == "job2"
+    assert queue.claim()["id"] == "job3"
+
+# END Test testApiJobQueue_Process
+
+
+@pytest.mark.api
+def testApiJobQueue_Recover(fncDir, monkeypatch):
+    """Test that interrupted jobs are queued again."""
+    queue = JobQueue(os.path.join(fncDir, "jobs"))
+    queue.submit("job1", "insert", "job1.xml", ["file"])
+    queue.submit("job2", "insert", "job2.xml", ["file"])
+    queue.claim()
+    queue.claim()
+
+    # Both are owned by a running process
+    assert queue.recover() == 0
+    assert JobQueue(os.path.join(fncDir, "jobs")).recover() == 0
+
+    # The owner of one of them is gone
+    os.close(queue._owned.pop("job1")._fd)
+
+    assert JobQueue(os.path.join(fncDir, "jobs")).recover() == 1
+    assert queue.status("job1")["status"] == "queued"
+    assert queue.status("job2")["status"] == "running"
+    assert queue.claim()["id"] == "job1"
+
+    # Unreadable records are skipped
+    queue.submit("job3", "insert", "job3.xml", ["file"])
+    with open(os.path.join(fncDir, "jobs", "pending", "job3.json"), mode="w") as outfile:
+        outfile.write("{")
+    assert queue.claim() is None
+    assert queue.status("job3") is None
+
+# END Test testApiJobQueue_Recover
+
+
+@pytest.mark.api
+def testApiJobQueue_Prune(fncDir):
+    """Test that old job records are deleted."""
+    queue = JobQueue(os.path.join(fncDir, "jobs"))
+    for job_id in ("job1", "job2"):
+        queue.submit(job_id, "insert", f"{job_id}.xml", ["file"])
+        queue.complete(queue.claim(), True, {}, [])
+
+    old = time.time() - 100
+    os.utime(os.path.join(fncDir, "jobs", "done", "job1.json"), (old, old))
+
+    queue.prune(None)
+    assert queue.status("job1") is not None
+
+    queue.prune(50)
+    assert queue.status("job1") is None
+    assert queue.status("job2")["status"] == "done"
+
+# END Test testApiJobQueue_Prune
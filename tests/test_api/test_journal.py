@@ -0,0 +1,124 @@
+"""
+DMCI : Distribution Journal Class Test
+======================================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import time
+import pytest
+
+from tools import readFile, writeFile
+
+from dmci.api.journal import Journal
+
+
+def stopOwner(journal, job_id):
+    """Release the record lock of a job, as if its process stopped."""
+    os.close(journal._owned.pop(job_id)._fd)
+
+
+@pytest.mark.api
+def testApiJournal_Process(fncDir):
+    """Test a job moving through the journal."""
+    journal = Journal(os.path.join(fncDir, "journal"))
+    assert journal.completed("job1") == []
+
+    record = journal.begin("job1", "insert", "job1.xml", digest="abc")
+    assert record["completed"] == []
+    assert record["pid"] == os.getpid()
+    assert record["queued"] is False
+
+    journal.mark_done("job1", "file")
+    journal.mark_done("job1", "solr")
+    journal.mark_done("job1", "file")
+    assert journal.completed("job1") == ["file", "solr"]
+
+    # Beginning the job again keeps the completed distributors
+    record = journal.begin("job1", "insert", "job1.xml")
+    assert record["completed"] == ["file", "solr"]
+    assert record["digest"] == "abc"
+
+    journal.finish("job1")
+    journal.finish("job1")
+    assert journal.completed("job1") == []
+    assert os.listdir(os.path.join(fncDir, "journal")) == []
+
+# END Test testApiJournal_Process
+
+
+@pytest.mark.api
+def testApiJournal_Recover(fncDir):
+    """Test taking over the records of interrupted jobs."""
+    journalDir = os.path.join(fncDir, "journal")
+    rejectDir = os.path.join(fncDir, "rejected")
+    os.mkdir(rejectDir)
+    cacheFiles = {}
+    for job_id in ("job1", "job2", "job3", "job4"):
+        cacheFiles[job_id] = os.path.join(fncDir, f"{job_id}.xml")
+        writeFile(cacheFiles[job_id], "<mmd/>")
+
+    journal = Journal(journalDir)
+    journal.begin("job1", "insert", cacheFiles["job1"])
+    journal.begin("job2", "update", cacheFiles["job2"])
+    journal.begin("job3", "update", cacheFiles["job3"], queued=True)
+    journal.begin("job4", "update", cacheFiles["job4"])
+    journal.mark_done("job1", "file")
+
+    # All are owned by a running process
+    assert journal.recover() == []
+    assert Journal(journalDir).recover() == []
+
+    # Queued jobs are left alone, and old jobs are dropped
+    stopOwner(journal, "job1")
+    stopOwner(journal, "job3")
+    stopOwner(journal, "job4")
+    old = time.time() - 200
+    os.utime(os.path.join(journalDir, "job4.json"), (old, old))
+
+    other = Journal(journalDir, ttl=100, rejected_path=rejectDir)
+    records = other.recover()
+    assert [record["id"] for record in records] == ["job1"]
+    assert records[0]["completed"] == ["file"]
+    assert records[0]["pid"] == os.getpid()
+
+    # The record now belongs to the other journal
+    assert journal.recover() == []
+    assert other.recover() == []
+    assert sorted(os.listdir(journalDir)) == [
+        "job1.json", "job1.json.lock", "job2.json", "job2.json.lock",
+        "job3.json", "job3.json.lock",
+    ]
+
+    # The cached file of a dropped job is moved to the rejected folder
+    assert not os.path.exists(cacheFiles["job4"])
+    assert readFile(os.path.join(rejectDir, "job4.xml")) == "<mmd/>"
+    assert "interrupted" in readFile(os.path.join(rejectDir, "job4.txt"))
+
+    # Old queued jobs are also dropped
+    os.utime(os.path.join(journalDir, "job3.json"), (old, old))
+    assert other.recover() == []
+    assert not os.path.isfile(os.path.join(journalDir, "job3.json"))
+    assert os.path.isfile(cacheFiles["job3"])
+    assert sorted(os.listdir(rejectDir)) == ["job4.txt", "job4.xml"]
+
+    # Unreadable records are skipped
+    stopOwner(journal, "job2")
+    with open(os.path.join(journalDir, "job2.json"), mode="w") as outfile:
+        outfile.write("{")
+    assert other.recover() == []
+
+# END Test testApiJournal_Recover
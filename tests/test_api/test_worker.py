@@ -19,15 +19,18 @@ limitations under the License.
 
 import os
 import re
+import time
+import threading
 from uuid import UUID
 
 import lxml
 import pytest
 
-from dmci.api.worker import Worker
-from dmci.distributors import FileDist, PyCSWDist
-from dmci.tools import CheckMMD
-from tools import readFile
+from dmci.api.journal import Journal
+from dmci.api.worker import Worker, get_distributor_executor
+from dmci.distributors import FileDist, PyCSWDist, SolRDist
+from dmci.tools import CheckMMD, MMDDocument
+from tools import readFile, causeException
 
 
 @pytest.mark.api
@@ -44,6 +47,27 @@ def testApiWorker_Init():
 # END Test testApiWorker_Init
 
 
+@pytest.mark.api
+def testApiWorker_Prepare(filesDir):
+    """Test preparing a worker for already validated data."""
+    passFile = os.path.join(filesDir, "api", "passing.xml")
+    with open(passFile, mode="rb") as infile:
+        data = infile.read()
+
+    tstWorker = Worker("insert", passFile, None)
+    assert tstWorker.prepare(data) is True
+    assert isinstance(tstWorker._doc, MMDDocument)
+    assert tstWorker._file_metadata_id == UUID("a1ddaf0f-cae0-4a15-9b37-3468e9cb1a2b")
+    assert tstWorker._namespace == "test.no"
+    assert tstWorker._doc.metadata_id == tstWorker._file_metadata_id
+
+    assert Worker("insert", None, None).prepare(b"<xml") is False
+    assert Worker("insert", None, None).prepare(b"<xml />") is False
+
+
+# END Test testApiWorker_Prepare
+
+
 @pytest.mark.api
 def testApiWorker_Distributor(tmpConf, mockXml, monkeypatch):
     """Test the Worker class distributor."""
@@ -83,6 +107,24 @@ def testApiWorker_Distributor(tmpConf, mockXml, monkeypatch):
         assert skipped == ["blabla"]
         assert failed_msg == ["oops", "oops"]
 
+    # Dependencies run first, and failed dependencies stop dependants
+    with monkeypatch.context() as mp:
+        order = []
+        mp.setattr(tmpConf, "call_distributors", ["pycsw", "file", "file"])
+        mp.setattr(tmpConf, "distributor_dependencies", {"pycsw": ["file"]})
+        mp.setattr(FileDist, "run", lambda self: order.append("file") or (False, "oops"))
+        mp.setattr(PyCSWDist, "run", lambda self: order.append("pycsw") or (True, "ok"))
+
+        tstWorker = Worker("insert", None, None)
+        tstWorker._conf = tmpConf
+        tstWorker._dist_xml_file = mockXml
+
+        status, valid, called, failed, skipped, failed_msg = tstWorker.distribute()
+        assert status is False
+        assert order == ["file"]
+        assert failed == ["pycsw", "file"]
+        assert failed_msg == ["Not run since distributor 'file' failed", "oops"]
+
     # Call the distributor function with the wrong parameters
     tstWorker = Worker("insert", None, None)
     tstWorker._conf = tmpConf
@@ -101,6 +143,240 @@ def testApiWorker_Distributor(tmpConf, mockXml, monkeypatch):
 # END Test testApiWorker_Distributor
 
 
+@pytest.mark.api
+def testApiWorker_DistributorConcurrent(tmpConf, mockXml, monkeypatch):
+    """Test the Worker class distributor in concurrent mode."""
+    tmpConf.call_distributors = ["file", "pycsw", "solr", "blabla"]
+    tmpConf.concurrent_distributors = True
+
+    def makeRun(status, msg, delay=0.0, log=None):
+        def fakeRun(self):
+            time.sleep(delay)
+            if log is not None:
+                log.append(type(self).__name__)
+            return status, msg
+        return fakeRun
+
+    def newWorker():
+        tstWorker = Worker("insert", None, None)
+        tstWorker._conf = tmpConf
+        tstWorker._dist_xml_file = mockXml
+        return tstWorker
+
+    # Results are reported in config order regardless of finish order
+    with monkeypatch.context() as mp:
+        mp.setattr(FileDist, "run", makeRun(True, "ok", 0.2))
+        mp.setattr(PyCSWDist, "run", makeRun(False, "oops", 0.1))
+        mp.setattr(SolRDist, "run", makeRun(True, "ok"))
+        mp.setattr(SolRDist, "__init__", lambda self, *a, **k: setattr(self, "_valid", True))
+
+        status, valid, called, failed, skipped, failed_msg = newWorker().distribute()
+        assert status is False
+        assert valid is True
+        assert called == ["file", "solr"]
+        assert failed == ["pycsw"]
+        assert skipped == ["blabla"]
+        assert failed_msg == ["oops"]
+
+    # A distributor that runs too long is reported as failed
+    with monkeypatch.context() as mp:
+        mp.setattr(tmpConf, "distributor_timeout", 0.1)
+        mp.setattr(FileDist, "run", makeRun(True, "ok"))
+        mp.setattr(PyCSWDist, "run", makeRun(True, "ok", 0.5))
+        mp.setattr(SolRDist, "run", makeRun(True, "ok"))
+        mp.setattr(SolRDist, "__init__", lambda self, *a, **k: setattr(self, "_valid", True))
+
+        status, valid, called, failed, skipped, failed_msg = newWorker().distribute()
+        assert status is False
+        assert called == ["file", "solr"]
+        assert failed == ["pycsw"]
+        assert failed_msg == ["Timed out after 0.1 seconds"]
+
+    # The job file is released once the timed out distributor is done
+    with monkeypatch.context() as mp:
+        mp.setattr(tmpConf, "call_distributors", ["file"])
+        mp.setattr(tmpConf, "distributor_timeout", 0.1)
+        mp.setattr(FileDist, "run", makeRun(True, "ok", 0.4))
+
+        released = threading.Event()
+        tstWorker = newWorker()
+        status, _, _, failed, _, _ = tstWorker.distribute()
+        assert status is False
+        assert failed == ["file"]
+        tstWorker.when_finished(released.set)
+        assert not released.is_set()
+        assert released.wait(2.0)
+
+        # Without running distributors, it is released at once
+        released.clear()
+        newWorker().when_finished(released.set)
+        assert released.is_set()
+
+    # All requests share the same thread pool
+    assert get_distributor_executor(1) is get_distributor_executor(4)
+
+    # Dependencies finish first, and failed dependencies stop dependants
+    with monkeypatch.context() as mp:
+        order = []
+        mp.setattr(tmpConf, "distributor_dependencies", {"pycsw": ["file"], "solr": ["file"]})
+        mp.setattr(FileDist, "run", makeRun(True, "ok", 0.2, order))
+        mp.setattr(PyCSWDist, "run", makeRun(True, "ok", 0.0, order))
+        mp.setattr(SolRDist, "run", makeRun(True, "ok", 0.0, order))
+        mp.setattr(SolRDist, "__init__", lambda self, *a, **k: setattr(self, "_valid", True))
+
+        status, valid, called, failed, skipped, failed_msg = newWorker().distribute()
+        assert status is True
+        assert called == ["file", "pycsw", "solr"]
+        assert order[0] == "FileDist"
+
+        mp.setattr(FileDist, "run", makeRun(False, "oops"))
+        status, valid, called, failed, skipped, failed_msg = newWorker().distribute()
+        assert status is False
+        assert called == []
+        assert failed == ["file", "pycsw", "solr"]
+        assert failed_msg == [
+            "oops",
+            "Not run since distributor 'file' failed",
+            "Not run since distributor 'file' failed",
+        ]
+
+    # Exceptions are reported as failures
+    with monkeypatch.context() as mp:
+        mp.setattr(tmpConf, "call_distributors", ["file"])
+        mp.setattr(FileDist, "run", lambda *a: 1/0)
+
+        status, valid, called, failed, skipped, failed_msg = newWorker().distribute()
+        assert status is False
+        assert failed == ["file"]
+        assert failed_msg == ["Internal error"]
+
+    # Invalid jobs are skipped without starting any threads
+    tmpConf.call_distributors = ["file", "pycsw", "blabla"]
+    tstWorker = newWorker()
+    tstWorker._dist_cmd = "blabla"
+    status, valid, called, failed, skipped, failed_msg = tstWorker.distribute()
+    assert status is True
+    assert valid is False
+    assert skipped == ["file", "pycsw", "blabla"]
+
+# END Test testApiWorker_DistributorConcurrent
+
+
+@pytest.mark.api
+def testApiWorker_DistributorJournal(tmpConf, mockXml, fncDir, monkeypatch):
+    """Test that completed distributors are journaled and skipped."""
+    journal = Journal(os.path.join(fncDir, "journal"))
+    journal.begin("job1", "insert", mockXml)
+    journal.mark_done("job1", "file")
+
+    def newWorker():
+        tstWorker = Worker("insert", None, None, journal=journal, job_id="job1")
+        tstWorker._conf = tmpConf
+        tstWorker._dist_xml_file = mockXml
+        return tstWorker
+
+    for concurrent in (False, True):
+        calls = []
+
+        def fakeRun(self):
+            calls.append(type(self).__name__)
+            return type(self) is SolRDist, "msg"
+
+        with monkeypatch.context() as mp:
+            mp.setattr(tmpConf, "call_distributors", ["file", "pycsw", "solr"])
+            mp.setattr(tmpConf, "concurrent_distributors", concurrent)
+            mp.setattr(FileDist, "run", fakeRun)
+            mp.setattr(PyCSWDist, "run", fakeRun)
+            mp.setattr(SolRDist, "run", fakeRun)
+            mp.setattr(SolRDist, "__init__", lambda self, *a, **k: setattr(self, "_valid", True))
+
+            # The file distributor completed before, and only solr
+            # completes now
+            status, valid, called, failed, skipped, _ = newWorker().distribute()
+            assert status is False
+            assert sorted(calls) == ["PyCSWDist", "SolRDist"]
+            assert called == ["file", "solr"]
+            assert failed == ["pycsw"]
+            assert skipped == []
+            assert journal.completed("job1") == ["file", "solr"]
+
+            # Journal errors do not stop the distributors
+            mp.setattr(Journal, "completed", causeException)
+            mp.setattr(Journal, "mark_done", causeException)
+            calls.clear()
+            status, _, called, _, _, _ = newWorker().distribute()
+            assert sorted(calls) == ["FileDist", "PyCSWDist", "SolRDist"]
+            assert called == ["solr"]
+
+        journal.finish("job1")
+        journal.begin("job1", "insert", mockXml)
+        journal.mark_done("job1", "file")
+
+# END Test testApiWorker_DistributorJournal
+
+
+@pytest.mark.api
+def testApiWorker_DistributeBatch(tmpConf, mockXml, monkeypatch):
+    """Test running the distributors for a batch of workers."""
+    tmpConf.call_distributors = ["pycsw", "file", "blabla"]
+    order = []
+
+    def makeRunBatch(results):
+        def fakeRunBatch(cls, dists):
+            order.append((cls.__name__, len(dists)))
+            return results[:len(dists)]
+        return classmethod(fakeRunBatch)
+
+    def newWorker(xml_file=mockXml):
+        tstWorker = Worker("insert", None, None)
+        tstWorker._conf = tmpConf
+        tstWorker._dist_xml_file = xml_file
+        return tstWorker
+
+    assert Worker.distribute_batch([]) == []
+
+    with monkeypatch.context() as mp:
+        mp.setattr(tmpConf, "distributor_dependencies", {"pycsw": ["file"]})
+        mp.setattr(FileDist, "run_batch", makeRunBatch([(True, "ok"), (False, "oops")]))
+        mp.setattr(PyCSWDist, "run_batch", makeRunBatch([(True, "ok")]))
+
+        # The third worker has an invalid job
+        results = Worker.distribute_batch([newWorker(), newWorker(), newWorker("nofile.xml")])
+
+        # Dependencies run first, and each distributor is called once
+        assert order == [("FileDist", 2), ("PyCSWDist", 1)]
+        assert results[0] == (True, True, ["pycsw", "file"], [], ["blabla"], [])
+        assert results[1] == (
+            False, True, [], ["pycsw", "file"], ["blabla"],
+            ["Not run since distributor 'file' failed", "oops"]
+        )
+        assert results[2] == (True, False, [], [], ["pycsw", "file", "blabla"], [])
+
+    # Repeated distributors are only called once
+    with monkeypatch.context() as mp:
+        order.clear()
+        mp.setattr(tmpConf, "call_distributors", ["pycsw", "file", "pycsw"])
+        mp.setattr(tmpConf, "distributor_dependencies", {"pycsw": ["file"]})
+        mp.setattr(FileDist, "run_batch", makeRunBatch([(True, "ok")]))
+        mp.setattr(PyCSWDist, "run_batch", makeRunBatch([(True, "ok")]))
+
+        results = Worker.distribute_batch([newWorker()])
+        assert order == [("FileDist", 1), ("PyCSWDist", 1)]
+        assert results[0] == (True, True, ["pycsw", "file"], [], [], [])
+
+    # An exception fails the whole batch
+    with monkeypatch.context() as mp:
+        mp.setattr(FileDist, "run_batch", makeRunBatch([(True, "ok")]*2))
+        mp.setattr(PyCSWDist, "run_batch", classmethod(causeException))
+        results = Worker.distribute_batch([newWorker(), newWorker()])
+        assert results[0][3] == ["pycsw"]
+        assert results[0][5] == ["Internal error"]
+        assert results[1][2] == ["file"]
+
+
+# END Test testApiWorker_DistributeBatch
+
+
 @pytest.mark.api
 def testApiWorker_Validator(monkeypatch, filesDir):
     """Test the Worker class validator."""
@@ -193,6 +469,51 @@ def testApiWorker_Validator(monkeypatch, filesDir):
 # END Test testApiWorker_Validator
 
 
+@pytest.mark.api
+def testApiWorker_ValidatorDocument(monkeypatch, filesDir, mockXml):
+    """Test that the document parsed by the validator is passed on to
+    the distributors.
+    """
+    xsdFile = os.path.join(filesDir, "mmd", "mmd.xsd")
+    passFile = os.path.join(filesDir, "api", "passing.xml")
+
+    xsdObj = lxml.etree.XMLSchema(lxml.etree.parse(xsdFile))
+    passWorker = Worker("insert", passFile, xsdObj)
+
+    with monkeypatch.context() as mp:
+        mp.setattr(passWorker._conf, "env_string", None)
+        mp.setattr(CheckMMD, "_url_result", lambda *a, **k: (True, []))
+        passData = bytes(readFile(passFile), "utf-8")
+        valid, msg, passData = passWorker.validate(passData)
+        assert valid is True
+
+    tstDoc = passWorker._doc
+    assert isinstance(tstDoc, MMDDocument)
+    assert tstDoc.data == passData
+    assert tstDoc.namespace == "test.no"
+    assert tstDoc.metadata_id == UUID("a1ddaf0f-cae0-4a15-9b37-3468e9cb1a2b")
+    assert tstDoc.title == "Direct Broadcast data processed in satellite swath to L1C"
+
+    # The distributors receive the same document
+    docs = []
+
+    def fakeRun(self):
+        docs.append(self._get_doc())
+        return True, "ok"
+
+    with monkeypatch.context() as mp:
+        mp.setattr(passWorker._conf, "call_distributors", ["file", "pycsw"])
+        mp.setattr(FileDist, "run", fakeRun)
+        mp.setattr(PyCSWDist, "run", fakeRun)
+        passWorker._dist_xml_file = mockXml
+        status, _, called, _, _, _ = passWorker.distribute()
+        assert status is True
+        assert called == ["file", "pycsw"]
+        assert docs == [tstDoc, tstDoc]
+
+# END Test testApiWorker_ValidatorDocument
+
+
 @pytest.mark.api
 def testApiWorker_NamespaceReplacement(filesDir):
     """Test the replacement of the namespace with the one customized for the environment."""
@@ -296,7 +617,7 @@ def testApiWorker_ParentNamespaceReplacement(filesDir):
     valid, msg, data = badparentWorker.validate(badparentData)
     assert valid is False
     assert (
-        msg == "Malformed parent dataset identifier [b'64db6102-14ce-41e9-b93b-61dbb2cb8b4e']"
+        msg == "Malformed parent dataset identifier ['64db6102-14ce-41e9-b93b-61dbb2cb8b4e']"
     )
 
 
@@ -319,7 +640,7 @@ def testApiWorker_CheckInfoContent(monkeypatch, filesDir):
 
     # Valid data format
     with monkeypatch.context() as mp:
-        mp.setattr(CheckMMD, "check_url", lambda *a, **k: (True, []))
+        mp.setattr(CheckMMD, "_url_result", lambda *a, **k: (True, []))
         passData = bytes(readFile(passFile), "utf-8")
         assert tstWorker._check_information_content(passData) == (
             True,
@@ -329,7 +650,7 @@ def testApiWorker_CheckInfoContent(monkeypatch, filesDir):
 
     # Valid data format, invalid content
     with monkeypatch.context() as mp:
-        mp.setattr(CheckMMD, "check_url", lambda *a, **k: (False, []))
+        mp.setattr(CheckMMD, "full_check", lambda *a, **k: False)
         passData = bytes(readFile(passFile), "utf-8")
         assert tstWorker._check_information_content(passData) == (
             False,
@@ -720,18 +1041,39 @@ def testApiWorker_AddLandingPage(filesDir):
         b"-9b37-3468e9cb1a2b</mmd:resource>\n  </mmd:related_information>\n</mmd:mmd>\n"
     )
 
+    # Empty elements are serialised as self-closing tags from the tree
+    data_w_landingpage = data_w_landingpage.replace(
+        b"<mmd:separator></mmd:separator>", b"<mmd:separator/>"
+    )
+    data_w_landingpage_andotherrelinfo = data_w_landingpage_andotherrelinfo.replace(
+        b"<mmd:separator></mmd:separator>", b"<mmd:separator/>"
+    )
+
     tstWorker = Worker("insert", passFile, None)
 
-    result = tstWorker._add_landing_page(data_wo_landingpage, catalog_url, uuid)
-    assert result == data_w_landingpage
-    result = tstWorker._add_landing_page(data_w_relinf_nolandingpage, catalog_url, uuid)
-    assert result == data_w_landingpage_andotherrelinfo
-    result = tstWorker._add_landing_page(data_w_old_landingpage, catalog_url, uuid)
-    assert result == data_w_landingpage
-    result = tstWorker._add_landing_page(
-        data_w_old_landingpage_wotherrelinfo, catalog_url, uuid
+    def addLandingPage(data):
+        doc = MMDDocument(data)
+        changed = tstWorker._add_landing_page(doc.xml_doc, catalog_url, uuid)
+        doc.tree_changed()
+        return changed, doc.data
+
+    assert addLandingPage(data_wo_landingpage) == (True, data_w_landingpage)
+    assert addLandingPage(data_w_relinf_nolandingpage) == (
+        True, data_w_landingpage_andotherrelinfo
+    )
+    assert addLandingPage(data_w_old_landingpage) == (True, data_w_landingpage)
+    assert addLandingPage(data_w_old_landingpage_wotherrelinfo) == (
+        True, data_w_landingpage_andotherrelinfo
+    )
+
+    # The tree is not modified if the landing page is already correct
+    assert addLandingPage(data_w_landingpage) == (False, data_w_landingpage)
+
+    # Landing page text that looks like a regex pattern is handled as text
+    data_w_pattern = data_w_old_landingpage.replace(
+        b"<mmd:description/>", b"<mmd:description>(.*)[</mmd:description>"
     )
-    assert result == data_w_landingpage_andotherrelinfo
+    assert addLandingPage(data_w_pattern) == (True, data_w_landingpage)
 
 
 # END Test testApiWorker_AddLandingPage
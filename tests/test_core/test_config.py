@@ -88,9 +88,40 @@ def testCoreConfig_Validate(rootDir, filesDir, tmpDir):
     assert theConf.mmd_xsd_path is None
     assert theConf.file_archive_path is None
     assert theConf.path_to_parent_list is None
+    assert theConf.vocab_ttl == 86400
+    assert theConf.concurrent_distributors is False
+    assert theConf.distributor_timeout is None
+    assert theConf.distributor_dependencies == {}
+    assert theConf.distributor_pool_size == 16
+    assert theConf.async_mode is False
+    assert theConf.async_workers == 2
+    assert theConf.job_retention == 86400
+    assert theConf.skip_unchanged is False
+    assert theConf.distribution_journal is False
+    assert theConf.journal_ttl == 86400
 
     assert theConf.csw_service_url == "http://localhost"
+    assert theConf.csw_pool_size == 10
+    assert theConf.csw_connect_timeout == 5
+    assert theConf.csw_read_timeout == 60
+    assert theConf.csw_batch_size == 1
+    assert theConf.csw_batch_wait == 0.05
+    assert theConf.csw_batch_timeout == 300
+    assert theConf.csw_native_update is True
+    assert theConf.solr_pool_size == 10
+    assert theConf.solr_batch_size == 1
+    assert theConf.solr_batch_wait == 0.05
+    assert theConf.solr_batch_timeout == 300
+    assert theConf.solr_commit_within is None
+    assert theConf.solr_soft_commit is False
     assert theConf.catalog_url == "http://localhost"
+    assert theConf.file_durability == "full"
+    assert theConf.file_manifest is False
+    assert theConf.file_manifest_path is None
+    assert theConf.file_versions is False
+    assert theConf.file_shard_positions == [7, 6, 5]
+    assert theConf.file_shard_width == 1
+    assert theConf.file_previous_shard_positions is None
 
     # Set valid values
     theConf.mmd_xsd_path = os.path.join(filesDir, "mmd", "mmd.xsd")
@@ -128,6 +159,29 @@ def testCoreConfig_Validate(rootDir, filesDir, tmpDir):
     theConf.file_archive_path = correctVal
     assert theConf._validate_config() is True
 
+    # Validate File Durability
+    theConf.file_durability = "always"
+    assert theConf._validate_config() is False
+    theConf.file_durability = "none"
+    assert theConf._validate_config() is True
+
+    # Validate File Shard Layout
+    theConf.file_shard_positions = []
+    assert theConf._validate_config() is False
+    theConf.file_shard_positions = [31, 30]
+    assert theConf._validate_config() is True
+    theConf.file_shard_width = 2
+    assert theConf._validate_config() is False
+    theConf.file_shard_positions = [0, "2"]
+    assert theConf._validate_config() is False
+    theConf.file_shard_positions = [0, 2]
+    assert theConf._validate_config() is True
+    theConf.file_previous_shard_positions = [7, 6, 5]
+    theConf.file_previous_shard_width = 0
+    assert theConf._validate_config() is False
+    theConf.file_previous_shard_width = 1
+    assert theConf._validate_config() is True
+
     # Validate Distributor Cache
     correctVal = theConf.distributor_cache
     theConf.distributor_cache = None
@@ -146,4 +200,45 @@ def testCoreConfig_Validate(rootDir, filesDir, tmpDir):
     theConf.rejected_jobs_path = correctVal
     assert theConf._validate_config() is True
 
+    # Validate Distributor Dependencies
+    theConf.distributor_dependencies = {"pycsw": ["file"], "solr": ["file"]}
+    assert theConf._validate_config() is True
+    theConf.distributor_dependencies = None
+    assert theConf._validate_config() is True
+    theConf.distributor_dependencies = ["file"]
+    assert theConf._validate_config() is False
+    theConf.distributor_dependencies = {"pycsw": "file"}
+    assert theConf._validate_config() is False
+    theConf.distributor_dependencies = {"pycsw": ["solr"], "solr": ["file"], "file": ["pycsw"]}
+    assert theConf._validate_config() is False
+    theConf.distributor_dependencies = {}
+    assert theConf._validate_config() is True
+
+    # Validate Distributor Pool Size
+    theConf.concurrent_distributors = True
+    assert theConf._validate_config() is True
+    theConf.distributor_pool_size = 0
+    assert theConf._validate_config() is False
+    theConf.concurrent_distributors = False
+    assert theConf._validate_config() is True
+    theConf.distributor_pool_size = 16
+
+    # Validate Async Workers
+    theConf.async_mode = True
+    assert theConf._validate_config() is True
+    theConf.async_workers = 0
+    assert theConf._validate_config() is False
+    theConf.async_mode = False
+    assert theConf._validate_config() is True
+    theConf.async_workers = 2
+
+    # Validate File Manifest Path
+    theConf.file_manifest = True
+    assert theConf._validate_config() is False
+    theConf.file_manifest_path = os.path.join(tmpDir, "missing", "manifest.sqlite")
+    assert theConf._validate_config() is False
+    theConf.file_manifest_path = os.path.join(tmpDir, "manifest.sqlite")
+    assert theConf._validate_config() is True
+    theConf.file_manifest = False
+
 # END Test testCoreConfig_Validate
@@ -26,6 +26,7 @@ import dmci
 from tools import readFile
 
 from dmci.config import Config
+from dmci.distributors.file_shards import ShardLayout
 
 
 @pytest.mark.core
@@ -98,3 +99,50 @@ def testCoreInit_ApiMain(monkeypatch, rootDir):
     assert sysExit.value.code is None
 
 # END Test testCoreInit_ApiMain
+
+
+@pytest.mark.core
+def testCoreInit_MigrateMain(monkeypatch, rootDir):
+    """Test the archive migration entry point function."""
+    migrated = []
+    monkeypatch.setattr(
+        "dmci.distributors.file_shards.migrate_archive",
+        lambda path, layout, manifest=None: migrated.append((path, layout, manifest)) or (1, 0)
+    )
+    monkeypatch.setattr(
+        "dmci.distributors.file_manifest.get_file_manifest", lambda *a: "manifest"
+    )
+
+    exampleConf = os.path.join(rootDir, "example_config.yaml")
+    monkeypatch.setenv("DMCI_CONFIG", exampleConf)
+
+    # Invalid config
+    with pytest.raises(SystemExit) as sysExit:
+        dmci.migrate_main()
+    assert sysExit.value.code == 1
+
+    # No file archive
+    monkeypatch.setattr(Config, "_validate_config", lambda *a: True)
+    with pytest.raises(SystemExit) as sysExit:
+        dmci.migrate_main()
+    assert sysExit.value.code == 1
+    assert migrated == []
+
+    # Valid config
+    monkeypatch.setattr(Config, "_read_file", lambda *a: None)
+    monkeypatch.setattr(dmci.CONFIG, "file_archive_path", "archive")
+    monkeypatch.setattr(dmci.CONFIG, "file_manifest", True)
+    with pytest.raises(SystemExit) as sysExit:
+        dmci.migrate_main()
+    assert sysExit.value.code == 0
+    assert migrated == [("archive", ShardLayout(), "manifest")]
+
+    # Failed moves
+    monkeypatch.setattr(
+        "dmci.distributors.file_shards.migrate_archive", lambda *a, **k: (0, 1)
+    )
+    with pytest.raises(SystemExit) as sysExit:
+        dmci.migrate_main()
+    assert sysExit.value.code == 1
+
+# END Test testCoreInit_MigrateMain
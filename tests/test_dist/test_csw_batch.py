@@ -0,0 +1,97 @@
+"""
+DMCI : CSW Transaction Batching Test
+====================================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import pytest
+
+from lxml import etree
+
+from dmci.distributors.csw_batch import CSWTransaction
+
+
+def makeSummary(inserted=0, deleted=0, identifiers=None, error=None, updated=0):
+    return {
+        "total_inserted": inserted,
+        "total_updated": updated,
+        "total_deleted": deleted,
+        "identifiers": identifiers,
+        "error": error,
+        "error_code": None,
+    }
+
+
+@pytest.mark.dist
+def testDistCSWBatch_Transaction():
+    """Test building a transaction and reading its results."""
+    transaction = CSWTransaction()
+    assert len(transaction) == 0
+    assert transaction.add(inserts=[("no.test:1", b"<rec1 />")]) == 0
+    assert transaction.add(deletes=["no.test:2"], inserts=[("no.test:2", b"<rec2 />")]) == 1
+    assert transaction.add(deletes=["no.test:<3>"]) == 2
+    assert len(transaction) == 3
+    assert transaction.expected() == (2, 2)
+
+    # The operations are in order, and the document is valid XML
+    root = etree.fromstring(transaction.to_xml())
+    assert [etree.QName(elem).localname for elem in root] == [
+        "Insert", "Delete", "Insert", "Delete"
+    ]
+    assert root.findtext(".//{*}Literal") == "no.test:2"
+    assert root.findall(".//{*}Literal")[1].text == "no.test:<3>"
+
+    # Everything succeeded
+    summary = makeSummary(2, 2, {"no.test:1", "no.test:2"})
+    assert transaction.results(summary, "ok") == [(True, "ok")]*3
+
+    # One insert is missing
+    summary = makeSummary(1, 2, {"no.test:2"})
+    results = transaction.results(summary, "ok")
+    assert results[0] == (False, "Record no.test:1 was not inserted: ok")
+    assert results[1:] == [(True, "ok")]*2
+
+    # Without identifiers, the inserts rely on the total count
+    assert transaction.results(makeSummary(2, 2), "ok") == [(True, "ok")]*3
+    assert transaction.results(makeSummary(1, 2), "ok")[0][0] is False
+
+    # A missing delete fails all entries with deletes
+    results = transaction.results(makeSummary(2, 1, {"no.test:1", "no.test:2"}), "ok")
+    assert results[0] == (True, "ok")
+    assert results[1] == (False, "Only 1 of 2 records were deleted: ok")
+    assert results[2] == (False, "Only 1 of 2 records were deleted: ok")
+
+    # An exception fails everything
+    assert transaction.results(makeSummary(error="Oops"), "err") == [(False, "err")]*3
+
+    # An entry can be sent again on its own
+    single = transaction.entry(1)
+    assert len(single) == 1
+    assert single.expected() == (1, 1)
+    root = etree.fromstring(single.to_xml())
+    assert [etree.QName(elem).localname for elem in root] == ["Delete", "Insert"]
+
+    # Updates are checked against the total count
+    transaction = CSWTransaction()
+    assert transaction.add(updates=[("no.test:4", b"<rec4 />")]) == 0
+    root = etree.fromstring(transaction.to_xml())
+    assert [etree.QName(elem).localname for elem in root] == ["Update"]
+    assert transaction.results(makeSummary(updated=1), "ok") == [(True, "ok")]
+    assert transaction.results(makeSummary(), "ok") == [
+        (False, "Only 0 of 1 records were updated: ok")
+    ]
+
+# END Test testDistCSWBatch_Transaction
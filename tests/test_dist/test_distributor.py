@@ -20,6 +20,7 @@ limitations under the License.
 import pytest
 
 from dmci.distributors.distributor import Distributor
+from dmci.tools import MMDDocument
 
 
 @pytest.mark.dist
@@ -70,3 +71,22 @@ def testDistDistributor_Run(tmpUUID):
         Distributor("insert", metadata_UUID=tmpUUID).run()
 
 # END Test testDistDistributor_Run
+
+
+@pytest.mark.dist
+def testDistDistributor_GetDoc(mockXml):
+    """Test that the parsed document is reused, or read once from the
+    xml file if none was given.
+    """
+    tstDoc = MMDDocument(b"<xml />")
+    tstDist = Distributor("insert", xml_file=mockXml, doc=tstDoc)
+    assert tstDist._get_doc() is tstDoc
+
+    tstDist = Distributor("insert", xml_file=mockXml)
+    tstDoc = tstDist._get_doc()
+    assert isinstance(tstDoc, MMDDocument)
+    assert tstDist._get_doc() is tstDoc
+    with open(mockXml, mode="rb") as inFile:
+        assert tstDoc.data == inFile.read()
+
+# END Test testDistDistributor_GetDoc
@@ -108,12 +108,13 @@ def testDistFile_InsertUpdate(tmpDir, filesDir, monkeypatch):
             False, "Failed to archive file: a1ddaf0f-cae0-4a15-9b37-3468e9cb1a2b.xml"
         )
 
-    # Fail the copy process
+    # Fail the copy process, which leaves no temporary file behind
     with monkeypatch.context() as mp:
-        mp.setattr("shutil.copy2", causeOSError)
+        mp.setattr("shutil.copyfileobj", causeOSError)
         assert tstDist.run() == (
             False, "Failed to archive file: a1ddaf0f-cae0-4a15-9b37-3468e9cb1a2b.xml"
         )
+        assert os.listdir(os.path.join(archDir, "arch_f", "arch_0", "arch_f")) == []
 
     # Update a new file is not allowed
     tstDist._cmd = DistCmd.UPDATE
@@ -204,3 +205,134 @@ def testDistFile_Delete(tmpDir, filesDir, monkeypatch):
     )
 
 # END Test testDistFile_Delete
+
+
+@pytest.mark.dist
+def testDistFile_AtomicWrite(fncDir, filesDir, monkeypatch):
+    """Test that archive files are renamed into place and synced."""
+    archDir = os.path.join(fncDir, "archive")
+    passFile = os.path.join(filesDir, "api", "passing.xml")
+    fileName = "a1ddaf0f-cae0-4a15-9b37-3468e9cb1a2b.xml"
+    archFile = os.path.join(archDir, "arch_f", "arch_0", "arch_f", fileName)
+
+    passXML = lxml.etree.fromstring(bytes(readFile(passFile), "utf-8"))
+    tstWorker = Worker("insert", passFile, None)
+    assert tstWorker._extract_metadata_id(passXML) is True
+
+    def newDist(cmd):
+        tstDist = FileDist(cmd, xml_file=passFile)
+        tstDist._worker = tstWorker
+        return tstDist
+
+    synced = []
+    realFsync = os.fsync
+
+    def mockFsync(fd):
+        synced.append(os.path.isdir(f"/proc/self/fd/{fd}"))
+        realFsync(fd)
+
+    with monkeypatch.context() as mp:
+        tstConf = newDist("insert")._conf
+        mp.setattr(tstConf, "file_archive_path", archDir)
+        mp.setattr("os.fsync", mockFsync)
+
+        # Full durability syncs the file and the new folders
+        assert newDist("insert").run() == (True, "Added file: %s" % fileName)
+        assert readFile(archFile) == readFile(passFile)
+        assert synced == [False, True, True, True, True]
+        assert os.listdir(os.path.dirname(archFile)) == [fileName]
+
+        # A file inserted since the existence check is not replaced,
+        # also if the file system has no hard links
+        dists = [newDist("insert") for _ in range(3)]
+        mp.setattr("os.path.isfile", lambda *a: False)
+        assert dists[0].run() == (False, "File already exists: %s" % fileName)
+        mp.setattr("os.link", causeOSError)
+        assert dists[1].run() == (False, "File already exists: %s" % fileName)
+        assert os.listdir(os.path.dirname(archFile)) == [fileName]
+
+        os.unlink(archFile)
+        assert dists[2].run() == (True, "Added file: %s" % fileName)
+        assert readFile(archFile) == readFile(passFile)
+
+    with monkeypatch.context() as mp:
+        mp.setattr(tstConf, "file_archive_path", archDir)
+        mp.setattr("os.fsync", mockFsync)
+
+        # File durability only syncs the file
+        synced.clear()
+        mp.setattr(tstConf, "file_durability", "file")
+        assert newDist("update").run() == (True, "Replaced file: %s" % fileName)
+        assert synced == [False]
+
+        # No durability syncs nothing
+        synced.clear()
+        mp.setattr(tstConf, "file_durability", "none")
+        assert newDist("update").run() == (True, "Replaced file: %s" % fileName)
+        assert synced == []
+
+        # In a batch, the folder is synced once at the end
+        synced.clear()
+        mp.setattr(tstConf, "file_durability", "full")
+        results = FileDist.run_batch([newDist("update"), newDist("update")])
+        assert results == [(True, "Replaced file: %s" % fileName)]*2
+        assert synced == [False, False, True]
+        assert os.listdir(os.path.dirname(archFile)) == [fileName]
+
+# END Test testDistFile_AtomicWrite
+
+
+@pytest.mark.dist
+def testDistFile_LinkFromCache(fncDir, filesDir, monkeypatch):
+    """Test that files in the distributor cache are linked into the
+    archive instead of copied.
+    """
+    archDir = os.path.join(fncDir, "archive")
+    cacheDir = os.path.join(fncDir, "cache")
+    passFile = os.path.join(filesDir, "api", "passing.xml")
+    cacheFile = os.path.join(cacheDir, "job.xml")
+    fileName = "a1ddaf0f-cae0-4a15-9b37-3468e9cb1a2b.xml"
+    archFile = os.path.join(archDir, "arch_f", "arch_0", "arch_f", fileName)
+
+    os.mkdir(cacheDir)
+    with open(cacheFile, mode="w", encoding="utf-8") as outfile:
+        outfile.write(readFile(passFile))
+
+    passXML = lxml.etree.fromstring(bytes(readFile(passFile), "utf-8"))
+    tstWorker = Worker("insert", passFile, None)
+    assert tstWorker._extract_metadata_id(passXML) is True
+
+    def newDist(cmd, xmlFile):
+        tstDist = FileDist(cmd, xml_file=xmlFile)
+        tstDist._worker = tstWorker
+        return tstDist
+
+    with monkeypatch.context() as mp:
+        tstConf = newDist("insert", cacheFile)._conf
+        mp.setattr(tstConf, "file_archive_path", archDir)
+        mp.setattr(tstConf, "distributor_cache", cacheDir)
+
+        # A file in the cache is hard linked
+        assert newDist("insert", cacheFile).run() == (True, "Added file: %s" % fileName)
+        assert os.path.samefile(cacheFile, archFile)
+        assert os.listdir(os.path.dirname(archFile)) == [fileName]
+
+        # The archived file is kept when the cache file is removed
+        os.unlink(cacheFile)
+        assert readFile(archFile) == readFile(passFile)
+
+        # A file outside the cache is copied
+        assert newDist("update", passFile).run() == (True, "Replaced file: %s" % fileName)
+        assert not os.path.samefile(passFile, archFile)
+        assert readFile(archFile) == readFile(passFile)
+
+        # If linking fails, the file is copied
+        with open(cacheFile, mode="w", encoding="utf-8") as outfile:
+            outfile.write(readFile(passFile))
+        mp.setattr("os.link", causeOSError)
+        assert newDist("update", cacheFile).run() == (True, "Replaced file: %s" % fileName)
+        assert not os.path.samefile(cacheFile, archFile)
+        assert readFile(archFile) == readFile(passFile)
+        assert os.listdir(os.path.dirname(archFile)) == [fileName]
+
+# END Test testDistFile_LinkFromCache
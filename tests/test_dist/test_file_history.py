@@ -0,0 +1,154 @@
+"""
+DMCI : File Archive History Test
+================================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import uuid
+import lxml
+import pytest
+
+from tools import causeOSError, readFile, writeFile
+
+from dmci.api.worker import Worker
+from dmci.distributors import FileDist
+from dmci.distributors.file_dist import get_archive_file
+from dmci.distributors.file_history import FileHistory
+
+
+@pytest.mark.dist
+def testDistFileHistory_Versions(fncDir, monkeypatch):
+    """Test adding and reading versions."""
+    archFile = os.path.join(fncDir, "file.xml")
+    history = FileHistory(archFile)
+    assert history.versions() == []
+    assert history.read(1) is None
+
+    for i in range(3):
+        with open(archFile, mode="w", encoding="utf-8") as outfile:
+            outfile.write("<mmd>version %d</mmd>" % i * 100)
+        assert history.add(archFile) == i + 1
+
+    versions = history.versions()
+    assert [v["version"] for v in versions] == [1, 2, 3]
+    assert [v["size"] for v in versions] == [2000, 2000, 2000]
+    assert all(v["length"] < v["size"] for v in versions)
+    assert sorted(os.listdir(fncDir)) == [
+        "file.xml", "file.xml.versions", "file.xml.versions.json"
+    ]
+
+    assert history.read(1) == b"<mmd>version 0</mmd>" * 100
+    assert history.read(3) == b"<mmd>version 2</mmd>" * 100
+    assert history.read(4) is None
+
+    # A failed index write does not list the new version
+    with monkeypatch.context() as mp:
+        mp.setattr("os.replace", causeOSError)
+        with pytest.raises(OSError):
+            history.add(archFile)
+    assert [v["version"] for v in history.versions()] == [1, 2, 3]
+    assert history.add(archFile) == 4
+    assert history.read(4) == b"<mmd>version 2</mmd>" * 100
+    assert history.read(2) == b"<mmd>version 1</mmd>" * 100
+
+    # The file is updated once its version is listed, and is read
+    # while the pack is locked
+    updated = []
+    assert history.add(archFile, lambda: updated.append(history.versions()[-1])) == 5
+    assert [v["version"] for v in updated] == [5]
+
+    def otherWriter(fileObj):
+        # The file is replaced while waiting for the lock
+        writeFile(archFile, "<mmd>replaced</mmd>")
+
+    with monkeypatch.context() as mp:
+        mp.setattr(FileHistory, "_lock", staticmethod(otherWriter))
+        assert history.add(archFile) == 6
+    assert history.read(6) == b"<mmd>replaced</mmd>"
+    assert history.add(archFile) == 7
+
+    # Versions are packed without a timestamp
+    versions = history.versions()
+    assert versions[-1]["length"] == versions[-2]["length"]
+    with open(archFile + ".versions", mode="rb") as infile:
+        infile.seek(versions[-2]["offset"])
+        packed = infile.read()
+    assert packed[:len(packed)//2] == packed[len(packed)//2:]
+
+# END Test testDistFileHistory_Versions
+
+
+@pytest.mark.dist
+def testDistFileHistory_FileDist(fncDir, filesDir, monkeypatch):
+    """Test that FileDist keeps the replaced and deleted versions."""
+    archDir = os.path.join(fncDir, "archive")
+    passFile = os.path.join(filesDir, "api", "passing.xml")
+    fileUUID = uuid.UUID("a1ddaf0f-cae0-4a15-9b37-3468e9cb1a2b")
+    archFile = get_archive_file(archDir, fileUUID)
+    history = FileHistory(archFile)
+
+    passXML = lxml.etree.fromstring(bytes(readFile(passFile), "utf-8"))
+    tstWorker = Worker("insert", passFile, None)
+    assert tstWorker._extract_metadata_id(passXML) is True
+
+    def newDist(cmd):
+        if cmd == "delete":
+            return FileDist(cmd, metadata_UUID=fileUUID)
+        tstDist = FileDist(cmd, xml_file=passFile)
+        tstDist._worker = tstWorker
+        return tstDist
+
+    tstConf = newDist("insert")._conf
+    monkeypatch.setattr(tstConf, "file_archive_path", archDir)
+
+    # Disabled by default
+    assert newDist("insert").run()[0] is True
+    assert newDist("update").run()[0] is True
+    assert history.versions() == []
+
+    monkeypatch.setattr(tstConf, "file_versions", True)
+    with open(archFile, mode="w", encoding="utf-8") as outfile:
+        outfile.write("<mmd>old</mmd>")
+
+    assert newDist("update").run()[0] is True
+    assert [v["version"] for v in history.versions()] == [1]
+    assert history.read(1) == b"<mmd>old</mmd>"
+    assert readFile(archFile) == readFile(passFile)
+
+    # The file is not replaced if its version cannot be kept
+    with monkeypatch.context() as mp:
+        mp.setattr(FileHistory, "_compress", causeOSError)
+        assert newDist("update").run() == (
+            False, "Failed to archive file: %s" % os.path.basename(archFile)
+        )
+        assert newDist("delete").run() == (
+            False, "Failed to delete file: %s" % os.path.basename(archFile)
+        )
+    assert os.path.isfile(archFile)
+    assert [v["version"] for v in history.versions()] == [1]
+
+    # The deleted version is kept, and the history outlives the file
+    assert newDist("delete").run()[0] is True
+    assert not os.path.isfile(archFile)
+    assert [v["version"] for v in history.versions()] == [1, 2]
+    assert history.read(2) == readFile(passFile).encode("utf-8")
+
+    assert newDist("insert").run()[0] is True
+    assert newDist("update").run()[0] is True
+    assert [v["version"] for v in history.versions()] == [1, 2, 3]
+
+# END Test testDistFileHistory_FileDist
@@ -0,0 +1,243 @@
+"""
+DMCI : File Archive Manifest Test
+=================================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import uuid
+import lxml
+import pytest
+
+from tools import causeOSError, readFile
+
+from dmci.api.worker import Worker
+from dmci.distributors import FileDist
+from dmci.distributors.file_manifest import (
+    FileManifest, get_file_manifest, rebuild_file_manifest
+)
+from dmci.tools.file_records import RecordLock
+
+
+@pytest.mark.dist
+def testDistFileManifest_Records(fncDir, monkeypatch):
+    """Test recording and looking up archive changes."""
+    uuidA = uuid.UUID("a1ddaf0f-cae0-4a15-9b37-3468e9cb1a2b")
+    uuidB = uuid.UUID("ee1ddaf0-cae0-4a15-9b37-3468e9cb1a2b")
+    manifest = FileManifest(os.path.join(fncDir, "manifest.sqlite"))
+    assert len(manifest) == 0
+    assert manifest.exists(uuidA) is False
+    assert manifest.get(uuidA) is None
+
+    manifest.apply([
+        (FileManifest.ADDED, uuidA, "a.xml", 10),
+        (FileManifest.ADDED, uuidB, "b.xml", 20),
+    ])
+    assert len(manifest) == 2
+    assert manifest.exists(uuidA) is True
+    assert manifest.get(uuidB)["path"] == "b.xml"
+    assert manifest.get(uuidB)["size"] == 20
+
+    modified = manifest.get(uuidA)["modified"]
+    manifest.apply([(FileManifest.REPLACED, uuidA, "a.xml", 30)])
+    assert manifest.get(uuidA)["size"] == 30
+    assert manifest.get(uuidA)["modified"] > modified
+    assert [r["uuid"] for r in manifest.records()] == [str(uuidB), str(uuidA)]
+    modified = manifest.get(uuidA)["modified"]
+    assert [r["uuid"] for r in manifest.records(modified_since=modified)] == [str(uuidA)]
+
+    manifest.apply([(FileManifest.DELETED, uuidB, None, None)])
+    assert manifest.exists(uuidB) is False
+    assert len(manifest) == 1
+
+    # The change log keeps every change
+    assert [(c["seq"], c["uuid"], c["action"]) for c in manifest.changes()] == [
+        (1, str(uuidA), "added"),
+        (2, str(uuidB), "added"),
+        (3, str(uuidA), "replaced"),
+        (4, str(uuidB), "deleted"),
+    ]
+    assert [c["seq"] for c in manifest.changes(since=2)] == [3, 4]
+
+    # A failed change is rolled back
+    with pytest.raises(Exception):
+        manifest.apply([(FileManifest.ADDED, uuidB, "b.xml", 20), ("added", None, None, 0)])
+    assert manifest.exists(uuidB) is False
+    assert len(list(manifest.changes())) == 4
+
+    # The manifest is shared by the threads and processes using it
+    assert FileManifest(os.path.join(fncDir, "manifest.sqlite")).exists(uuidA) is True
+
+# END Test testDistFileManifest_Records
+
+
+@pytest.mark.dist
+def testDistFileManifest_Rebuild(fncDir, monkeypatch):
+    """Test that a manifest is filled from the archive folders."""
+    archDir = os.path.join(fncDir, "archive")
+    dbPath = os.path.join(fncDir, "manifest.sqlite")
+    fileName = "a1ddaf0f-cae0-4a15-9b37-3468e9cb1a2b.xml"
+    filePath = os.path.join("arch_f", "arch_0", "arch_f", fileName)
+    os.makedirs(os.path.join(archDir, "arch_f", "arch_0", "arch_f"))
+    os.makedirs(os.path.join(archDir, "other"))
+    for path in (filePath, os.path.join("arch_f", "notes.xml"), os.path.join("other", fileName)):
+        with open(os.path.join(archDir, path), mode="w", encoding="utf-8") as outfile:
+            outfile.write("<mmd/>")
+
+    # A new manifest is empty until it is rebuilt
+    monkeypatch.setattr("dmci.distributors.file_manifest._MANIFESTS", {})
+    manifest = get_file_manifest(dbPath)
+    assert len(manifest) == 0
+    assert manifest.is_complete() is False
+
+    assert rebuild_file_manifest(dbPath, archDir) is True
+    assert manifest.is_complete() is True
+    assert [(r["uuid"], r["path"], r["size"]) for r in manifest.records()] == [
+        ("a1ddaf0f-cae0-4a15-9b37-3468e9cb1a2b", filePath, 6)
+    ]
+    assert list(manifest.changes()) == []
+    assert not os.path.exists(dbPath + ".lock")
+
+    # The manifest is opened once per process, and rebuilt once
+    assert get_file_manifest(dbPath) is manifest
+    with monkeypatch.context() as mp:
+        mp.setattr("os.walk", causeOSError)
+        assert rebuild_file_manifest(dbPath, archDir) is True
+
+    # Changes made while the archive is walked are kept
+    realWalk = os.walk
+
+    def walkAndDelete(*args):
+        manifest.apply([(FileManifest.DELETED, fileName[:-4], None, None)])
+        yield from realWalk(*args)
+
+    manifest.mark_incomplete()
+    with monkeypatch.context() as mp:
+        mp.setattr("os.walk", walkAndDelete)
+        assert rebuild_file_manifest(dbPath, archDir) is True
+    assert len(manifest) == 0
+
+    # Only one process rebuilds the manifest
+    manifest.mark_incomplete()
+    otherLock = RecordLock(dbPath)
+    assert otherLock.acquire() is True
+    assert rebuild_file_manifest(dbPath, archDir) is False
+    otherLock.release()
+
+    # A failed rebuild leaves the manifest incomplete
+    with monkeypatch.context() as mp:
+        mp.setattr("os.walk", causeOSError)
+        assert rebuild_file_manifest(dbPath, archDir) is False
+    assert manifest.is_complete() is False
+    assert rebuild_file_manifest(dbPath, archDir) is True
+    assert len(manifest) == 1
+
+    # A manifest that cannot be opened is reported as missing
+    missingPath = os.path.join(fncDir, "missing", "manifest.sqlite")
+    assert get_file_manifest(missingPath) is None
+    assert rebuild_file_manifest(missingPath, archDir) is False
+
+# END Test testDistFileManifest_Rebuild
+
+
+@pytest.mark.dist
+def testDistFileManifest_FileDist(fncDir, filesDir, monkeypatch):
+    """Test that FileDist records its changes in the manifest."""
+    archDir = os.path.join(fncDir, "archive")
+    passFile = os.path.join(filesDir, "api", "passing.xml")
+    fileUUID = "a1ddaf0f-cae0-4a15-9b37-3468e9cb1a2b"
+    filePath = os.path.join("arch_f", "arch_0", "arch_f", f"{fileUUID}.xml")
+    os.mkdir(archDir)
+
+    passXML = lxml.etree.fromstring(bytes(readFile(passFile), "utf-8"))
+    tstWorker = Worker("insert", passFile, None)
+    assert tstWorker._extract_metadata_id(passXML) is True
+
+    def newDist(cmd):
+        if cmd == "delete":
+            return FileDist(cmd, metadata_UUID=uuid.UUID(fileUUID))
+        tstDist = FileDist(cmd, xml_file=passFile)
+        tstDist._worker = tstWorker
+        return tstDist
+
+    dbPath = os.path.join(fncDir, "manifest.sqlite")
+    monkeypatch.setattr("dmci.distributors.file_manifest._MANIFESTS", {})
+    tstConf = newDist("insert")._conf
+    monkeypatch.setattr(tstConf, "file_archive_path", archDir)
+    monkeypatch.setattr(tstConf, "file_manifest_path", dbPath)
+
+    # Disabled by default
+    assert newDist("insert").run()[0] is True
+    assert newDist("delete").run()[0] is True
+    assert os.listdir(archDir) == ["arch_f"]
+    assert not os.path.exists(dbPath)
+
+    monkeypatch.setattr(tstConf, "file_manifest", True)
+    manifest = get_file_manifest(dbPath)
+
+    assert newDist("insert").run()[0] is True
+    record = manifest.get(fileUUID)
+    assert record["path"] == filePath
+    assert record["size"] == os.path.getsize(passFile)
+
+    # A failed job is not recorded
+    assert newDist("insert").run()[0] is False
+    assert [c["action"] for c in manifest.changes()] == ["added"]
+
+    # A batch is recorded in one transaction
+    applied = []
+    monkeypatch.setattr(manifest, "apply", lambda c, apply=manifest.apply: (
+        applied.append(len(c)), apply(c)
+    ))
+    results = FileDist.run_batch([newDist("update"), newDist("update")])
+    assert [status for status, _ in results] == [True, True]
+    assert applied == [2]
+    assert [c["action"] for c in manifest.changes()] == ["added", "replaced", "replaced"]
+
+    # Once complete, files are looked up in the manifest
+    assert manifest.is_complete() is False
+    assert rebuild_file_manifest(dbPath, archDir) is True
+    manifest.apply([(FileManifest.DELETED, fileUUID, None, None)])
+    assert newDist("update").run() == (False, f"Cannot update non-existing file: {fileUUID}.xml")
+    assert manifest.rebuild(archDir) == 1
+
+    # If the lookup fails, the archive folders are checked
+    with monkeypatch.context() as mp:
+        mp.setattr(manifest, "exists", causeOSError)
+        assert newDist("update").run()[0] is True
+
+    # A manifest error does not fail the job, but the manifest is marked
+    # as out of date and rebuilt
+    rebuilds = []
+    monkeypatch.setattr(
+        "dmci.distributors.file_dist.start_manifest_rebuild", lambda *a: rebuilds.append(a)
+    )
+    with monkeypatch.context() as mp:
+        mp.setattr(manifest, "apply", causeOSError)
+        assert newDist("delete").run()[0] is True
+        assert manifest.is_complete() is False
+        assert rebuild_file_manifest(dbPath, archDir) is True
+        assert manifest.exists(fileUUID) is False
+        assert newDist("insert").run()[0] is True
+
+    assert rebuilds == 2*[(dbPath, archDir, tstConf.file_durability)]
+    assert manifest.is_complete() is False
+    assert manifest.exists(fileUUID) is False
+    assert newDist("update").run()[0] is True
+    assert newDist("delete").run()[0] is True
+    assert os.listdir(os.path.dirname(os.path.join(archDir, filePath))) == []
+
+# END Test testDistFileManifest_FileDist
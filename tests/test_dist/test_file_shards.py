@@ -0,0 +1,191 @@
+"""
+DMCI : File Archive Sharding Test
+=================================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import uuid
+import lxml
+import pytest
+
+from tools import causeOSError, readFile, writeFile
+
+from dmci.api.worker import Worker
+from dmci.distributors import FileDist
+from dmci.distributors.file_dist import get_archive_file, get_folder_names
+from dmci.distributors.file_history import FileHistory
+from dmci.distributors.file_manifest import FileManifest
+from dmci.distributors.file_shards import ShardLayout, migrate_archive, move_archived
+
+UUID_A = uuid.UUID("a1ddaf0f-cae0-4a15-9b37-3468e9cb1a2b")
+UUID_B = uuid.UUID("0123abcd-cae0-4a15-9b37-3468e9cb1a2b")
+
+
+@pytest.mark.dist
+def testDistFileShards_Layout():
+    """Test the archive paths of a layout."""
+    # The default layout is the original three levels
+    assert get_folder_names(UUID_A) == ("arch_f", "arch_0", "arch_f")
+    assert get_archive_file("arch", UUID_A) == os.path.join(
+        "arch", "arch_f", "arch_0", "arch_f", f"{UUID_A}.xml"
+    )
+    assert ShardLayout() == ShardLayout([7, 6, 5], 1)
+    assert ShardLayout() != ShardLayout([7, 6, 5], 2)
+
+    layout = ShardLayout([0, 2], 2)
+    assert get_folder_names(UUID_B, layout) == ("arch_01", "arch_23")
+    assert get_archive_file("arch", UUID_B, layout) == os.path.join(
+        "arch", "arch_01", "arch_23", f"{UUID_B}.xml"
+    )
+    assert layout.folder_names(UUID_A) == ["arch_a1", "arch_dd"]
+
+# END Test testDistFileShards_Layout
+
+
+@pytest.mark.dist
+def testDistFileShards_Migrate(fncDir, monkeypatch):
+    """Test moving an archive to a new layout."""
+    archDir = os.path.join(fncDir, "archive")
+    oldLayout = ShardLayout()
+    newLayout = ShardLayout([0, 2], 2)
+    oldA = oldLayout.file_path(archDir, UUID_A)
+    oldB = oldLayout.file_path(archDir, UUID_B)
+    newA = newLayout.file_path(archDir, UUID_A)
+    newB = newLayout.file_path(archDir, UUID_B)
+
+    os.makedirs(os.path.dirname(oldA))
+    os.makedirs(os.path.dirname(oldB))
+    writeFile(oldA, "<mmd>A</mmd>")
+    writeFile(oldB, "<mmd>B1</mmd>")
+    FileHistory(oldB).add(oldB)
+    writeFile(oldB, "<mmd>B2</mmd>")
+    writeFile(os.path.join(os.path.dirname(oldB), "notes.xml"), "")
+    os.unlink(oldA)
+    writeFile(oldA, "<mmd>A</mmd>")
+    FileHistory(oldA).add(oldA)
+    os.unlink(oldA)
+
+    # The history of a deleted file is moved on its own
+    manifest = FileManifest(os.path.join(archDir, "manifest.sqlite"))
+    assert migrate_archive(archDir, newLayout, manifest=manifest) == (1, 0)
+    assert readFile(newB) == "<mmd>B2</mmd>"
+    assert FileHistory(newB).read(1) == b"<mmd>B1</mmd>"
+    assert FileHistory(newA).read(1) == b"<mmd>A</mmd>"
+    assert not os.path.exists(oldB)
+    assert [(c["uuid"], c["action"]) for c in manifest.changes()] == [(str(UUID_B), "moved")]
+    assert manifest.get(UUID_B)["path"] == os.path.relpath(newB, archDir)
+
+    # The old folders are removed if they are empty
+    assert not os.path.isdir(os.path.dirname(oldA))
+    assert os.listdir(os.path.dirname(oldB)) == ["notes.xml"]
+
+    # Running it again does nothing
+    assert migrate_archive(archDir, newLayout) == (0, 0)
+
+    # Failed moves are counted
+    with monkeypatch.context() as mp:
+        mp.setattr("dmci.distributors.file_shards.move_archived", causeOSError)
+        assert migrate_archive(archDir, oldLayout) == (0, 2)
+    assert migrate_archive(archDir, oldLayout) == (1, 0)
+    assert readFile(oldB) == "<mmd>B2</mmd>"
+    assert FileHistory(oldA).read(1) == b"<mmd>A</mmd>"
+
+    # A file at both paths is out of date at the old path
+    os.makedirs(os.path.dirname(newB))
+    writeFile(newB, "<mmd>B3</mmd>")
+    assert move_archived(oldB, newB) is True
+    assert readFile(newB) == "<mmd>B3</mmd>"
+    assert not os.path.exists(oldB)
+    assert move_archived(oldB, newB) is False
+
+    # A file moved by another process at the same time is not an error
+    writeFile(oldA, "<mmd>A2</mmd>")
+    realLink = os.link
+    realRename = os.rename
+
+    def otherLink(src, dst):
+        realLink(src, dst)
+        os.unlink(src)
+
+    def otherRename(src, dst):
+        realRename(src, dst)
+        raise FileNotFoundError(src)
+
+    with monkeypatch.context() as mp:
+        mp.setattr("dmci.distributors.file_shards.os.link", otherLink)
+        mp.setattr("dmci.distributors.file_shards.os.rename", otherRename)
+        assert move_archived(oldA, newA) is True
+    assert readFile(newA) == "<mmd>A2</mmd>"
+    assert FileHistory(newA).read(1) == b"<mmd>A</mmd>"
+    assert not os.path.exists(oldA)
+    assert os.listdir(os.path.dirname(oldA)) == []
+
+# END Test testDistFileShards_Migrate
+
+
+@pytest.mark.dist
+def testDistFileShards_DualRead(fncDir, filesDir, monkeypatch):
+    """Test that FileDist finds files in the previous layout."""
+    archDir = os.path.join(fncDir, "archive")
+    passFile = os.path.join(filesDir, "api", "passing.xml")
+    oldFile = ShardLayout().file_path(archDir, UUID_A)
+    newFile = ShardLayout([0], 2).file_path(archDir, UUID_A)
+    fileName = f"{UUID_A}.xml"
+
+    passXML = lxml.etree.fromstring(bytes(readFile(passFile), "utf-8"))
+    tstWorker = Worker("insert", passFile, None)
+    assert tstWorker._extract_metadata_id(passXML) is True
+
+    def newDist(cmd):
+        if cmd == "delete":
+            return FileDist(cmd, metadata_UUID=UUID_A)
+        tstDist = FileDist(cmd, xml_file=passFile)
+        tstDist._worker = tstWorker
+        return tstDist
+
+    tstConf = newDist("insert")._conf
+    monkeypatch.setattr(tstConf, "file_archive_path", archDir)
+    assert newDist("insert").run() == (True, "Added file: %s" % fileName)
+    assert os.path.isfile(oldFile)
+
+    # Without the previous layout, the file is not found
+    monkeypatch.setattr(tstConf, "file_shard_positions", [0])
+    monkeypatch.setattr(tstConf, "file_shard_width", 2)
+    assert newDist("delete").run() == (False, "File not found: %s" % fileName)
+
+    # With it, the file is moved to the new layout when it is used
+    monkeypatch.setattr(tstConf, "file_previous_shard_positions", [7, 6, 5])
+    assert newDist("insert").run() == (False, "File already exists: %s" % fileName)
+    assert os.path.isfile(newFile)
+    assert not os.path.isfile(oldFile)
+
+    writeFile(oldFile, "<mmd/>")
+    os.unlink(newFile)
+    with monkeypatch.context() as mp:
+        mp.setattr("os.link", causeOSError)
+        assert newDist("update").run() == (False, "Failed to archive file: %s" % fileName)
+        assert newDist("delete").run() == (False, "Failed to delete file: %s" % fileName)
+    assert newDist("update").run() == (True, "Replaced file: %s" % fileName)
+    assert readFile(newFile) == readFile(passFile)
+
+    writeFile(oldFile, "<mmd/>")
+    os.unlink(newFile)
+    assert newDist("delete").run() == (True, "Deleted file: %s" % fileName)
+    assert not os.path.isfile(oldFile)
+    assert not os.path.isfile(newFile)
+
+# END Test testDistFileShards_DualRead
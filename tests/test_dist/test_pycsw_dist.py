@@ -19,14 +19,18 @@ limitations under the License.
 
 import os
 import pytest
+import shutil
 import requests
 
 from lxml import etree
 from unittest import mock
+from prometheus_client import REGISTRY
 from tools import causeException
 
 from dmci.api.worker import Worker
-from dmci.distributors.pycsw_dist import PyCSWDist
+from dmci.distributors import pycsw_dist
+from dmci.distributors.distributor import DistCmd
+from dmci.distributors.pycsw_dist import PyCSWDist, get_xslt_transform, get_csw_session
 
 
 class mockResp:
@@ -68,7 +72,7 @@ def testDistPyCSW_Insert(monkeypatch, mockXml, mockXslt, tmpConf):
     with monkeypatch.context() as mp:
         mp.setattr(PyCSWDist, "_translate", lambda *a: b"<xml />")
         mp.setattr(
-            "dmci.distributors.pycsw_dist.requests.post", lambda *a, **k: mockResp
+            "dmci.distributors.pycsw_dist.requests.Session.post", lambda *a, **k: mockResp
         )
         mp.setattr(PyCSWDist, "_get_transaction_status", lambda *a: True)
         tstPyCSW = PyCSWDist("insert", xml_file=mockXml)
@@ -79,7 +83,7 @@ def testDistPyCSW_Insert(monkeypatch, mockXml, mockXslt, tmpConf):
     with monkeypatch.context() as mp:
         mp.setattr(PyCSWDist, "_translate", lambda *a: b"<xml />")
         mp.setattr(
-            "dmci.distributors.pycsw_dist.requests.post", lambda *a, **k: mockResp
+            "dmci.distributors.pycsw_dist.requests.Session.post", lambda *a, **k: mockResp
         )
         mp.setattr(PyCSWDist, "_get_transaction_status", lambda *a: False)
 
@@ -90,7 +94,7 @@ def testDistPyCSW_Insert(monkeypatch, mockXml, mockXslt, tmpConf):
     # Insert returns False if the http post request fails
     with monkeypatch.context() as mp:
         mp.setattr(
-            "dmci.distributors.pycsw_dist.requests.post", causeException)
+            "dmci.distributors.pycsw_dist.requests.Session.post", causeException)
         tstPyCSW = PyCSWDist("insert", xml_file=mockXml)
         tstPyCSW._conf = tmpConf
         assert tstPyCSW.run() == (
@@ -101,6 +105,186 @@ def testDistPyCSW_Insert(monkeypatch, mockXml, mockXslt, tmpConf):
     # END Test testDistPyCSW_Insert
 
 
+@pytest.mark.dist
+def testDistPyCSW_RunBatch(monkeypatch, mockXml, tmpUUID, tmpConf):
+    """Test inserting a batch of records in one transaction."""
+    posted = []
+
+    def makePost(text):
+        def fakePost(self, url, data=None, **kwargs):
+            posted.append(data)
+            resp = requests.models.Response()
+            resp.status_code = 200
+            resp._content = text.encode("utf-8")
+            return resp
+        return fakePost
+
+    def newDist(identifier):
+        tstPyCSW = PyCSWDist("insert", xml_file=mockXml)
+        tstPyCSW._conf = tmpConf
+        tstPyCSW._translate = lambda *a: (
+            b'<gmd:MD_Metadata xmlns:gmd="http://www.isotc211.org/2005/gmd" '
+            b'xmlns:gco="http://www.isotc211.org/2005/gco"><gmd:fileIdentifier>'
+            b'<gco:CharacterString>%s</gco:CharacterString>'
+            b'</gmd:fileIdentifier></gmd:MD_Metadata>' % identifier.encode()
+        )
+        return tstPyCSW
+
+    response = (
+        '<csw:TransactionResponse xmlns:csw="http://www.opengis.net/cat/csw/2.0.2" '
+        'xmlns:dc="http://purl.org/dc/elements/1.1/">'
+        '<csw:TransactionSummary><csw:totalInserted>2</csw:totalInserted>'
+        '</csw:TransactionSummary><csw:InsertResult>'
+        '<csw:BriefRecord><dc:identifier>no.test:1</dc:identifier></csw:BriefRecord>'
+        '<csw:BriefRecord><dc:identifier>no.test:2</dc:identifier></csw:BriefRecord>'
+        '</csw:InsertResult></csw:TransactionResponse>'
+    )
+
+    with monkeypatch.context() as mp:
+        mp.setattr("dmci.distributors.pycsw_dist.requests.Session.post", makePost(response))
+
+        # Records not listed in the response are sent again on their
+        # own, and records that could not be translated fail
+        failDist = newDist("")
+        failDist._translate = lambda *a: b""
+        dists = [newDist("no.test:1"), failDist, newDist("no.test:2"), newDist("no.test:3")]
+        results = PyCSWDist.run_batch(dists)
+        assert len(posted) == 2
+        assert posted[0].count(b"<csw:Insert>") == 3
+        assert posted[1].count(b"<csw:Insert>") == 1
+        assert b"no.test:3" in posted[1]
+        assert results[0] == (True, response)
+        assert results[1] == (False, "Failed to translate MMD to ISO19139")
+        assert results[2] == (True, response)
+        assert results[3][0] is False
+        assert results[3][1].startswith("Record no.test:3 was not inserted")
+
+        # Deletes are sent on their own, and the record of an update is
+        # only inserted if its delete succeeded
+        posted.clear()
+        delWorker = Worker("delete", None, None)
+        delWorker._namespace = "no.test"
+        delDist = PyCSWDist("delete", metadata_UUID=tmpUUID, worker=delWorker)
+        updDist = newDist("no.test:2")
+        updDist._cmd = DistCmd.UPDATE
+        updDist._worker = delWorker
+        updDist._read_metadata_uuid = lambda: (True, "")
+        updDist._metadata_UUID = tmpUUID
+        delResponse = response.replace(
+            "</csw:totalInserted>", "</csw:totalInserted><csw:totalDeleted>1</csw:totalDeleted>"
+        )
+        mp.setattr("dmci.distributors.pycsw_dist.requests.Session.post", makePost(delResponse))
+        results = PyCSWDist.run_batch([delDist, updDist, newDist("no.test:1")])
+        assert [status for status, _ in results] == [True, True, True]
+        assert results[1][1] == delResponse.replace("insert", "update")
+        assert [data.count(b"<csw:Delete>") for data in posted] == [1, 1, 0]
+        assert posted[2].count(b"<csw:Insert>") == 2
+        assert b"no.test:%s" % str(tmpUUID).encode() in posted[0]
+
+        posted.clear()
+        mp.setattr("dmci.distributors.pycsw_dist.requests.Session.post", makePost(response))
+        results = PyCSWDist.run_batch([updDist, newDist("no.test:1")])
+        assert results[0] == (False, response)
+        assert results[1] == (True, response)
+        assert len(posted) == 2
+        assert b"no.test:2" not in posted[1]
+
+        mp.setattr(PyCSWDist, "run", lambda self: (True, "single"))
+        assert PyCSWDist.run_batch([newDist("no.test:1")]) == [(True, "single")]
+
+    # A rejected transaction is sent again one record at a time
+    with monkeypatch.context() as mp:
+        posted.clear()
+        error = (
+            '<ows:ExceptionReport xmlns:ows="http://www.opengis.net/ows">'
+            '<ows:Exception exceptionCode="NoApplicableCode">'
+            '<ows:ExceptionText>Bad record</ows:ExceptionText>'
+            '</ows:Exception></ows:ExceptionReport>'
+        )
+        answers = iter([error, error, response])
+
+        def fakePost(self, url, data=None, **kwargs):
+            posted.append(data)
+            resp = requests.models.Response()
+            resp.status_code = 200
+            resp._content = next(answers).encode("utf-8")
+            return resp
+
+        mp.setattr("dmci.distributors.pycsw_dist.requests.Session.post", fakePost)
+        results = PyCSWDist.run_batch([newDist("no.test:1"), newDist("no.test:2")])
+        assert results == [(False, error), (True, response)]
+        assert [data.count(b"<csw:Insert>") for data in posted] == [2, 1, 1]
+
+    # A transaction that can't be sent fails all records at once
+    with monkeypatch.context() as mp:
+        posted.clear()
+        mp.setattr(
+            "dmci.distributors.pycsw_dist.requests.Session.post", causeException)
+        results = PyCSWDist.run_batch([newDist("no.test:1"), newDist("no.test:2")])
+        assert results == [
+            (False, "http://localhost: service unavailable. Failed to send transaction.")
+        ]*2
+
+# END Test testDistPyCSW_RunBatch
+
+
+@pytest.mark.dist
+def testDistPyCSW_Batched(monkeypatch, filesDir, tmpUUID, tmpConf):
+    """Test sending single jobs through the shared batcher."""
+    tstWorker = Worker("update", None, None)
+    tstWorker._namespace = "no.test"
+    passFile = os.path.join(filesDir, "api", "passing.xml")
+    record = (
+        b'<gmd:MD_Metadata xmlns:gmd="http://www.isotc211.org/2005/gmd" '
+        b'xmlns:gco="http://www.isotc211.org/2005/gco"><gmd:fileIdentifier>'
+        b'<gco:CharacterString>no.test:1</gco:CharacterString>'
+        b'</gmd:fileIdentifier></gmd:MD_Metadata>'
+    )
+    submitted = []
+
+    deleted = []
+
+    class mockBatcher:
+        def submit(self, entry):
+            submitted.append(entry)
+            return True, "Batched insert"
+
+    def mockDelete(self):
+        deleted.append(self._construct_identifier(self._worker._namespace, self._metadata_UUID))
+        return len(deleted) == 1, "Deleted"
+
+    with monkeypatch.context() as mp:
+        mp.setattr(tmpConf, "csw_batch_size", 10)
+        mp.setattr("dmci.distributors.pycsw_dist.get_csw_batcher", lambda conf: mockBatcher())
+        mp.setattr(PyCSWDist, "_translate", lambda *a: record)
+        mp.setattr(PyCSWDist, "_delete", mockDelete)
+
+        tstPyCSW = PyCSWDist("insert", xml_file=passFile, worker=tstWorker)
+        tstPyCSW._conf = tmpConf
+        assert tstPyCSW.run() == (True, "Batched insert")
+        assert submitted[-1] == {"inserts": [("no.test:1", record)]}
+
+        # The delete of an update is sent on its own, and the record is
+        # only inserted if it succeeded
+        tstPyCSW = PyCSWDist("update", xml_file=passFile, worker=tstWorker)
+        tstPyCSW._conf = tmpConf
+        assert tstPyCSW.run() == (True, "Batched update")
+        assert deleted == ["no.test:a1ddaf0f-cae0-4a15-9b37-3468e9cb1a2b"]
+        assert len(submitted) == 2
+
+        assert tstPyCSW.run() == (False, "Deleted")
+        assert len(submitted) == 2
+
+        # Records that can't be translated are not submitted
+        mp.setattr(PyCSWDist, "_translate", lambda *a: b"")
+        tstPyCSW = PyCSWDist("insert", xml_file=passFile, worker=tstWorker)
+        tstPyCSW._conf = tmpConf
+        assert tstPyCSW.run() == (False, "Failed to translate MMD to ISO19139")
+        assert len(submitted) == 2
+
+# END Test testDistPyCSW_Batched
+
+
 @pytest.mark.dist
 def testDistPyCSW_Update(monkeypatch, filesDir, mockXslt, tmpUUID, tmpConf):
     """Test update commands via run()."""
@@ -116,7 +300,7 @@ def testDistPyCSW_Update(monkeypatch, filesDir, mockXslt, tmpUUID, tmpConf):
     with monkeypatch.context() as mp:
         mp.setattr(PyCSWDist, "_translate", lambda *a: b"<xml />")
         mp.setattr(
-            "dmci.distributors.pycsw_dist.requests.post", lambda *a, **k: mockResp
+            "dmci.distributors.pycsw_dist.requests.Session.post", lambda *a, **k: mockResp
         )
         mp.setattr(PyCSWDist, "_get_transaction_status", lambda *a: True)
         tstPyCSW = PyCSWDist("update", xml_file=mockXml)
@@ -130,7 +314,7 @@ def testDistPyCSW_Update(monkeypatch, filesDir, mockXslt, tmpUUID, tmpConf):
     with monkeypatch.context() as mp:
         mp.setattr(PyCSWDist, "_translate", lambda *a: b"<xml />")
         mp.setattr(
-            "dmci.distributors.pycsw_dist.requests.post", lambda *a, **k: mockResp
+            "dmci.distributors.pycsw_dist.requests.Session.post", lambda *a, **k: mockResp
         )
         mp.setattr(PyCSWDist, "_get_transaction_status", lambda *a: False)
         tstPyCSW = PyCSWDist("update", xml_file=mockXml)
@@ -140,9 +324,11 @@ def testDistPyCSW_Update(monkeypatch, filesDir, mockXslt, tmpUUID, tmpConf):
 
     # Update returns False if the http post request fails
     with monkeypatch.context() as mp:
+        mp.setattr(tmpConf, "csw_native_update", False)
+
         # Delete within update fails
         mp.setattr(
-            "dmci.distributors.pycsw_dist.requests.post", causeException)
+            "dmci.distributors.pycsw_dist.requests.Session.post", causeException)
         tstPyCSW = PyCSWDist("update", xml_file=mockXml)
         tstPyCSW._worker = tstWorker
         tstPyCSW._conf = tmpConf
@@ -157,7 +343,7 @@ def testDistPyCSW_Update(monkeypatch, filesDir, mockXslt, tmpUUID, tmpConf):
 
         with mock.patch.object(PyCSWDist, '_delete', new=new_delete):
             mp.setattr(
-                "dmci.distributors.pycsw_dist.requests.post", causeException)
+                "dmci.distributors.pycsw_dist.requests.Session.post", causeException)
             tstPyCSW = PyCSWDist("update", xml_file=mockXml)
             tstPyCSW._worker = tstWorker
             tstPyCSW._conf = tmpConf
@@ -188,6 +374,103 @@ def testDistPyCSW_Update(monkeypatch, filesDir, mockXslt, tmpUUID, tmpConf):
 # END Test testDistPyCSW_Update
 
 
+@pytest.mark.dist
+def testDistPyCSW_NativeUpdate(monkeypatch, filesDir, tmpUUID, tmpConf):
+    """Test updates sent as a single csw:Update transaction."""
+    tstWorker = Worker("update", None, None)
+    tstWorker._file_metadata_id = tmpUUID
+    tstWorker._namespace = "no.test"
+    tstWorker._conf = tmpConf
+
+    mockXml = os.path.join(filesDir, "reference", "mmd_file.xml")
+    rejected = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="no"?>'
+        '<ows:ExceptionReport xmlns:ows="http://www.opengis.net/ows" version="1.2.0">'
+        '<ows:Exception exceptionCode="OperationNotSupported" locator="update">'
+        '<ows:ExceptionText>Update not supported</ows:ExceptionText>'
+        '</ows:Exception>'
+        '</ows:ExceptionReport>'
+    )
+
+    def newDist():
+        tstPyCSW = PyCSWDist("update", xml_file=mockXml)
+        tstPyCSW._worker = tstWorker
+        tstPyCSW._conf = tmpConf
+        return tstPyCSW
+
+    class postResp:
+        status_code = 200
+
+        def __init__(self, text):
+            self.text = text
+
+    with monkeypatch.context() as mp:
+        mp.setattr(pycsw_dist, "_CSW_UPDATE_REJECTED", set())
+        mp.setattr(PyCSWDist, "_translate", lambda *a: b"<xml />")
+
+        # The record is replaced in a single transaction
+        posts = []
+        mp.setattr(
+            "dmci.distributors.pycsw_dist.requests.Session.post",
+            lambda s, url, data=None, **k: posts.append(data) or mockResp
+        )
+        mp.setattr(PyCSWDist, "_get_transaction_status", lambda *a: True)
+        assert newDist().run() == (True, "Mock response")
+        assert len(posts) == 1
+        assert b"<csw:Update><xml /></csw:Update>" in posts[0]
+        assert b"<csw:Delete>" not in posts[0]
+
+        # Any other failed update fails, without falling back
+        posts.clear()
+        mp.setattr(
+            PyCSWDist, "_get_transaction_status", lambda s, key, resp: key != "total_updated"
+        )
+        assert newDist().run() == (False, "Mock response")
+        assert len(posts) == 1
+        assert pycsw_dist._CSW_UPDATE_REJECTED == set()
+
+        # A service that does not support Update falls back to delete
+        # and insert, with the record translated once, and is remembered
+        posts.clear()
+        translated = []
+        mp.setattr(PyCSWDist, "_translate", lambda *a: translated.append(1) or b"<xml />")
+        mp.setattr(
+            "dmci.distributors.pycsw_dist.requests.Session.post",
+            lambda s, url, data=None, **k: posts.append(data) or postResp(rejected)
+        )
+        assert newDist().run() == (True, rejected)
+        assert len(posts) == 3
+        assert b"<csw:Delete>" in posts[1]
+        assert b"<csw:Insert><xml /></csw:Insert>" in posts[2]
+        assert len(translated) == 1
+        assert pycsw_dist._CSW_UPDATE_REJECTED == {"http://localhost"}
+
+        posts.clear()
+        assert newDist().run() == (True, rejected)
+        assert len(posts) == 2
+        assert b"<csw:Update>" not in b"".join(posts)
+
+        # The fallback is not used if the service is unavailable
+        mp.setattr(pycsw_dist, "_CSW_UPDATE_REJECTED", set())
+        mp.setattr("dmci.distributors.pycsw_dist.requests.Session.post", causeException)
+        assert newDist().run() == (
+            False, "http://localhost: service unavailable. Failed to update."
+        )
+
+        # Native updates can be switched off
+        posts.clear()
+        mp.setattr(tmpConf, "csw_native_update", False)
+        mp.setattr(
+            "dmci.distributors.pycsw_dist.requests.Session.post",
+            lambda s, url, data=None, **k: posts.append(data) or mockResp
+        )
+        assert newDist().run() == (True, "Mock response")
+        assert len(posts) == 2
+        assert b"<csw:Update>" not in b"".join(posts)
+
+# END Test testDistPyCSW_NativeUpdate
+
+
 @pytest.mark.dist
 def testDistPyCSW_Delete(monkeypatch, mockXml, tmpUUID, tmpConf):
     """Test delete commands via run()."""
@@ -198,7 +481,7 @@ def testDistPyCSW_Delete(monkeypatch, mockXml, tmpUUID, tmpConf):
     # delete returns True
     with monkeypatch.context() as mp:
         mp.setattr(
-            "dmci.distributors.pycsw_dist.requests.post", lambda *a, **k: mockResp
+            "dmci.distributors.pycsw_dist.requests.Session.post", lambda *a, **k: mockResp
         )
         mp.setattr(PyCSWDist, "_get_transaction_status", lambda *a: True)
         with pytest.raises(ValueError):
@@ -211,7 +494,7 @@ def testDistPyCSW_Delete(monkeypatch, mockXml, tmpUUID, tmpConf):
     # delete returns false
     with monkeypatch.context() as mp:
         mp.setattr(
-            "dmci.distributors.pycsw_dist.requests.post", lambda *a, **k: mockResp
+            "dmci.distributors.pycsw_dist.requests.Session.post", lambda *a, **k: mockResp
         )
         mp.setattr(PyCSWDist, "_get_transaction_status", lambda *a: False)
         mockWorker._namespace = "test.no"
@@ -221,7 +504,7 @@ def testDistPyCSW_Delete(monkeypatch, mockXml, tmpUUID, tmpConf):
     # Delete returns False if http post request fails
     with monkeypatch.context() as mp:
         mp.setattr(
-            "dmci.distributors.pycsw_dist.requests.post", causeException)
+            "dmci.distributors.pycsw_dist.requests.Session.post", causeException)
         tstPyCSW = PyCSWDist("delete", metadata_UUID=tmpUUID, worker=mockWorker)
         tstPyCSW._conf = tmpConf
         assert tstPyCSW.run() == (False,
@@ -277,9 +560,89 @@ def testDistPyCSW_Translate_Parent(filesDir):
     assert isinstance(result, bytes)
     assert result == outData
 
+    # The stylesheet gets the parent status, not the parent list file
+    xml_doc = tstPyCSW._get_doc().xml_doc
+    assert tstPyCSW._parent_list_url(xml_doc) == (
+        "dmci-parent-list:test.no%3A64db6102-14ce-41e9-b93b-61dbb2cb8b4e"
+    )
+    tstPyCSW = PyCSWDist("insert", xml_file=passFile)
+    assert tstPyCSW._parent_list_url(xml_doc) == ""
+    assert b'codeListValue="series"' not in tstPyCSW._translate()
+
+    nonParent = os.path.join(filesDir, "api", "passing.xml")
+    tstPyCSW = PyCSWDist("insert", xml_file=nonParent, path_to_parent_list=path_to_parent_list)
+    xml_doc = tstPyCSW._get_doc().xml_doc
+    assert tstPyCSW._parent_list_url(xml_doc) == "dmci-parent-list:"
+
 # END Test testDistPyCSW_Translate_Parent
 
 
+@pytest.mark.dist
+def testDistPyCSW_XSLTCache(filesDir, fncDir):
+    """get_xslt_transform tests"""
+    xslFile = os.path.join(fncDir, "mmd-to-geonorge.xsl")
+    shutil.copy2(os.path.join(filesDir, "mmd", "mmd-to-geonorge.xsl"), xslFile)
+
+    def hits():
+        return REGISTRY.get_sample_value("xslt_cache_hits_total")
+
+    def misses():
+        return REGISTRY.get_sample_value("xslt_cache_misses_total")
+
+    # First call compiles the stylesheet
+    nHits, nMisses = hits(), misses()
+    transform = get_xslt_transform(xslFile)
+    assert isinstance(transform, etree.XSLT)
+    assert (hits(), misses()) == (nHits, nMisses + 1)
+
+    # Second call reuses it
+    assert get_xslt_transform(xslFile) is transform
+    assert (hits(), misses()) == (nHits + 1, nMisses + 1)
+
+    # A modified stylesheet is compiled again
+    stat = os.stat(xslFile)
+    os.utime(xslFile, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+    assert get_xslt_transform(xslFile) is not transform
+    assert (hits(), misses()) == (nHits + 1, nMisses + 2)
+
+    # A missing stylesheet raises an error
+    with pytest.raises(OSError):
+        get_xslt_transform(os.path.join(fncDir, "not_a_file.xsl"))
+
+# END Test testDistPyCSW_XSLTCache
+
+
+@pytest.mark.dist
+def testDistPyCSW_Session(monkeypatch, mockXml):
+    """get_csw_session tests"""
+    tstPyCSW = PyCSWDist("insert", xml_file=mockXml)
+
+    # The session is shared between instances
+    session = get_csw_session(tstPyCSW._conf)
+    assert isinstance(session, requests.Session)
+    assert get_csw_session(PyCSWDist("delete", xml_file=mockXml)._conf) is session
+    assert session.get_adapter("https://localhost")._pool_maxsize == tstPyCSW._conf.csw_pool_size
+
+    # A new process gets a new session
+    with monkeypatch.context() as mp:
+        mp.setattr("dmci.distributors.pycsw_dist.os.getpid", lambda: -1)
+        assert get_csw_session(tstPyCSW._conf) is not session
+
+    # The timeouts are passed on with the request
+    calls = []
+    with monkeypatch.context() as mp:
+        mp.setattr(tstPyCSW._conf, "csw_connect_timeout", 2)
+        mp.setattr(tstPyCSW._conf, "csw_read_timeout", 30)
+        mp.setattr(
+            "dmci.distributors.pycsw_dist.requests.Session.post",
+            lambda *a, **k: calls.append(k) or mockResp
+        )
+        tstPyCSW._post_request({}, b"", "insert", "total_inserted")
+        assert calls[0]["timeout"] == (2, 30)
+
+# END Test testDistPyCSW_Session
+
+
 @pytest.mark.dist
 def testDistPyCSW_GetTransactionStatus(monkeypatch, mockXml, caplog):
     """_get_transaction_status tests"""
@@ -502,4 +865,29 @@ def testDistPyCSW_ReadResponse(mockXml, caplog):
     assert PyCSWDist("insert", xml_file=mockXml)._read_response_text(key, text) is False
     assert "Could not parse response XML from PyCSW" in caplog.messages
 
+    # The summary holds the totals of all operations
+    text = (
+        '<csw:TransactionResponse xmlns:csw="http://www.opengis.net/cat/csw/2.0.2" '
+        'xmlns:dc="http://purl.org/dc/elements/1.1/">'
+        '<csw:TransactionSummary>'
+        '<csw:totalInserted>2</csw:totalInserted>'
+        '<csw:totalUpdated>0</csw:totalUpdated>'
+        '<csw:totalDeleted>3</csw:totalDeleted>'
+        '</csw:TransactionSummary>'
+        '<csw:InsertResult>'
+        '<csw:BriefRecord><dc:identifier>no.test:1</dc:identifier></csw:BriefRecord>'
+        '<csw:BriefRecord><dc:identifier>no.test:2</dc:identifier></csw:BriefRecord>'
+        '</csw:InsertResult>'
+        '</csw:TransactionResponse>'
+    )
+    assert PyCSWDist._read_transaction_summary(text) == {
+        "total_inserted": 2,
+        "total_updated": 0,
+        "total_deleted": 3,
+        "identifiers": {"no.test:1", "no.test:2"},
+        "error": None,
+        "error_code": None,
+    }
+    assert PyCSWDist._read_transaction_summary("<xml")["error"] is not None
+
 # END Test testDistPyCSW_ReadResponse
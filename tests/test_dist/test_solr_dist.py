@@ -18,10 +18,13 @@ limitations under the License.
 """
 import pytest
 import uuid
+import requests
+from prometheus_client import REGISTRY
 from tools import causeException
 
 from dmci.distributors import SolRDist
 from dmci.distributors.distributor import DistCmd
+from dmci.distributors.solr_dist import get_solr_client, reset_solr_client, send_solr_docs
 
 
 class MockIndexMMD:
@@ -80,6 +83,14 @@ class mockWorker:
     _namespace = ""
 
 
+@pytest.fixture(autouse=True)
+def resetSolRClient():
+    """Make sure each test gets a client from its own mocks."""
+    reset_solr_client()
+    yield
+    reset_solr_client()
+
+
 @pytest.mark.dist
 def testDistSolR_Init(tmpUUID, solr_ping_ok):
     """Test the SolRDist class init."""
@@ -325,3 +336,189 @@ def testDistSolR_Delete(monkeypatch, mockXml, solr_ping_ok):
         mockWorker._namespace = "no.test"
         res = SolRDist("delete", metadata_UUID=md_uuid, worker=mockWorker).run()
         assert res == ("Mock Response", "no.test:250ba38f-1081-4669-a429-f378c569db32")
+
+
+@pytest.mark.dist
+def testDistSolR_SharedClient(mockXml, monkeypatch):
+    """Test that the SolR client is shared, and recreated after a
+    connection error.
+    """
+    def count(name):
+        return REGISTRY.get_sample_value(name)
+
+    def connectionError(*a, **k):
+        try:
+            raise requests.exceptions.ConnectionError("Connection refused")
+        except Exception:
+            raise RuntimeError("Failed to connect to server")
+
+    with monkeypatch.context() as mp:
+        mp.setattr("dmci.distributors.solr_dist.IndexMMD",
+                   lambda *args, **kwargs: MockIndexMMD(*args, **kwargs))
+
+        # The client is not created until it is used
+        nCreated = count("solr_client_created_total")
+        nReused = count("solr_client_reused_total")
+        tstDist = SolRDist("insert", xml_file=mockXml)
+        assert count("solr_client_created_total") == nCreated
+
+        # The client is shared between instances
+        client = tstDist.mysolr
+        assert isinstance(client, MockIndexMMD)
+        assert SolRDist("update", xml_file=mockXml).mysolr is client
+        assert count("solr_client_created_total") == nCreated + 1
+        assert count("solr_client_reused_total") == nReused + 1
+
+        # A new client is created if the settings change
+        mp.setattr(tstDist._conf, "solr_service_url", "http://otherhost")
+        assert get_solr_client(tstDist._conf) is not client
+        client = get_solr_client(tstDist._conf)
+
+        # Other errors keep the client
+        nResets = count("solr_client_resets_total")
+        mp.setattr(MockIndexMMD, "index_record", causeException)
+        assert tstDist._index_record({"metadata_identifier": "test"})[0] is False
+        assert get_solr_client(tstDist._conf) is client
+        assert count("solr_client_resets_total") == nResets
+
+        # Connection errors drop the client
+        mp.setattr(MockIndexMMD, "index_record", connectionError)
+        assert tstDist._index_record({"metadata_identifier": "test"})[0] is False
+        assert get_solr_client(tstDist._conf) is not client
+        assert count("solr_client_resets_total") == nResets + 1
+
+    # Failing to connect fails the job
+    with monkeypatch.context() as mp:
+        reset_solr_client()
+        mp.setattr("dmci.distributors.solr_dist.IndexMMD", causeException)
+        assert SolRDist("insert", xml_file=mockXml).run() == (
+            False, "Failed to connect to SolR: Test Exception"
+        )
+
+
+@pytest.mark.dist
+def testDistSolR_RunBatch(mockXml, monkeypatch, tmpUUID):
+    """Test indexing a batch of documents in one add request."""
+    class MockSolr:
+        added = []
+
+        def add(self, docs, **kwargs):
+            MockSolr.added.append(list(docs))
+
+    class MockBatchIndexMMD(MockIndexMMD):
+        def __init__(self, *args, **kwargs):
+            self.solrc = MockSolr()
+
+        def index_record(self, newdoc, **kwargs):
+            self.solrc.add([newdoc])
+            return True, "Record successfully added."
+
+    with monkeypatch.context() as mp:
+        mp.setattr("dmci.distributors.solr_dist.MMD4SolR",
+                   lambda *args, **kwargs: MockMMD4SolR(*args, **kwargs))
+        mp.setattr("dmci.distributors.solr_dist.IndexMMD",
+                   lambda *args, **kwargs: MockBatchIndexMMD(*args, **kwargs))
+
+        dists = [SolRDist("insert", xml_file=mockXml) for _ in range(3)]
+        assert SolRDist.run_batch(dists) == [(True, "Record successfully added.")]*3
+        assert len(MockSolr.added) == 1
+        assert len(MockSolr.added[0]) == 3
+        assert all(dist._batch_client is None for dist in dists)
+
+        # Documents that fail their checks are left out of the batch
+        MockSolr.added.clear()
+        fails = iter([True, False])
+        mp.setattr(MockBatchIndexMMD, "get_dataset",
+                   lambda *a: None if next(fails) else {"doc": None})
+        dists = [SolRDist("insert", xml_file=mockXml) for _ in range(2)]
+        results = SolRDist.run_batch(dists)
+        assert results[0] == (False, "Failed to insert dataset in SolR.")
+        assert results[1] == (True, "Record successfully added.")
+        assert len(MockSolr.added[0]) == 1
+
+        # A failed add fails all documents that also fail on their own
+        mp.setattr(MockBatchIndexMMD, "get_dataset", lambda *a: {"doc": None})
+        mp.setattr(MockSolr, "add", causeException)
+        dists = [SolRDist("insert", xml_file=mockXml) for _ in range(2)]
+        assert SolRDist.run_batch(dists) == [
+            (False, "Could not add documents to SolR. Reason: Test Exception")
+        ]*2
+
+        # Deletes are run one by one
+        mp.setattr(SolRDist, "run", lambda self: (True, "single"))
+        dists = [SolRDist("delete", metadata_UUID=tmpUUID), SolRDist("insert", xml_file=mockXml)]
+        assert SolRDist.run_batch(dists) == [(True, "single"), (True, "single")]
+
+
+@pytest.mark.dist
+def testDistSolR_SendDocs(mockXml, monkeypatch, tmpConf):
+    """Test sending documents with the commit policy, and through the
+    shared batcher.
+    """
+    class MockSolr:
+        added = []
+
+        def add(self, docs, **kwargs):
+            if any(doc.get("bad") for doc in docs):
+                raise ValueError("Bad document")
+            MockSolr.added.append((list(docs), kwargs))
+
+    class MockBatchIndexMMD(MockIndexMMD):
+        def __init__(self, *args, **kwargs):
+            self.solrc = MockSolr()
+
+        def index_record(self, newdoc, **kwargs):
+            self.solrc.add([newdoc])
+            return True, "Record successfully added."
+
+    with monkeypatch.context() as mp:
+        mp.setattr("dmci.distributors.solr_dist.MMD4SolR",
+                   lambda *args, **kwargs: MockMMD4SolR(*args, **kwargs))
+        mp.setattr("dmci.distributors.solr_dist.IndexMMD",
+                   lambda *args, **kwargs: MockBatchIndexMMD(*args, **kwargs))
+
+        # Commits are left to SolR by default
+        assert send_solr_docs(tmpConf, [[{"id": "a"}], [{"id": "b"}]]) == [
+            (True, "Added 1 documents to SolR")
+        ]*2
+        assert MockSolr.added == [([{"id": "a"}, {"id": "b"}], {})]
+
+        # The commit policy is passed on
+        MockSolr.added.clear()
+        mp.setattr(tmpConf, "solr_commit_within", 1000)
+        mp.setattr(tmpConf, "solr_soft_commit", True)
+        send_solr_docs(tmpConf, [[{"id": "a"}]])
+        assert MockSolr.added == [
+            ([{"id": "a"}], {"commitWithin": 1000, "softCommit": True})
+        ]
+
+        # A rejected batch is sent again one request at a time
+        MockSolr.added.clear()
+        assert send_solr_docs(tmpConf, [[{"id": "a", "bad": True}], [{"id": "b"}]]) == [
+            (False, "Could not add documents to SolR. Reason: Bad document"),
+            (True, "Added 1 documents to SolR"),
+        ]
+        assert MockSolr.added == [([{"id": "b"}], {"commitWithin": 1000, "softCommit": True})]
+
+        # A single job sends its own document
+        MockSolr.added.clear()
+        tstDist = SolRDist("insert", xml_file=mockXml)
+        tstDist._conf = tmpConf
+        assert tstDist.run() == (True, "Record successfully added.")
+        assert len(MockSolr.added) == 1
+
+        # With batching, the documents go through the shared batcher
+        submitted = []
+
+        class mockBatcher:
+            def submit(self, docs):
+                submitted.append(docs)
+                return False, "Batch failed"
+
+        mp.setattr(tmpConf, "solr_batch_size", 10)
+        mp.setattr("dmci.distributors.solr_dist.get_solr_batcher", lambda conf: mockBatcher())
+        tstDist = SolRDist("insert", xml_file=mockXml)
+        tstDist._conf = tmpConf
+        assert tstDist.run() == (False, "Batch failed")
+        assert submitted[0][0]["id"] == "no-test-250ba38f-1081-4669-a429-f378c569db32"
+        assert len(MockSolr.added) == 1
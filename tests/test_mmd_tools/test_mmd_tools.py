@@ -18,14 +18,25 @@ limitations under the License.
 """
 
 import os
+import time
 import pytest
+import shutil
+import threading
 
 from lxml import etree
 from metvocab import CFStandard, MMDVocab
 
-from tools import causeOSError
+from tools import causeException, causeOSError
 
-from dmci.tools import CheckMMD
+from dmci.tools import (
+    CheckMMD, MMDDocument, MMDRecord, ParentList, RequestBatcher, SchemaPool, VocabRegistry
+)
+from dmci.tools.check_mmd import _check_url
+from dmci.tools.file_records import (
+    RecordLock, read_json_record, write_atomic, write_json_record
+)
+from dmci.tools.parent_list import get_parent_list
+from dmci.tools.vocab_registry import VOCAB_REGISTRY
 
 
 @pytest.mark.tools
@@ -249,6 +260,34 @@ def testMMDTools_CheckURLs():
     assert ok is False
     assert err == ["URL contains non-ASCII characters.", "URL cannot be parsed by urllib."]
 
+    # Unhashable input is checked without the cache
+    ok, err = chkMMD.check_url(["https://www.met.no/"])
+    assert ok is False
+    assert err == ["URL contains non-ASCII characters.", "URL cannot be parsed by urllib."]
+
+    # Results are cached, and duplicate URLs in a document are checked once
+    _check_url.cache_clear()
+    assert chkMMD.check_url("https://www.met.no/")[0] is True
+    assert chkMMD.check_url("https://www.met.no/")[0] is True
+    assert _check_url.cache_info().hits == 1
+
+    chkMMD.clear()
+    assert chkMMD.full_check(etree.ElementTree(etree.XML(
+        "<root>"
+        "  <resource>https://www.met.no/</resource>"
+        "  <resource>https://www.mæt.no/</resource>"
+        "  <resource>https://www.mæt.no/</resource>"
+        "</root>"
+    ))) is False
+    ok, passed, failed = chkMMD.status()
+    assert passed == ["Passed: URL Check on 1 URL(s)"]
+    assert failed[:2] == [
+        "Failed: URL Check on 'https://www.mæt.no/'",
+        " - URL contains non-ASCII characters.",
+    ]
+    assert failed.count("Failed: URL Check on 'https://www.mæt.no/'") == 1
+    assert _check_url.cache_info().hits == 2
+
 # END Test testMMDTools_CheckURLs
 
 
@@ -362,24 +401,11 @@ def testMMDTools_FullCheck(filesDir):
     ok, passed, failed = chkMMD.status()
     assert ok is True
     assert failed == []
-    assert "\n".join(passed) == (
-        "Passed: URL Check on 'https://gcmdservices.gsfc.nasa.gov/static/kms/'\n"
-        "Passed: URL Check on 'http://inspire.ec.europa.eu/theme'\n"
-        "Passed: URL Check on 'https://register.geonorge.no/subregister/metadata-kodelister/kartve"
-        "rket/nasjonal-temainndeling'\n"
-        "Passed: URL Check on 'http://spdx.org/licenses/CC-BY-4.0'\n"
-        "Passed: URL Check on 'https://thredds.met.no/thredds/dodsC/remotesensingsatellite/polar-s"
-        "wath/2021/04/29/aqua-modis-1km-20210429002844-20210429003955.nc'\n"
-        "Passed: URL Check on 'https://thredds.met.no/thredds/wms/remotesensingsatellite/polar-swa"
-        "th/2021/04/29/aqua-modis-1km-20210429002844-20210429003955.nc?service=WMS&version=1.3.0&r"
-        "equest=GetCapabilities'\n"
-        "Passed: URL Check on 'https://thredds.met.no/thredds/fileServer/remotesensingsatellite/po"
-        "lar-swath/2021/04/29/aqua-modis-1km-20210429002844-20210429003955.nc'\n"
-        "Passed: URL Check on 'https://www.wmo-sat.info/oscar/satellites/view/aqua'\n"
-        "Passed: URL Check on 'https://www.wmo-sat.info/oscar/instruments/view/modis'\n"
-        "Passed: Rectangle Check\n"
-        "Passed: Controlled Vocabularies Check\n"
-    ).rstrip()
+    assert passed == [
+        "Passed: URL Check on 9 URL(s)",
+        "Passed: Rectangle Check",
+        "Passed: Controlled Vocabularies Check",
+    ]
 
     # Full check with no elements to check
     assert chkMMD.full_check(etree.ElementTree(etree.XML("<xml />"))) is True
@@ -423,3 +449,391 @@ def testMMDTools_FullCheck(filesDir):
     ).rstrip()
 
 # END Test testMMDTools_FullCheck
+
+
+@pytest.mark.tools
+def testMMDTools_VocabRegistry(monkeypatch):
+    """Test the shared vocabulary registry."""
+    # CheckMMD objects borrow the shared vocabularies
+    chkA = CheckMMD()
+    chkB = CheckMMD()
+    assert VOCAB_REGISTRY.is_loaded()
+    assert chkA._cf_standard is chkB._cf_standard
+    assert chkA._use_constraint is chkB._use_constraint
+
+    # A registry is only loaded once while it has not expired
+    tstReg = VocabRegistry(ttl=3600)
+    assert tstReg.is_loaded() is False
+    vocabs = tstReg.get()
+    assert tstReg.is_loaded() is True
+    assert tstReg.get() is vocabs
+    assert set(vocabs.keys()) == {
+        "cf_standard", "access_constraint", "activity_type",
+        "operational_status", "use_constraint",
+    }
+
+    # An explicit refresh replaces the vocabularies
+    assert tstReg.refresh() is True
+    assert tstReg.get() is not vocabs
+
+    # Expired vocabularies are reloaded on next use
+    vocabs = tstReg.get()
+    tstReg._loaded_at -= 7200
+    assert tstReg.get() is not vocabs
+
+    # A failing refresh keeps the previous vocabularies
+    vocabs = tstReg.get()
+    with monkeypatch.context() as mp:
+        mp.setattr(CFStandard, "init_vocab", causeOSError)
+        assert tstReg.refresh() is False
+        assert tstReg.get() is vocabs
+
+    # It is tried again after the retry interval, not after the TTL
+    assert tstReg.get() is vocabs
+    tstReg._retry_at -= VocabRegistry.RETRY_INTERVAL
+    assert tstReg.get() is not vocabs
+    assert tstReg._retry_at is None
+
+    # An initial load with uninitialised vocabularies is also retried
+    tstReg = VocabRegistry(ttl=3600)
+    with monkeypatch.context() as mp:
+        mp.setattr(MMDVocab, "init_vocab", lambda *a: None)
+        vocabs = tstReg.get()
+        assert vocabs["activity_type"].is_initialised is False
+        assert tstReg._loaded_at is None
+        assert tstReg.get() is vocabs
+    tstReg._retry_at -= VocabRegistry.RETRY_INTERVAL
+    vocabs = tstReg.get()
+    assert vocabs["activity_type"].is_initialised is True
+    assert tstReg._loaded_at is not None
+
+    # A failing initial load is raised to the caller
+    tstReg = VocabRegistry()
+    with monkeypatch.context() as mp:
+        mp.setattr(MMDVocab, "init_vocab", causeOSError)
+        with pytest.raises(OSError):
+            tstReg.get()
+    assert tstReg.is_loaded() is False
+
+    # CheckMMD can be given a specific set of vocabularies
+    assert CheckMMD(vocabs=vocabs)._cf_standard is vocabs["cf_standard"]
+
+# END Test testMMDTools_VocabRegistry
+
+
+@pytest.mark.tools
+def testMMDTools_MMDDocument(mockXml):
+    """Test the MMDDocument class."""
+    with pytest.raises(TypeError):
+        MMDDocument("<xml />")
+    with pytest.raises(etree.XMLSyntaxError):
+        MMDDocument(b"<xml>")
+
+    # The data is parsed once
+    tstDoc = MMDDocument(b"<root><a>1</a></root>")
+    xmlDoc = tstDoc.xml_doc
+    assert tstDoc.xml_doc is xmlDoc
+    assert tstDoc.data == b"<root><a>1</a></root>"
+    assert tstDoc.is_modified() is False
+
+    # Setting identical data does not invalidate the tree
+    tstDoc.set_data(b"<root><a>1</a></root>")
+    assert tstDoc.xml_doc is xmlDoc
+    assert tstDoc.is_modified() is False
+
+    # New data is parsed on next access to the tree
+    tstDoc.set_data(b"<root><a>2</a></root>")
+    assert tstDoc.is_modified() is True
+    assert tstDoc.xml_doc is not xmlDoc
+    assert tstDoc.xml_doc.findtext("a") == "2"
+
+    # A changed tree is serialised on next access to the data
+    tstDoc = MMDDocument(b"<root><a>1</a></root>\n")
+    tstDoc.xml_doc.find("a").text = "3"
+    tstDoc.tree_changed()
+    assert tstDoc.is_modified() is True
+    assert tstDoc.data == b"<root><a>3</a></root>\n"
+
+    # The XML declaration and trailing whitespace are kept as they are
+    tstData = b'<?xml version="1.0" encoding="UTF-8"?>\n<root>\xc3\xb8</root>\n'
+    tstDoc = MMDDocument(tstData)
+    tstDoc.tree_changed()
+    assert tstDoc.data == tstData
+
+    tstData = b"<?xml version='1.0' encoding='ISO-8859-1'?>\r\n<root>\xf8</root>"
+    tstDoc = MMDDocument(tstData)
+    tstDoc.tree_changed()
+    assert tstDoc.data == tstData
+
+    tstDoc = MMDDocument(b"<root><a>1</a></root>")
+    tstDoc.tree_changed()
+    assert tstDoc.data == b"<root><a>1</a></root>"
+
+    tstDoc.set_data(b'<?xml version="1.0"?>\n<root><a>2</a></root>\n\n')
+    tstDoc.xml_doc.find("a").text = "4"
+    tstDoc.tree_changed()
+    assert tstDoc.data == b'<?xml version="1.0"?>\n<root><a>4</a></root>\n\n'
+
+    # Read from file, the bytes are only read when requested
+    tstDoc = MMDDocument.from_file(mockXml)
+    assert tstDoc._data is None
+    assert tstDoc.xml_doc is not None
+    with open(mockXml, mode="rb") as inFile:
+        assert tstDoc.data == inFile.read()
+
+    # A changed document read from file is serialised, and is equal to
+    # the file if nothing was changed
+    tstDoc = MMDDocument.from_file(mockXml)
+    tstDoc.tree_changed()
+    with open(mockXml, mode="rb") as inFile:
+        assert tstDoc.data == inFile.read()
+
+    # The record is extracted once, until the document is changed
+    tstDoc = MMDDocument(b"<root><title>A</title></root>")
+    record = tstDoc.record
+    assert record.title == "A"
+    assert tstDoc.record is record
+    tstDoc.xml_doc.find("title").text = "B"
+    tstDoc.tree_changed()
+    assert tstDoc.record.title == "B"
+    tstDoc.set_data(b"<root><title>C</title></root>")
+    assert tstDoc.record.title == "C"
+
+# END Test testMMDTools_MMDDocument
+
+
+@pytest.mark.tools
+def testMMDTools_MMDRecord(filesDir):
+    """Test extracting the record of a document."""
+    passFile = os.path.join(filesDir, "api", "passing.xml")
+    passTree = etree.parse(passFile)
+
+    record = MMDRecord.from_xml(passTree)
+    assert MMDRecord.of(record) is record
+    assert record.title == "Direct Broadcast data processed in satellite swath to L1C"
+    assert record.metadata_identifier == "test.no:a1ddaf0f-cae0-4a15-9b37-3468e9cb1a2b"
+    assert [elem.text for elem in record.parents] == [
+        "test.no:64db6102-14ce-41e9-b93b-61dbb2cb8b4e"
+    ]
+    assert len(record.rectangles) == 1
+    assert record.resources == [elem.text for elem in passTree.findall(".//{*}resource")]
+    assert record.cf_keywords == []
+    assert record.vocabularies == {
+        "access_constraint": [],
+        "activity_type": ["Space Borne Instrument"],
+        "operational_status": ["Operational"],
+        "use_constraint": ["CC-BY-4.0"],
+    }
+
+    # Only the first title and identifier are used, and comments are
+    # skipped
+    record = MMDRecord.of(etree.XML(
+        "<root>"
+        "  <!-- comment -->"
+        "  <title>First</title>"
+        "  <title>Second</title>"
+        "  <metadata_identifier>no.test:1</metadata_identifier>"
+        "  <metadata_identifier>no.test:2</metadata_identifier>"
+        "  <related_dataset relation_type='auxiliary'>no.test:3</related_dataset>"
+        "  <keywords vocabulary='Climate and Forecast Standard Names'>"
+        "    <keyword>sea_surface_temperature</keyword>"
+        "  </keywords>"
+        "  <keywords vocabulary='Other'><keyword>other</keyword></keywords>"
+        "</root>"
+    ))
+    assert record.title == "First"
+    assert record.metadata_identifier == "no.test:1"
+    assert record.parents == []
+    assert record.resources == []
+    assert record.cf_keywords == [["sea_surface_temperature"]]
+
+# END Test testMMDTools_MMDRecord
+
+
+@pytest.mark.tools
+def testMMDTools_RequestBatcher():
+    """Test collecting items into batches."""
+    sent = []
+
+    def send(items):
+        sent.append(list(items))
+        return [(True, "ok %s" % item) for item in items]
+
+    # A full batch is sent at once
+    batcher = RequestBatcher(send, 1, 10.0)
+    assert batcher.submit("a") == (True, "ok a")
+    assert sent == [["a"]]
+
+    # Items from several threads share a batch
+    sent.clear()
+    batcher = RequestBatcher(send, 3, 10.0)
+    results = [None]*3
+
+    def submit(idx):
+        results[idx] = batcher.submit(idx)
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(sent) == 1
+    assert sorted(sent[0]) == [0, 1, 2]
+    assert results == [(True, "ok 0"), (True, "ok 1"), (True, "ok 2")]
+
+    # A batch that does not fill up is sent after the wait time
+    sent.clear()
+    batcher = RequestBatcher(send, 10, 0.05)
+    start = time.monotonic()
+    assert batcher.submit("b") == (True, "ok b")
+    assert time.monotonic() - start >= 0.05
+    assert sent == [["b"]]
+
+    # A failed send fails all items
+    batcher = RequestBatcher(causeException, 1, 10.0)
+    assert batcher.submit("c") == (False, "Internal error")
+
+    # An item that gets no result in time fails
+    batcher = RequestBatcher(send, 10, 10.0, timeout=0.05)
+    assert batcher.submit("d") == (False, "No result from the batch after 0.05 seconds")
+
+# END Test testMMDTools_RequestBatcher
+
+
+@pytest.mark.tools
+def testMMDTools_SchemaPool(filesDir):
+    """Test that each thread gets its own compiled schema."""
+    xsdFile = os.path.join(filesDir, "mmd", "mmd.xsd")
+    passFile = os.path.join(filesDir, "api", "passing.xml")
+    failFile = os.path.join(filesDir, "api", "failing.xml")
+
+    with pytest.raises(etree.XMLSchemaParseError):
+        SchemaPool(os.path.join(filesDir, "mock", "mock.xml"))
+    with pytest.raises(OSError):
+        SchemaPool(os.path.join(filesDir, "not_a_file.xsd"))
+
+    # The first schema is compiled when the pool is created, and then
+    # reused by the same thread
+    tstPool = SchemaPool(xsdFile)
+    assert len(tstPool) == 1
+    schema = tstPool.get()
+    assert isinstance(schema, etree.XMLSchema)
+    assert tstPool.get() is schema
+
+    passDoc = etree.parse(passFile)
+    failDoc = etree.parse(failFile)
+    assert tstPool.validate(passDoc) is True
+    assert len(tstPool.error_log) == 0
+
+    # Other threads get their own schema and error log
+    results = {}
+
+    def validate(name, doc):
+        results[name] = (tstPool.get(), tstPool.validate(doc), len(tstPool.error_log))
+
+    threads = [
+        threading.Thread(target=validate, args=("fail", failDoc)),
+        threading.Thread(target=validate, args=("pass", passDoc)),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(tstPool) == 3
+    assert results["fail"][0] is not schema
+    assert results["fail"][0] is not results["pass"][0]
+    assert results["fail"][1] is False
+    assert results["fail"][2] > 0
+    assert results["pass"][1:] == (True, 0)
+
+    # The error log of this thread is not touched
+    assert len(tstPool.error_log) == 0
+
+# END Test testMMDTools_SchemaPool
+
+
+@pytest.mark.tools
+def testMMDTools_ParentList(filesDir, fncDir):
+    """Test loading and reloading the parent list."""
+    listFile = os.path.join(fncDir, "parent-uuid-list.xml")
+    shutil.copy2(os.path.join(filesDir, "mmd", "parent-uuid-list.xml"), listFile)
+    parentId = "test.no:64db6102-14ce-41e9-b93b-61dbb2cb8b4e"
+    newId = "test.no:3f289fcc-022b-4b62-bbbb-b001304a6e09"
+
+    assert get_parent_list(os.path.join(fncDir, "not_a_file.xml")) is None
+
+    # The list is loaded once per path
+    tstList = get_parent_list(listFile)
+    assert isinstance(tstList, ParentList)
+    assert get_parent_list(listFile) is tstList
+    assert len(tstList) == 9
+    assert tstList.is_parent(parentId) is True
+    assert tstList.is_parent(newId) is False
+
+    # The file is read again when it changes
+    with open(listFile, mode="w") as outfile:
+        outfile.write("<parent><id>%s</id></parent>" % newId)
+    stat = os.stat(listFile)
+    os.utime(listFile, (stat.st_atime, stat.st_mtime + 10))
+    assert tstList.is_parent(newId) is True
+    assert tstList.is_parent(parentId) is False
+    assert len(tstList) == 1
+
+    # If the file can't be read, the previous list is kept
+    with open(listFile, mode="w") as outfile:
+        outfile.write("<parent><id>")
+    os.utime(listFile, (stat.st_atime, stat.st_mtime + 20))
+    assert tstList.is_parent(newId) is True
+
+    # A list that was never loaded has no parents
+    assert ParentList(listFile).is_parent(newId) is False
+
+# END Test testMMDTools_ParentList
+
+
+@pytest.mark.tools
+def testMMDTools_FileRecords(fncDir, monkeypatch):
+    """Test the shared file record functions."""
+    recFile = os.path.join(fncDir, "record.json")
+
+    # Records are written in one step, and replace the old record
+    write_json_record(recFile, {"id": "job1"})
+    write_json_record(recFile, {"id": "job2"}, sync=False)
+    assert read_json_record(recFile) == {"id": "job2"}
+    assert os.listdir(fncDir) == ["record.json"]
+
+    write_atomic(recFile, b"bytes")
+    with open(recFile, mode="rb") as infile:
+        assert infile.read() == b"bytes"
+
+    # A failed write keeps the old file and removes the temporary file
+    with monkeypatch.context() as mp:
+        mp.setattr("os.replace", causeOSError)
+        with pytest.raises(OSError):
+            write_atomic(recFile, "text")
+    assert os.listdir(fncDir) == ["record.json"]
+    with open(recFile, mode="rb") as infile:
+        assert infile.read() == b"bytes"
+
+    # Only one lock object can hold a record lock
+    ownLock = RecordLock(recFile)
+    otherLock = RecordLock(recFile)
+    assert ownLock.acquire() is True
+    assert ownLock.acquire() is True
+    assert otherLock.acquire() is False
+    assert os.path.isfile(recFile + ".lock")
+
+    # Releasing removes the lock file
+    ownLock.release()
+    ownLock.release()
+    assert not os.path.isfile(recFile + ".lock")
+    assert otherLock.acquire() is True
+
+    # A lock released by a stopped process can be taken over
+    os.close(otherLock._fd)
+    assert ownLock.acquire() is True
+    assert os.path.isfile(recFile + ".lock")
+    ownLock.release()
+
+# END Test testMMDTools_FileRecords